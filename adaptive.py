@@ -0,0 +1,172 @@
+"""
+Adaptive concurrency: the number of jobs in flight follows Midjourney's load.
+
+`AimdController` raises the limit by one job for every limit's worth of
+grids that arrive in about the usual time while the limit is in use
+(additive increase), and halves it when the bot answers with a throttling
+reply (queue full, concurrent job limit, rate limit) or a grid takes much
+longer than usual (multiplicative decrease). At most one decrease happens
+per cooldown, so one burst of throttling replies counts once. The limit
+stays within the configured bounds.
+
+A grid that arrives in time while fewer jobs than the limit are in flight
+means the pause between submissions is what holds the batch back, so the
+controller shortens it instead (`pacing`, a factor on the job pacing). A
+throttling reply or a slow grid puts the pause back to the configured one.
+
+Every observation is appended to a JSONL metrics file with the limit after
+it, so the way the limit tracked the load can be plotted after a run.
+"""
+
+import json
+import os
+import time
+
+from loguru import logger
+
+from config import Settings
+from logging_setup import log_throttled
+
+
+class AimdController:
+    """
+    Additive-increase, multiplicative-decrease limit on the jobs in flight.
+
+    Attributes:
+    - minimum (int): Lowest limit.
+    - maximum (int): Highest limit.
+    - baseline (float): Running average of the grid latency, in seconds; None before the first grid.
+    - pacing (float): Factor applied to the job pacing, between `min_pacing` and 1.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: int = 12,
+        decrease: float = 0.5,
+        latency_factor: float = 2.0,
+        cooldown: float = 60.0,
+        smoothing: float = 0.1,
+        min_pacing: float = 0.1,
+        pacing_step: float = 0.9,
+        metrics_path: str = None,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.min_pacing = min_pacing
+        self.pacing_step = pacing_step
+        self.metrics_path = metrics_path
+        self.baseline: float = None
+        self.pacing = 1.0
+        self._limit = float(min(max(initial, minimum), maximum))
+        self._last_decrease: float = None
+        if metrics_path:
+            os.makedirs(os.path.dirname(os.path.abspath(metrics_path)), exist_ok=True)
+
+    @property
+    def limit(self) -> int:
+        """Jobs allowed in flight now."""
+        return int(self._limit)
+
+    def on_grid(self, latency: float, in_flight: int = None):
+        """
+        Function to take in the time from submitting a prompt to its grid.
+
+        Parameters:
+        - latency (float): Seconds from the submission to the finished grid.
+        - in_flight (int): Jobs in flight when the grid arrived, this job included.
+
+        Returns:
+        - None
+        """
+        baseline = self.baseline
+        # The average follows lasting changes in load, so a slower but steady
+        # Midjourney stops counting as a spike after a while.
+        self.baseline = (
+            latency
+            if baseline is None
+            else baseline + self.smoothing * (latency - baseline)
+        )
+        if baseline is not None and latency > baseline * self.latency_factor:
+            self._back_off("latency", latency=latency, baseline=baseline, in_flight=in_flight)
+            return
+        previous = self.limit
+        if in_flight is not None and in_flight >= self.limit:
+            # One job more once a whole limit's worth of grids came back in time
+            self._limit = min(self._limit + 1 / max(self._limit, 1), float(self.maximum))
+            if self.limit != previous:
+                logger.info(
+                    f"Concurrency limit raised to {self.limit}: grid in {latency:.0f} s, "
+                    f"usually {self.baseline:.0f} s."
+                )
+        elif self.pacing > self.min_pacing:
+            # The limit is not in use, so the pause between submissions is the bottleneck
+            self.pacing = max(self.pacing * self.pacing_step, self.min_pacing)
+            log_throttled(
+                "adaptive-pacing",
+                f"Job pacing shortened to {self.pacing:.0%} of the configured pause: "
+                f"{in_flight} of {self.limit} jobs in flight.",
+            )
+        self._record("grid", previous, latency=latency, baseline=baseline, in_flight=in_flight)
+
+    def on_throttle(self, text: str, in_flight: int = None):
+        """
+        Function to take in a throttling reply of the bot.
+
+        Parameters:
+        - text (str): The text of the reply, recorded in the metrics.
+        - in_flight (int): Jobs in flight when it arrived, recorded in the metrics.
+
+        Returns:
+        - None
+        """
+        self._back_off("throttle", reply=text[:200], in_flight=in_flight)
+
+    def _back_off(self, reason: str, **details):
+        now = time.monotonic()
+        previous = self.limit
+        self.pacing = 1.0
+        if self._last_decrease is not None and now - self._last_decrease < self.cooldown:
+            self._record(reason, previous, held=True, **details)
+            return
+        self._last_decrease = now
+        self._limit = max(self._limit * self.decrease, float(self.minimum))
+        logger.warning(
+            f"Concurrency limit lowered from {previous} to {self.limit} and job pacing "
+            f"restored ({reason})."
+        )
+        self._record(reason, previous, **details)
+
+    def _record(self, event: str, previous: int, **details):
+        if not self.metrics_path:
+            return
+        row = {
+            "time": time.time(),
+            "event": event,
+            "previous": previous,
+            "limit": self.limit,
+            "pacing": round(self.pacing, 3),
+        }
+        row.update(details)
+        try:
+            with open(self.metrics_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(row) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write the concurrency metrics: {e}")
+
+
+def create_controller(settings: Settings) -> AimdController:
+    """Return the controller the settings ask for, or None for a fixed `concurrency`."""
+    if not settings.adaptive_concurrency:
+        return None
+    return AimdController(
+        settings.concurrency,
+        settings.concurrency_min,
+        settings.concurrency_max,
+        metrics_path=settings.concurrency_metrics or None,
+    )
@@ -0,0 +1,269 @@
+import os
+from dataclasses import dataclass, fields, replace
+
+from dotenv import dotenv_values
+from loguru import logger
+
+from download_profiles import DownloadProfile
+
+ENV_FILE = ".env"
+
+
+class ConfigError(ValueError):
+    """Raised when the settings in the environment or `.env` are invalid."""
+
+
+def _parse_bool(value: str) -> bool:
+    value = value.strip().lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off", ""):
+        return False
+    raise ValueError(f"expected 1/0, true/false or yes/no, got {value!r}")
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Validated bot settings.
+
+    Each field is read from the environment variable named in `ENV_VARS`.
+    Fields listed in `HOT_RELOADABLE` are picked up by a running batch when
+    `.env` changes; the others need a new batch.
+    """
+
+    channel_url: str
+    message_placeholder: str
+    cdp_url: str = "http://localhost:9222"
+    number_of_upscaled_images: int = 1
+    wait_for_upscale_timeout: int = 120
+    wait_for_download_timeout: int = 600
+    job_pacing_min: float = 20
+    job_pacing_max: float = 30
+    output_dir: str = "."
+    output_shard_depth: int = 2
+    fast_submit: bool = False
+    storage_backend: str = "local"
+    s3_bucket: str = ""
+    s3_prefix: str = ""
+    s3_endpoint_url: str = ""
+    s3_region: str = ""
+    download_profile: str = "original"
+    profile_sample_rate: float = 0
+    profile_slow_job_seconds: float = 0
+    profile_trace_dir: str = "traces"
+    profile_trace_max_mb: int = 500
+    concurrency: int = 1
+    workflow: str = "default"
+    grid_preview: str = "off"
+    pack_prompts: int = 0
+    adaptive_concurrency: bool = False
+    concurrency_min: int = 1
+    concurrency_max: int = 12
+    concurrency_metrics: str = "concurrency_metrics.jsonl"
+
+
+ENV_VARS = {
+    "channel_url": "DISCORD_CHANNEL_URL",
+    "message_placeholder": "DISCORD_CHANNEL_MESSAGE_PLACEHOLDER",
+    "cdp_url": "CDP_URL",
+    "number_of_upscaled_images": "NUMBER_OF_UPSCALED_IMAGES",
+    "wait_for_upscale_timeout": "WAIT_FOR_UPSCALE_TIMEOUT",
+    "wait_for_download_timeout": "WAIT_FOR_DOWNLOAD_TIMEOUT",
+    "job_pacing_min": "JOB_PACING_MIN",
+    "job_pacing_max": "JOB_PACING_MAX",
+    "output_dir": "OUTPUT_DIR",
+    "output_shard_depth": "OUTPUT_SHARD_DEPTH",
+    "fast_submit": "FAST_SUBMIT",
+    "storage_backend": "STORAGE_BACKEND",
+    "s3_bucket": "S3_BUCKET",
+    "s3_prefix": "S3_PREFIX",
+    "s3_endpoint_url": "S3_ENDPOINT_URL",
+    "s3_region": "S3_REGION",
+    "download_profile": "DOWNLOAD_PROFILE",
+    "profile_sample_rate": "PROFILE_SAMPLE_RATE",
+    "profile_slow_job_seconds": "PROFILE_SLOW_JOB_SECONDS",
+    "profile_trace_dir": "PROFILE_TRACE_DIR",
+    "profile_trace_max_mb": "PROFILE_TRACE_MAX_MB",
+    "concurrency": "CONCURRENCY",
+    "workflow": "WORKFLOW",
+    "grid_preview": "GRID_PREVIEW",
+    "pack_prompts": "PACK_PROMPTS",
+    "adaptive_concurrency": "ADAPTIVE_CONCURRENCY",
+    "concurrency_min": "CONCURRENCY_MIN",
+    "concurrency_max": "CONCURRENCY_MAX",
+    "concurrency_metrics": "CONCURRENCY_METRICS",
+}
+
+HOT_RELOADABLE = frozenset(
+    {
+        "message_placeholder",
+        "number_of_upscaled_images",
+        "wait_for_upscale_timeout",
+        "wait_for_download_timeout",
+        "job_pacing_min",
+        "job_pacing_max",
+        "output_dir",
+        "output_shard_depth",
+        "fast_submit",
+        "download_profile",
+        "profile_sample_rate",
+        "profile_slow_job_seconds",
+        "profile_trace_dir",
+        "profile_trace_max_mb",
+        "workflow",
+        "grid_preview",
+    }
+)
+
+_PARSERS = {
+    int: int,
+    float: float,
+    bool: _parse_bool,
+    str: str.strip,
+}
+
+
+def validate(settings: Settings) -> list[str]:
+    """
+    Function to check settings for values that would break a batch.
+
+    Parameters:
+    - settings (Settings): The settings to check.
+
+    Returns:
+    - list[str]: One message per problem; empty when the settings are valid.
+    """
+    problems = []
+    if not settings.channel_url.startswith(("http://", "https://")):
+        problems.append("DISCORD_CHANNEL_URL must be an http(s) URL.")
+    if not settings.message_placeholder:
+        problems.append("DISCORD_CHANNEL_MESSAGE_PLACEHOLDER cannot be empty.")
+    if not 1 <= settings.number_of_upscaled_images <= 4:
+        problems.append("NUMBER_OF_UPSCALED_IMAGES must be between 1 and 4.")
+    if settings.wait_for_upscale_timeout <= 0:
+        problems.append("WAIT_FOR_UPSCALE_TIMEOUT must be positive.")
+    if settings.wait_for_download_timeout <= 0:
+        problems.append("WAIT_FOR_DOWNLOAD_TIMEOUT must be positive.")
+    if settings.job_pacing_min < 0 or settings.job_pacing_max < settings.job_pacing_min:
+        problems.append("JOB_PACING_MIN must be >= 0 and <= JOB_PACING_MAX.")
+    if not 0 <= settings.output_shard_depth <= 4:
+        problems.append("OUTPUT_SHARD_DEPTH must be between 0 and 4.")
+    if settings.storage_backend not in ("local", "s3"):
+        problems.append("STORAGE_BACKEND must be 'local' or 's3'.")
+    elif settings.storage_backend == "s3" and not settings.s3_bucket:
+        problems.append("S3_BUCKET is required with STORAGE_BACKEND=s3.")
+    try:
+        DownloadProfile.parse(settings.download_profile)
+    except ValueError as e:
+        problems.append(f"DOWNLOAD_PROFILE: {e}")
+    if not 0 <= settings.profile_sample_rate <= 1:
+        problems.append("PROFILE_SAMPLE_RATE must be between 0 and 1.")
+    if settings.profile_slow_job_seconds < 0:
+        problems.append("PROFILE_SLOW_JOB_SECONDS cannot be negative.")
+    if settings.profile_trace_max_mb <= 0:
+        problems.append("PROFILE_TRACE_MAX_MB must be positive.")
+    if not 1 <= settings.concurrency <= 12:
+        problems.append("CONCURRENCY must be between 1 and 12.")
+    if not settings.workflow:
+        problems.append("WORKFLOW cannot be empty.")
+    if settings.grid_preview not in ("off", "grid", "tiles"):
+        problems.append("GRID_PREVIEW must be 'off', 'grid' or 'tiles'.")
+    if not 0 <= settings.pack_prompts <= 40:
+        problems.append("PACK_PROMPTS must be between 0 (off) and 40.")
+    if not 1 <= settings.concurrency_min <= settings.concurrency_max <= 12:
+        problems.append("CONCURRENCY_MIN and CONCURRENCY_MAX must satisfy 1 <= min <= max <= 12.")
+    return problems
+
+
+def load_settings(env_file: str = ENV_FILE, overrides: dict = None) -> Settings:
+    """
+    Function to read and validate the settings.
+
+    Values in `env_file` take precedence over the process environment, so
+    edits made through the Settings tab are seen without a restart.
+
+    Parameters:
+    - env_file (str): Path of the `.env` file.
+    - overrides (dict): Raw environment values to apply on top, keyed by variable name.
+
+    Returns:
+    - Settings: The settings. `ConfigError` lists every invalid value.
+    """
+    raw = dict(os.environ)
+    if env_file and os.path.exists(env_file):
+        raw.update({k: v for k, v in dotenv_values(env_file).items() if v is not None})
+    raw.update(overrides or {})
+
+    values, problems = {}, []
+    for field in fields(Settings):
+        name = ENV_VARS[field.name]
+        value = raw.get(name)
+        if value is None or (value == "" and field.type is not str):
+            continue
+        try:
+            values[field.name] = _PARSERS[field.type](value)
+        except ValueError as e:
+            problems.append(f"{name}: {e}")
+
+    values.setdefault("channel_url", "")
+    values.setdefault("message_placeholder", "")
+    settings = Settings(**values)
+    problems.extend(validate(settings))
+    if problems:
+        raise ConfigError("Invalid settings:\n- " + "\n- ".join(problems))
+    return settings
+
+
+class SettingsWatcher:
+    """
+    Keeps a running batch in sync with `.env`.
+
+    `poll` is cheap (one `os.stat`) and meant to be called between jobs. When
+    the file changed and still validates, the hot-reloadable fields are
+    applied; changes to other fields are logged and ignored until the next
+    batch. An invalid file is reported and the current settings are kept.
+    """
+
+    def __init__(self, settings: Settings, env_file: str = ENV_FILE):
+        self.settings = settings
+        self.env_file = env_file
+        self._mtime = self._stat()
+
+    def _stat(self) -> float:
+        try:
+            return os.stat(self.env_file).st_mtime
+        except OSError:
+            return None
+
+    def poll(self) -> Settings:
+        """Return the current settings, reloading `.env` if it changed."""
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return self.settings
+        self._mtime = mtime
+
+        try:
+            fresh = load_settings(self.env_file)
+        except ConfigError as e:
+            logger.error(f"Ignoring the updated {self.env_file}: {e}")
+            return self.settings
+
+        changes = {
+            field.name: getattr(fresh, field.name)
+            for field in fields(Settings)
+            if getattr(fresh, field.name) != getattr(self.settings, field.name)
+        }
+        applied = {k: v for k, v in changes.items() if k in HOT_RELOADABLE}
+        ignored = sorted(k for k in changes if k not in HOT_RELOADABLE)
+        if ignored:
+            logger.warning(
+                f"Settings {', '.join(ENV_VARS[k] for k in ignored)} changed; they apply to the next batch."
+            )
+        if applied:
+            logger.info(
+                "Applied updated settings: "
+                + ", ".join(f"{ENV_VARS[k]}={v}" for k, v in applied.items())
+            )
+            self.settings = replace(self.settings, **applied)
+        return self.settings
@@ -0,0 +1,127 @@
+"""
+Pause, skip and cancel for a running batch.
+
+Kept apart from `pipeline` so the UI can create a `BatchControl` without
+importing Playwright.
+"""
+
+import asyncio
+import threading
+import time
+
+from loguru import logger
+
+
+class BatchCancelled(Exception):
+    """Raised inside the batch loop once the operator cancelled the batch."""
+
+
+class JobSkipped(Exception):
+    """Raised inside the batch loop when the operator skipped the current job."""
+
+
+class BatchControl:
+    """
+    Control channel between the thread that owns the UI and the asyncio loop
+    running the batch.
+
+    Every public method is safe to call from any thread. The batch loop polls
+    `checkpoint` between stages and runs each job through `run_job` so the
+    jobs in flight can be interrupted.
+    """
+
+    def __init__(self):
+        self._loop: asyncio.AbstractEventLoop = None
+        self._resumed = threading.Event()
+        self._resumed.set()
+        self._cancelled = threading.Event()
+        # Jobs in flight, oldest first, and the ones the operator skipped.
+        # Only touched on the batch's loop.
+        self._tasks: list[asyncio.Task] = []
+        self._skipped: set[asyncio.Task] = set()
+
+    @property
+    def paused(self) -> bool:
+        return not self._resumed.is_set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def pause(self):
+        """Hold the batch at the next checkpoint."""
+        self._resumed.clear()
+        logger.info("Batch paused.")
+
+    def resume(self):
+        """Continue a paused batch."""
+        self._resumed.set()
+        logger.info("Batch resumed.")
+
+    def skip(self):
+        """Abandon the oldest job in flight; the batch carries on with the others."""
+        logger.info("Skipping the oldest job in flight.")
+        self._on_loop(self._cancel_oldest)
+
+    def cancel(self):
+        """Stop the batch. Files already downloaded are kept."""
+        logger.info("Batch cancelled.")
+        self._cancelled.set()
+        self._resumed.set()
+        self._on_loop(self._cancel_all)
+
+    def _on_loop(self, callback):
+        loop = self._loop
+        if loop and not loop.is_closed():
+            loop.call_soon_threadsafe(callback)
+
+    def _cancel_oldest(self):
+        if self._tasks:
+            self._skipped.add(self._tasks[0])
+            self._tasks[0].cancel()
+
+    def _cancel_all(self):
+        for task in self._tasks:
+            task.cancel()
+
+    async def checkpoint(self):
+        """Wait while paused, then raise `BatchCancelled` if the batch was cancelled."""
+        while not self._resumed.is_set():
+            await asyncio.sleep(0.2)
+        if self._cancelled.is_set():
+            raise BatchCancelled()
+
+    async def sleep(self, seconds: float):
+        """Sleep for `seconds`, waking early when the batch is cancelled."""
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self._cancelled.is_set():
+            await asyncio.sleep(min(0.5, deadline - time.monotonic()))
+        await self.checkpoint()
+
+    async def run_job(self, coro):
+        """
+        Run one job as its own task so `skip` and `cancel` can interrupt it.
+
+        Any other cancellation, such as the batch's own task being cancelled
+        when a worker shuts down, propagates as `asyncio.CancelledError`.
+
+        Raises:
+        - JobSkipped: The operator skipped the job.
+        - BatchCancelled: The operator cancelled the batch.
+        """
+        self._loop = asyncio.get_running_loop()
+        task = asyncio.create_task(coro)
+        self._tasks.append(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+            if task in self._skipped:
+                raise JobSkipped()
+            if self._cancelled.is_set():
+                raise BatchCancelled()
+            raise
+        finally:
+            self._tasks.remove(task)
+            self._skipped.discard(task)
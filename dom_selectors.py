@@ -0,0 +1,211 @@
+"""
+Registry of the CSS selectors used to find Discord elements.
+
+Discord's class names carry a build hash (``messageListItem__5126c``) that
+changes when Discord ships a new client. The selectors live in
+`selectors.json` instead of the code, each logical element with an ordered
+list of fallbacks, so a broken build can be fixed by editing the file. The
+startup self-test probes the live page and picks, per element, the first
+selector that matches.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+from loguru import logger
+
+SELECTORS_FILE = "selectors.json"
+
+ELEMENTS = ("message_item", "image_link", "option_pill", "autocomplete_entry")
+
+# Only used when present; a registry without them still loads
+OPTIONAL_ELEMENTS = ("channel_beginning",)
+
+# Runs in the page. Counts the matches of every candidate selector; an
+# invalid selector counts as -1 instead of aborting the whole probe.
+_PROBE_JS = """
+(candidates) => Object.fromEntries(Object.entries(candidates).map(([name, selectors]) => [
+    name,
+    selectors.map((selector) => {
+        try {
+            return document.querySelectorAll(selector).length;
+        } catch (e) {
+            return -1;
+        }
+    }),
+]))
+"""
+
+
+class SelectorError(RuntimeError):
+    """Raised when no selector of a required element matches the page."""
+
+
+class SelectorRegistry:
+    """
+    Ordered selector candidates per element, and the one picked for each.
+
+    Until an element is resolved, `get` returns all its candidates joined
+    into one selector list, so lookups still work on whichever one matches.
+    """
+
+    def __init__(self, version: int, candidates: dict[str, list[str]], source: str = None):
+        missing = [name for name in ELEMENTS if not candidates.get(name)]
+        if missing:
+            raise SelectorError(
+                f"{source or 'Selector registry'} has no selectors for: {', '.join(missing)}"
+            )
+        self.version = version
+        self.candidates = {
+            name: list(candidates.get(name) or []) for name in ELEMENTS + OPTIONAL_ELEMENTS
+        }
+        self.source = source
+        self.active: dict[str, str] = {}
+
+    @classmethod
+    def load(cls, path: str = None) -> "SelectorRegistry":
+        """
+        Function to read the registry from a JSON file.
+
+        Parameters:
+        - path (str): The file to read. Defaults to `SELECTORS_FILE` env var, then
+          `selectors.json` in the working directory, then next to this module.
+
+        Returns:
+        - SelectorRegistry: The registry.
+        """
+        if path is None:
+            path = os.environ.get("SELECTORS_FILE") or SELECTORS_FILE
+            if not os.path.exists(path):
+                path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SELECTORS_FILE)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("version", 0), data.get("elements", {}), path)
+
+    def get(self, name: str) -> str:
+        """Return the selector to use for element `name`; empty for an optional element without candidates."""
+        if name in self.active:
+            return self.active[name]
+        return ", ".join(self.candidates[name])
+
+    def ordered(self, name: str) -> list[str]:
+        """Return the candidates of `name` to try in order; just the picked one once resolved."""
+        if name in self.active:
+            return [self.active[name]]
+        return list(self.candidates[name])
+
+    def use(self, name: str, selector: str):
+        """Record that `selector` was found to work for element `name`."""
+        if self.active.get(name) == selector:
+            return
+        if selector != self.candidates[name][0]:
+            logger.warning(f"Using fallback selector for {name}: {selector}")
+        self.active[name] = selector
+
+    async def _probe(self, page, names) -> dict[str, list[int]]:
+        return await page.evaluate(_PROBE_JS, {name: self.candidates[name] for name in names})
+
+    def _pick(self, name: str, counts: list[int]) -> str:
+        for selector, count in zip(self.candidates[name], counts):
+            if count > 0:
+                self.use(name, selector)
+                return selector
+        return None
+
+    async def resolve(self, page, name: str) -> str:
+        """
+        Function to pick the first candidate of `name` that matches the page now.
+
+        Parameters:
+        - page: The page object representing the current browser context.
+        - name (str): The element name.
+
+        Returns:
+        - str: The selector picked, or None when no candidate matches.
+        """
+        if name in self.active:
+            return self.active[name]
+        counts = await self._probe(page, [name])
+        return self._pick(name, counts[name])
+
+    async def self_test(
+        self,
+        page,
+        bot_command: str = None,
+        timeout: int = 5000,
+        placeholder: str = None,
+        lock: asyncio.Lock = None,
+    ):
+        """
+        Function to check the selectors against the open channel and pick the working ones.
+
+        Messages and image links are only checked when the channel shows
+        some, so a new, empty channel can still start a batch. With `bot_command`, the command is typed into the
+        chat box to check the autocomplete entry and then cleared; the
+        option pill only appears once a command is chosen, so it is picked
+        on the first submit instead.
+
+        Parameters:
+        - page: The page object representing the current browser context.
+        - bot_command (str): The slash command used by the batch.
+        - timeout (int): Milliseconds to wait for the autocomplete entry.
+        - placeholder (str): Accessible name of the chat box. Defaults to `DISCORD_CHANNEL_MESSAGE_PLACEHOLDER`.
+        - lock (asyncio.Lock): Held while typing, so other batches on the page do not type at the same time.
+
+        Returns:
+        - None. Raises `SelectorError` when a required element has no working selector.
+        """
+        started = time.monotonic()
+        counts = await self._probe(page, ["message_item", "image_link"])
+
+        if not self._pick("message_item", counts["message_item"]):
+            logger.warning(
+                "No messages in the channel yet, or none matches (tried: "
+                + ", ".join(self.candidates["message_item"])
+                + "); message selector not checked."
+            )
+        if not self._pick("image_link", counts["image_link"]):
+            logger.warning("No image links in the channel yet; image link selector not checked.")
+
+        if bot_command and "autocomplete_entry" not in self.active:
+            chat_bar = page.get_by_role(
+                "textbox",
+                name=placeholder or os.environ.get("DISCORD_CHANNEL_MESSAGE_PLACEHOLDER"),
+            )
+            async with lock or contextlib.nullcontext():
+                await chat_bar.fill(bot_command)
+                try:
+                    await page.wait_for_selector(
+                        self.get("autocomplete_entry"), state="visible", timeout=timeout
+                    )
+                    await self.resolve(page, "autocomplete_entry")
+                except Exception as e:
+                    logger.error(f"Autocomplete entry did not appear: {e}")
+                finally:
+                    await chat_bar.fill("")
+            if "autocomplete_entry" not in self.active:
+                raise SelectorError(
+                    f"No autocomplete selector matches after typing {bot_command} (tried: "
+                    + ", ".join(self.candidates["autocomplete_entry"])
+                    + f"). Discord may have changed; update {self.source}."
+                )
+
+        logger.info(
+            f"Selector self-test passed in {time.monotonic() - started:.1f}s "
+            f"({self.source} v{self.version}): "
+            + ", ".join(f"{name}={selector}" for name, selector in self.active.items())
+        )
+
+
+_registry: SelectorRegistry = None
+
+
+def registry() -> SelectorRegistry:
+    """Return the process-wide registry, loading it on first use."""
+    global _registry
+    if _registry is None:
+        _registry = SelectorRegistry.load()
+    return _registry
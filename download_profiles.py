@@ -0,0 +1,116 @@
+"""
+Download profiles: which rendition of an upscale to fetch from Discord.
+
+``original`` downloads the attachment as posted (a full-size PNG). Any other
+profile is written ``<format>`` or ``<format>:<width>`` (``webp``,
+``webp:2048``, ``jpeg:1024``) and is requested from Discord's media proxy,
+which converts and resizes on its side so fewer bytes cross the uplink.
+"""
+
+from dataclasses import dataclass
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+ORIGINAL = "original"
+FORMATS = ("webp", "jpeg", "png")
+
+# Attachments are served by the CDN as uploaded; the media proxy serves
+# converted and resized variants of the same paths.
+CDN_HOST = "cdn.discordapp.com"
+MEDIA_PROXY_HOST = "media.discordapp.net"
+
+_VARIANT_PARAMS = ("format", "width", "height", "quality")
+
+
+@dataclass(frozen=True)
+class DownloadProfile:
+    """
+    A rendition to download.
+
+    Attributes:
+    - name (str): The profile as written in settings and prompt options.
+    - format (str): Image format requested from the media proxy, or None for the original.
+    - width (int): Width to resize to, or None to keep the full size.
+    """
+
+    name: str = ORIGINAL
+    format: str = None
+    width: int = None
+
+    @classmethod
+    def parse(cls, spec: str) -> "DownloadProfile":
+        """
+        Function to read a profile from its name.
+
+        Parameters:
+        - spec (str): ``original``, ``<format>`` or ``<format>:<width>``.
+
+        Returns:
+        - DownloadProfile: The profile. `ValueError` if `spec` is not valid.
+        """
+        spec = (spec or ORIGINAL).strip().lower()
+        if spec == ORIGINAL:
+            return cls()
+        image_format, _, width = spec.partition(":")
+        if image_format == "jpg":
+            image_format = "jpeg"
+        if image_format not in FORMATS:
+            raise ValueError(
+                f"unknown download profile {spec!r}; use original, or one of "
+                f"{', '.join(FORMATS)} optionally followed by :<width>"
+            )
+        if width and (not width.isdigit() or int(width) <= 0):
+            raise ValueError(f"width in download profile {spec!r} must be a positive number")
+        return cls(spec, image_format, int(width) if width else None)
+
+    @property
+    def original(self) -> bool:
+        return self.format is None and self.width is None
+
+    @property
+    def extension(self) -> str:
+        return "jpg" if self.format == "jpeg" else self.format or "png"
+
+    def variant_url(self, url: str) -> str:
+        """Return the URL of this profile's rendition of the attachment at `url`."""
+        if self.original:
+            return url
+        parts = urlsplit(url)
+        host = MEDIA_PROXY_HOST if parts.netloc == CDN_HOST else parts.netloc
+        # Keep the signed-URL parameters (ex, is, hm) and replace the rendition ones.
+        query = [
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if key not in _VARIANT_PARAMS
+        ]
+        query.append(("format", self.format))
+        if self.width:
+            query.append(("width", str(self.width)))
+        return urlunsplit((parts.scheme, host, parts.path, urlencode(query), parts.fragment))
+
+
+PROMPT_OPTIONS_MARKER = "##"
+
+
+def split_prompt_options(line: str) -> tuple[str, dict[str, str]]:
+    """
+    Function to separate a prompt from the options written after it.
+
+    Options follow ``##`` at the end of the line as ``key=value`` pairs,
+    e.g. ``a red fox in the snow ## profile=webp:1024``.
+
+    Parameters:
+    - line (str): One line of the prompts file.
+
+    Returns:
+    - tuple[str, dict[str, str]]: The prompt and its options. `ValueError` if an option has no value.
+    """
+    prompt, marker, tail = line.partition(PROMPT_OPTIONS_MARKER)
+    if not marker:
+        return line.strip(), {}
+    options = {}
+    for token in tail.split():
+        key, _, value = token.partition("=")
+        if not key or not value:
+            raise ValueError(f"prompt option {token!r} must be written key=value")
+        options[key.strip().lower()] = value.strip()
+    return prompt.strip(), options
@@ -0,0 +1,398 @@
+"""
+Local stand-in for a Discord channel with the Midjourney bot, for developing
+and checking the automation without touching Discord.
+
+It reproduces just enough of the Discord web client for the bot: the chat
+box, the `/imagine` autocomplete entry and option pill, and a message list
+using the same class names. Submitting a prompt posts a "Waiting to start"
+message that is replaced by a 2x2 grid with U1-U4 / V1-V4 / reroll buttons;
+U buttons post an "Image #n" upscale with the follow-up buttons, and follow-up
+buttons post new grids or upscales in turn. ``{a, b}`` permutations and
+``--repeat N`` first ask for confirmation (Yes / Edit template / Show prompts)
+and post one grid per job once Yes is clicked.
+
+Usage:
+    python fake_discord.py --port 8765 --speed 10
+    python fake_discord.py --check-fast-submit
+
+then start Chrome with `--remote-debugging-port=9222`, open
+http://localhost:8765/channels/1/2 in it, and set in `.env`
+    DISCORD_CHANNEL_URL=http://localhost:8765/channels/1/2
+    DISCORD_CHANNEL_MESSAGE_PLACEHOLDER="Message #general"
+"""
+
+import argparse
+import struct
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from loguru import logger
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>#general | Fake Discord</title>
+<style>
+body { background: #313338; color: #dbdee1; font-family: sans-serif; margin: 0; }
+ol { list-style: none; margin: 0; padding: 8px; height: calc(100vh - 120px); overflow-y: auto; }
+li { padding: 6px; border-bottom: 1px solid #3f4147; white-space: pre-wrap; }
+button { margin: 2px; }
+#composer { position: fixed; bottom: 0; left: 0; right: 0; padding: 8px; background: #383a40; }
+[role=textbox] { min-height: 24px; padding: 6px; background: #404249; }
+.optionPillValue__1464f { display: inline-block; min-width: 80px; background: #2b2d31; padding: 0 4px; }
+#autocomplete-0 { background: #2b2d31; padding: 4px; }
+.base__13533 { cursor: pointer; padding: 4px; }
+</style>
+</head>
+<body>
+<ol id="messages" data-list-id="chat-messages">
+  <div class="emptyChannelIcon__b9d6c">Welcome to #general! This is the start of the #general channel.</div>
+</ol>
+<div id="composer">
+  <div id="autocomplete-slot"></div>
+  <div role="textbox" aria-label="__PLACEHOLDER__" contenteditable="true"></div>
+</div>
+<script>
+const SPEED = __SPEED__;
+const HISTORY = __HISTORY__;
+const CHANNEL = "__CHANNEL__";
+const list = document.getElementById("messages");
+const textbox = document.querySelector("[role=textbox]");
+const slot = document.getElementById("autocomplete-slot");
+let nextId = 1000;
+let pill = null;
+
+const later = (seconds, fn) => setTimeout(fn, seconds * 1000 / SPEED);
+
+function post({text, buttons = [], image = null, web = false}) {
+  const li = document.createElement("li");
+  const id = String(nextId++);
+  li.id = `chat-messages-${CHANNEL}-${id}`;
+  li.className = "messageListItem__5126c";
+  const body = document.createElement("div");
+  body.textContent = text;
+  li.appendChild(body);
+  if (image) {
+    const a = document.createElement("a");
+    a.className = "originalLink_af017a";
+    a.href = `/attachments/${image}_${id}.png`;
+    li.appendChild(a);
+  }
+  const row = document.createElement("div");
+  for (const label of buttons) {
+    const b = document.createElement("button");
+    b.textContent = label;
+    b.addEventListener("click", () => onButton(li, label));
+    row.appendChild(b);
+  }
+  if (web) {
+    const a = document.createElement("a");
+    a.textContent = "Web";
+    a.href = "#";
+    row.appendChild(a);
+  }
+  li.appendChild(row);
+  list.appendChild(li);
+  // Like Discord, only keep a window of the history in the DOM; the
+  // channel's beginning goes away with the first message
+  while (list.querySelectorAll("li").length > HISTORY) list.firstElementChild.remove();
+  list.scrollTop = list.scrollHeight;
+  return li;
+}
+
+const GRID_BUTTONS = ["U1", "U2", "U3", "U4", "🔄", "V1", "V2", "V3", "V4"];
+const UPSCALE_BUTTONS = [
+  "Upscale (Subtle)", "Upscale (Creative)", "Vary (Subtle)", "Vary (Strong)",
+  "Vary (Region)", "Zoom Out 2x", "Zoom Out 1.5x", "Custom Zoom",
+  "⬅️", "➡️", "⬆️", "⬇️",
+];
+const SUBTLE_BUTTONS = ["Vary (Subtle)", "Vary (Strong)", "Redo Upscale (Subtle)"];
+
+function grid(prompt, suffix) {
+  const waiting = post({text: `**${prompt}** - @user (Waiting to start)`});
+  later(4, () => {
+    waiting.remove();
+    const li = post({
+      text: `**${prompt}** - ${suffix}@user (fast)`, buttons: GRID_BUTTONS, image: "grid",
+    });
+    li.dataset.prompt = prompt;
+  });
+}
+
+function upscale(prompt, text, buttons) {
+  later(3, () => {
+    const li = post({text: `**${prompt}** - ${text} @user`, buttons, image: "upscale", web: true});
+    li.dataset.prompt = prompt;
+  });
+}
+
+function onButton(li, label) {
+  if (li.jobs) return onConfirmation(li, label);
+  const prompt = li.dataset.prompt;
+  if (/^U[1-4]$/.test(label)) return upscale(prompt, `Image #${label[1]}`, UPSCALE_BUTTONS);
+  if (label === "Upscale (Subtle)") return upscale(prompt, "Upscaled (Subtle) by", SUBTLE_BUTTONS);
+  if (label === "Upscale (Creative)") return upscale(prompt, "Upscaled (Creative) by", SUBTLE_BUTTONS);
+  if (label === "🔄") return grid(prompt, "");
+  if (/^V[1-4]$/.test(label)) return grid(prompt, `Variations by `);
+  if (label.startsWith("Vary")) return grid(prompt, `${label.replace("Vary", "Variations")} by `);
+  if (label.startsWith("Zoom Out")) return grid(prompt, `${label} by `);
+  if (["⬅️", "➡️", "⬆️", "⬇️"].includes(label)) return grid(prompt, "Pan by ");
+}
+
+function showAutocomplete() {
+  if (document.getElementById("autocomplete-0")) return;
+  const box = document.createElement("div");
+  box.id = "autocomplete-0";
+  const entry = document.createElement("div");
+  entry.className = "base__13533";
+  entry.textContent = "/imagine prompt";
+  entry.addEventListener("click", selectImagine);
+  box.appendChild(entry);
+  slot.appendChild(box);
+}
+
+function selectImagine() {
+  slot.innerHTML = "";
+  textbox.textContent = "/imagine prompt: ";
+  pill = document.createElement("span");
+  pill.className = "optionPillValue__1464f";
+  pill.contentEditable = "true";
+  textbox.appendChild(pill);
+  pill.focus();
+}
+
+textbox.addEventListener("input", () => {
+  if (pill && !pill.isConnected) pill = null;
+  if (!pill && textbox.textContent.trim() === "/imagine") showAutocomplete();
+  else if (!pill) slot.innerHTML = "";
+});
+
+document.addEventListener("keydown", (event) => {
+  // Like Discord, only real key presses send the message
+  if (event.key !== "Enter" || !pill || !event.isTrusted) return;
+  event.preventDefault();
+  const prompt = pill.textContent.trim();
+  pill = null;
+  textbox.textContent = "";
+  if (!prompt) return;
+  const jobs = expand(prompt);
+  if (jobs.length === 1) return grid(jobs[0], "");
+  // Like Midjourney, several jobs from one prompt need a confirmation
+  const li = post({
+    text: `Are you sure you want to create ${jobs.length} prompts? Prompt template: ${prompt}`,
+    buttons: ["Yes", "Edit template", "Show prompts"],
+  });
+  li.jobs = jobs;
+});
+
+function onConfirmation(li, label) {
+  if (label === "Show prompts") {
+    li.firstElementChild.textContent += "\\n" + li.jobs.join("\\n");
+    return;
+  }
+  // Answered: the buttons go away and the message stays
+  li.lastElementChild.remove();
+  const jobs = li.jobs;
+  li.jobs = null;
+  if (label === "Yes") jobs.forEach((p) => grid(p, ""));
+}
+
+// One prompt per job of a "{a, b}" permutation and/or "--repeat N"
+function expand(prompt) {
+  let repeat = 1;
+  prompt = prompt.replace(/\s+--repeat\s+(\d+)/, (_, n) => { repeat = Number(n); return ""; });
+  let prompts = [prompt];
+  const match = prompt.match(/\{(.*?)\}/);
+  if (match) {
+    prompts = match[1].split(/(?<!\\\\),/).map((option) =>
+      prompt.replace(match[0], option.trim().replace(/\\\\,/g, ",")));
+  }
+  return [].concat(...Array(repeat).fill(prompts));
+}
+</script>
+</body>
+</html>
+"""
+
+
+def _png(width: int, height: int, rgb: tuple[int, int, int]) -> bytes:
+    """Encode a solid-colour RGB PNG."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(data))
+            + kind
+            + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+        )
+
+    row = b"\x00" + bytes(rgb) * width
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(row * height))
+        + chunk(b"IEND", b"")
+    )
+
+
+class FakeDiscordHandler(BaseHTTPRequestHandler):
+    speed = 1.0
+    placeholder = "Message #general"
+    history = 200
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool = False):
+        self.head = head
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if parts[0] == "channels" and len(parts) == 3:
+            body = (
+                PAGE.replace("__SPEED__", str(self.speed))
+                .replace("__HISTORY__", str(self.history))
+                .replace("__CHANNEL__", parts[2])
+                .replace("__PLACEHOLDER__", self.placeholder)
+                .encode("utf-8")
+            )
+            self._send(200, "text/html; charset=utf-8", body)
+        elif parts[0] == "attachments" and len(parts) == 2:
+            query = parse_qs(url.query)
+            size = int(query.get("width", ["256"])[0])
+            seed = zlib.crc32(parts[1].encode("utf-8"))
+            rgb = (seed & 0xFF, (seed >> 8) & 0xFF, (seed >> 16) & 0xFF)
+            self._send(200, "image/png", _png(size, size, rgb))
+        else:
+            self._send(404, "text/plain", b"Not found")
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not self.head:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+def make_server(
+    port: int = 8765,
+    speed: float = 1.0,
+    placeholder: str = "Message #general",
+    history: int = 200,
+) -> ThreadingHTTPServer:
+    """
+    Function to create the fake channel's server without starting it.
+
+    Parameters:
+    - port (int): The port to listen on.
+    - speed (float): How many times faster than real time the fake bot replies.
+    - placeholder (str): Accessible name of the chat box.
+    - history (int): Messages kept in the page; older ones are removed, as Discord does.
+
+    Returns:
+    - ThreadingHTTPServer: The server; call `serve_forever` to run it.
+    """
+    FakeDiscordHandler.speed = speed
+    FakeDiscordHandler.placeholder = placeholder
+    FakeDiscordHandler.history = history
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeDiscordHandler)
+    logger.info(f"Fake Discord channel at http://localhost:{port}/channels/1/2")
+    return server
+
+
+def serve(port: int = 8765, speed: float = 1.0, placeholder: str = "Message #general"):
+    """
+    Function to serve the fake channel until interrupted.
+
+    Parameters:
+    - port (int): The port to listen on.
+    - speed (float): How many times faster than real time the fake bot replies.
+    - placeholder (str): Accessible name of the chat box.
+
+    Returns:
+    - None
+    """
+    server = make_server(port, speed, placeholder)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+async def check_fast_submit(cdp_url: str, port: int = 8765, placeholder: str = "Message #general") -> bool:
+    """
+    Function to check the fast submit path against the fake channel.
+
+    Serves the channel, opens it in the Chrome at `cdp_url`, submits one
+    prompt with `submit_prompt(fast=True)` and waits for its grid.
+
+    Parameters:
+    - cdp_url (str): Chrome debugging URL.
+    - port (int): The port to serve the channel on.
+    - placeholder (str): Accessible name of the chat box.
+
+    Returns:
+    - bool: True when the grid was posted and the chat box was left empty.
+    """
+    import asyncio
+    import threading
+
+    from playwright.async_api import async_playwright
+
+    from utils import acquire_channel_page, read_messages, submit_prompt
+
+    server = make_server(port, speed=10.0, placeholder=placeholder)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    prompt = "fast submit check, a lighthouse at dusk"
+    try:
+        async with async_playwright() as p:
+            browser = await p.chromium.connect_over_cdp(cdp_url)
+            page = await acquire_channel_page(
+                browser, f"http://localhost:{port}/channels/1/2", placeholder
+            )
+            await submit_prompt(page, "/imagine", prompt, fast=True, placeholder=placeholder)
+            for _ in range(50):
+                messages = await read_messages(page, tail=5)
+                if any(prompt in m.text and "U1" in m.buttons for m in messages):
+                    break
+                await asyncio.sleep(0.2)
+            else:
+                logger.error("No grid was posted for the prompt.")
+                return False
+            left = await page.get_by_role("textbox", name=placeholder).inner_text()
+            if left.strip():
+                logger.error(f"The chat box was not emptied: {left!r}")
+                return False
+            logger.info("Fast submit works against the fake channel.")
+            return True
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a fake Midjourney channel.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--speed", type=float, default=1.0)
+    parser.add_argument("--placeholder", default="Message #general")
+    parser.add_argument(
+        "--check-fast-submit",
+        metavar="CDP_URL",
+        nargs="?",
+        const="http://localhost:9222",
+        help="Submit one prompt through the fast path in the Chrome at CDP_URL and exit.",
+    )
+    args = parser.parse_args()
+    if args.check_fast_submit:
+        import asyncio
+        import sys
+
+        ok = asyncio.run(check_fast_submit(args.check_fast_submit, args.port, args.placeholder))
+        sys.exit(0 if ok else 1)
+    serve(args.port, args.speed, args.placeholder)
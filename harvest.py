@@ -0,0 +1,392 @@
+"""
+Harvest mode: download the Midjourney results already posted in a channel.
+
+The harvester walks the channel history backwards by scrolling Discord's
+virtualized message list to the top and reading what it renders. Every
+finished upscale (and, with ``--grids``, every grid) is handed to a pool of
+download workers together with its prompt and message id. Messages already
+in the output manifest are skipped, so the same channel can be harvested
+again to pick up what is new.
+
+After each screen of history is downloaded, the oldest message reached is
+written to a checkpoint. An interrupted harvest resumes from there by
+opening Discord's link to that message instead of scrolling back from the
+newest one. The channel only counts as done once its beginning is in view;
+history that stops loading ends the run without marking it done. Messages
+whose download failed are kept in the checkpoint and retried by the next run.
+
+Usage:
+    python harvest.py --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+import uuid
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from config import ConfigError, load_settings
+from dom_selectors import registry
+from download_profiles import DownloadProfile
+from logging_setup import configure_logging
+from router import GRID, UPSCALE, message_kind
+from storage import ShardedStorage, create_storage
+from utils import ChannelMessage, read_messages, save_message_images, wait_for_chat_ready
+
+CHECKPOINT_NAME = "harvest_checkpoint.json"
+
+# Every rendered message, whatever the window Discord keeps
+_ALL = 1_000_000
+
+# Runs in the page. Scrolls the message list's scroller to the top, which
+# makes Discord load the previous screen of history. Reports whether the
+# list can scroll at all and whether the channel's beginning is rendered.
+_SCROLL_TO_TOP_JS = """
+({messageSelector, beginningSelector}) => {
+    const beginning = Boolean(beginningSelector && document.querySelector(beginningSelector));
+    const first = document.querySelector(messageSelector);
+    let node = first ? first.parentElement : null;
+    while (node) {
+        const overflow = getComputedStyle(node).overflowY;
+        if (node.scrollHeight > node.clientHeight && /(auto|scroll)/.test(overflow)) {
+            node.scrollTop = 0;
+            return {scrollable: true, beginning};
+        }
+        node = node.parentElement;
+    }
+    return {scrollable: false, beginning};
+}
+"""
+
+# "<prompt> - Image #2 <@user>", "<prompt> - Upscaled (Subtle) by <@user>", ...
+_PROMPT_LINE = re.compile(
+    r"^\**(?P<prompt>.+?)\**\s+-\s+(?:Image #\d|Upscaled|Variations|Zoom Out|Pan|<?@)"
+)
+
+
+def message_prompt(message: ChannelMessage) -> str:
+    """Return the prompt quoted by a bot reply, or None if there is none."""
+    for line in message.text.splitlines():
+        match = _PROMPT_LINE.match(line.strip())
+        if match:
+            return match.group("prompt").strip()
+    return None
+
+
+def load_checkpoint(path: str, channel_url: str) -> dict:
+    """Return the checkpoint of an earlier harvest of `channel_url`, or an empty one."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return checkpoint if checkpoint.get("channel_url") == channel_url else {}
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    """Write `checkpoint` atomically, so an interruption never leaves half a file."""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(temporary, path)
+
+
+class Harvester:
+    """
+    Walks a channel's history backwards and downloads its results.
+
+    Attributes:
+    - queued (int): Results handed to the download workers during this run.
+    - downloaded (int): Images written during this run.
+    - skipped (int): Results already in the manifest.
+    - failed (int): Results whose download failed.
+    - failed_ids (list[str]): Message ids of the results still failing, kept for the next run.
+    """
+
+    def __init__(
+        self,
+        page,
+        storage: ShardedStorage,
+        channel_url: str,
+        checkpoint_path: str,
+        workers: int = 4,
+        kinds: tuple[str, ...] = (UPSCALE,),
+        profile: DownloadProfile = None,
+        limit: int = None,
+        scroll_timeout: float = 15.0,
+        placeholder: str = None,
+    ):
+        self.page = page
+        self.storage = storage
+        self.channel_url = channel_url
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.kinds = kinds
+        self.profile = profile
+        self.limit = limit
+        self.scroll_timeout = scroll_timeout
+        self.placeholder = placeholder
+        self.run_id = uuid.uuid4().hex
+        self.queued = self.downloaded = self.skipped = self.failed = 0
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 4)
+        self._seen: set[str] = set()
+        self._failed: dict[str, None] = {}
+
+    @property
+    def failed_ids(self) -> list[str]:
+        return list(self._failed)
+
+    async def _download(self):
+        while True:
+            message, prompt = await self._queue.get()
+            try:
+                paths: list[str] = []
+                await save_message_images(
+                    [message],
+                    prompt,
+                    self.storage,
+                    paths,
+                    job_id=self.run_id,
+                    parameters={"harvested": True, "kind": message_kind(message)},
+                    profile=self.profile,
+                )
+                self.downloaded += len(paths)
+                self._failed.pop(message.message_id, None)
+            except Exception as e:
+                self.failed += 1
+                self._failed[message.message_id] = None
+                logger.error(f"Could not download message {message.message_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _older_messages(self, oldest_id: str) -> list[ChannelMessage]:
+        """
+        Scroll to the top and return the rendered messages once older ones
+        appear, or [] at the beginning of the channel. The beginning is
+        recognised by Discord's channel header, or by a list that no longer
+        scrolls. `TimeoutError` when neither shows up in `scroll_timeout`.
+        """
+        selectors = {
+            "messageSelector": registry().get("message_item"),
+            "beginningSelector": registry().get("channel_beginning"),
+        }
+        deadline = time.monotonic() + self.scroll_timeout
+        unscrollable = 0
+        while True:
+            state = await self.page.evaluate(_SCROLL_TO_TOP_JS, selectors)
+            await asyncio.sleep(0.5)
+            messages = await read_messages(self.page, tail=_ALL)
+            if messages and messages[0].id != oldest_id:
+                return messages
+            if state["beginning"]:
+                return []
+            # The whole history fits on screen, checked twice in case it is still loading
+            unscrollable = unscrollable + 1 if not state["scrollable"] else 0
+            if unscrollable >= 2:
+                return []
+            if time.monotonic() >= deadline:
+                raise TimeoutError(
+                    f"No older messages loaded in {self.scroll_timeout:.0f}s "
+                    "and the beginning of the channel is not in view."
+                )
+
+    async def _retry(self, message_ids: list[str]):
+        """Open each message whose download failed in an earlier run and queue it again."""
+        for message_id in message_ids:
+            await self.page.goto(
+                f"{self.channel_url.rstrip('/')}/{message_id}", wait_until="domcontentloaded"
+            )
+            await wait_for_chat_ready(self.page, placeholder=self.placeholder)
+            messages = await read_messages(self.page, tail=_ALL)
+            message = next((m for m in messages if m.message_id == message_id), None)
+            prompt = message_prompt(message) if message else None
+            if prompt is None:
+                logger.warning(f"Message {message_id} is gone; not retrying its download.")
+                continue
+            if self.storage.lookup(message_id=message_id):
+                continue
+            logger.info(f"Retrying the download of message {message_id}")
+            self._seen.add(message.id)
+            await self._queue.put((message, prompt))
+            self.queued += 1
+        await self._queue.join()
+
+    def _limit_reached(self) -> bool:
+        return self.limit is not None and self.queued >= self.limit
+
+    async def _queue_results(self, messages: list[ChannelMessage]):
+        """Queue the unseen results among `messages` for download, newest first."""
+        for message in reversed(messages):
+            if message.id in self._seen:
+                continue
+            self._seen.add(message.id)
+            if message_kind(message) not in self.kinds or not message.attachments:
+                continue
+            prompt = message_prompt(message)
+            if prompt is None:
+                continue
+            if self.storage.lookup(message_id=message.message_id):
+                self.skipped += 1
+                continue
+            if self._limit_reached():
+                return
+            await self._queue.put((message, prompt))
+            self.queued += 1
+
+    async def run(self, restart: bool = False) -> bool:
+        """
+        Function to harvest until the top of the channel or `limit` results.
+
+        Parameters:
+        - restart (bool): Ignore the checkpoint and start from the newest message.
+
+        Returns:
+        - bool: True when the beginning of the channel, or of the last full harvest, was reached.
+        """
+        checkpoint = {} if restart else load_checkpoint(self.checkpoint_path, self.channel_url)
+        # Once the whole channel was harvested, only the messages posted since are new
+        known_newest = int(checkpoint["newest_message_id"]) if checkpoint.get("done") else None
+        retries = checkpoint.get("failed", [])
+
+        downloaded_before = checkpoint.get("downloaded", 0)
+        workers = [asyncio.create_task(self._download()) for _ in range(self.workers)]
+        reached_top = False
+        try:
+            if retries:
+                await self._retry(retries)
+            if known_newest is not None:
+                logger.info("This channel was harvested to the top before; harvesting newer messages only.")
+                start_url = self.channel_url if retries else None
+            elif checkpoint.get("oldest_message_id"):
+                start_url = f"{self.channel_url.rstrip('/')}/{checkpoint['oldest_message_id']}"
+                logger.info(f"Resuming the harvest at {start_url}")
+            else:
+                start_url = self.channel_url if retries else None
+            if start_url:
+                await self.page.goto(start_url, wait_until="domcontentloaded")
+                await wait_for_chat_ready(self.page, placeholder=self.placeholder)
+
+            messages = await read_messages(self.page, tail=_ALL)
+            newest = messages[-1].message_id if messages else None
+            if not checkpoint.get("newest_message_id"):
+                checkpoint["newest_message_id"] = newest
+            while messages:
+                await self._queue_results(messages)
+                if self._limit_reached():
+                    break
+                caught_up = known_newest is not None and int(messages[0].message_id) <= known_newest
+                stalled = False
+                try:
+                    # Load the previous screen while this one downloads
+                    older = [] if caught_up else await self._older_messages(messages[0].id)
+                except TimeoutError as e:
+                    logger.warning(f"{e} Stopping; run the harvest again to resume.")
+                    older, stalled = [], True
+                await self._queue.join()
+                if known_newest is None:
+                    checkpoint["oldest_message_id"] = messages[0].message_id
+                checkpoint.update(
+                    channel_url=self.channel_url,
+                    done=known_newest is not None,
+                    downloaded=downloaded_before + self.downloaded,
+                    failed=self.failed_ids,
+                    updated_at=time.time(),
+                )
+                save_checkpoint(self.checkpoint_path, checkpoint)
+                logger.info(
+                    f"Harvested back to message {messages[0].message_id}: "
+                    f"{self.downloaded} downloaded, {self.skipped} already stored, {self.failed} failed."
+                )
+                if not older:
+                    reached_top = not stalled
+                    break
+                messages = older
+            await self._queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        if reached_top:
+            # Only now is everything up to the newest message stored. A
+            # resumed harvest started below messages posted since the first
+            # run, so it keeps the newest message that run saw.
+            if known_newest is not None:
+                checkpoint["newest_message_id"] = newest
+            checkpoint["done"] = True
+        checkpoint["failed"] = self.failed_ids
+        save_checkpoint(self.checkpoint_path, checkpoint)
+        return reached_top
+
+
+async def harvest(args) -> int:
+    """
+    Function to run a harvest from the command line.
+
+    Parameters:
+    - args: The parsed command line.
+
+    Returns:
+    - int: 0 once the harvest finished, 1 if some downloads failed.
+    """
+    from playwright.async_api import async_playwright
+
+    from utils import acquire_channel_page
+
+    settings = load_settings()
+    channel_url = args.channel_url or settings.channel_url
+    output_dir = args.output_dir or settings.output_dir
+    storage = create_storage(settings, output_dir)
+    kinds = (UPSCALE, GRID) if args.grids else (UPSCALE,)
+    try:
+        async with async_playwright() as p:
+            browser = await p.chromium.connect_over_cdp(settings.cdp_url)
+            page = await acquire_channel_page(browser, channel_url, settings.message_placeholder)
+            harvester = Harvester(
+                page,
+                storage,
+                channel_url,
+                os.path.join(output_dir, CHECKPOINT_NAME),
+                workers=args.workers,
+                kinds=kinds,
+                profile=DownloadProfile.parse(args.profile or settings.download_profile),
+                limit=args.limit,
+                placeholder=settings.message_placeholder,
+            )
+            reached_top = await harvester.run(restart=args.restart)
+            await browser.close()
+    finally:
+        storage.close()
+
+    logger.info(
+        f"Harvest {'complete' if reached_top else 'stopped'}: {harvester.downloaded} downloaded, "
+        f"{harvester.skipped} already stored, {harvester.failed} failed."
+    )
+    return 1 if harvester.failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the results already posted in a channel.")
+    parser.add_argument("--channel-url", help="Channel to harvest. Defaults to DISCORD_CHANNEL_URL.")
+    parser.add_argument("--output-dir", help="Defaults to OUTPUT_DIR.")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent downloads.")
+    parser.add_argument("--grids", action="store_true", help="Also download grids.")
+    parser.add_argument("--profile", help="Download profile. Defaults to DOWNLOAD_PROFILE.")
+    parser.add_argument("--limit", type=int, help="Stop after this many results.")
+    parser.add_argument(
+        "--restart", action="store_true", help="Ignore the checkpoint and start from the newest message."
+    )
+    args = parser.parse_args()
+
+    load_dotenv()
+    configure_logging()
+    try:
+        sys.exit(asyncio.run(harvest(args)))
+    except (ConfigError, ValueError) as e:
+        sys.exit(str(e))
@@ -0,0 +1,253 @@
+"""
+Durable job queue shared by the worker processes of a `Supervisor`.
+
+Jobs live in a local SQLite file. A worker leases a job for a limited time
+and keeps the lease alive with heartbeats; a job whose lease ran out, or
+whose worker died, goes back to the queue until it has been tried
+`max_attempts` times.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+JOBS_NAME = "jobs.sqlite3"
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT NOT NULL,
+    sequence_number INTEGER NOT NULL,
+    prompt TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    UNIQUE (batch, sequence_number)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (batch, status, sequence_number);
+CREATE TABLE IF NOT EXISTS workers (
+    worker TEXT PRIMARY KEY,
+    pid INTEGER,
+    heartbeat_at REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class Job:
+    """
+    A leased job.
+
+    Attributes:
+    - id (int): Row id in the job store.
+    - batch (str): The batch the job belongs to.
+    - sequence_number (int): Position of the prompt in its batch.
+    - prompt (str): The prompt line, options included.
+    - attempts (int): Times the job has been leased, this lease included.
+    """
+
+    id: int
+    batch: str
+    sequence_number: int
+    prompt: str
+    attempts: int
+
+
+class JobStore:
+    """
+    Job queue in a SQLite file, safe to share between processes.
+
+    Every process opens its own `JobStore` on the same path. Leasing runs in
+    an immediate transaction, so two workers never lease the same job.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = os.path.abspath(path)
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            self.path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        # Readers do not block the worker writing a lease
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def _write(self, query: str, values=()) -> sqlite3.Cursor:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._db.execute(query, values)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return cursor
+
+    def enqueue(self, batch: str, prompts: list[str]) -> int:
+        """
+        Function to add the prompts of a batch to the queue.
+
+        Prompts already queued for `batch` at the same position are left
+        alone, so enqueuing the same file again resumes it.
+
+        Parameters:
+        - batch (str): Identifier of the batch, e.g. a hash of the prompts file.
+        - prompts (list[str]): The prompt lines, in order.
+
+        Returns:
+        - int: Jobs added.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._db.total_changes
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO jobs (batch, sequence_number, prompt, updated_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    [(batch, i + 1, prompt, now) for i, prompt in enumerate(prompts)],
+                )
+                added = self._db.total_changes - before
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return added
+
+    def lease(self, batch: str, worker: str, lease_seconds: float) -> Job:
+        """
+        Function to take the next queued job of `batch`.
+
+        Parameters:
+        - batch (str): The batch to take a job from.
+        - worker (str): The worker taking it.
+        - lease_seconds (float): How long the job stays leased without a heartbeat.
+
+        Returns:
+        - Job: The job, or None when nothing is queued.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, batch, sequence_number, prompt, attempts FROM jobs"
+                    " WHERE batch = ? AND status = ? ORDER BY sequence_number LIMIT 1",
+                    (batch, QUEUED),
+                ).fetchone()
+                if row:
+                    self._db.execute(
+                        "UPDATE jobs SET status = ?, worker = ?, lease_until = ?,"
+                        " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (LEASED, worker, now + lease_seconds, now, row[0]),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        if not row:
+            return None
+        return Job(*row[:4], attempts=row[4] + 1)
+
+    def heartbeat(self, worker: str, lease_seconds: float, pid: int = None):
+        """Record that `worker` is alive and extend the leases it holds."""
+        now = time.time()
+        self._write(
+            "INSERT INTO workers (worker, pid, heartbeat_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (worker) DO UPDATE SET pid = excluded.pid,"
+            " heartbeat_at = excluded.heartbeat_at",
+            (worker, pid, now),
+        )
+        self._write(
+            "UPDATE jobs SET lease_until = ? WHERE worker = ? AND status = ?",
+            (now + lease_seconds, worker, LEASED),
+        )
+
+    def last_heartbeat(self, worker: str) -> float:
+        """Return the Unix time of the last heartbeat of `worker`, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT heartbeat_at FROM workers WHERE worker = ?", (worker,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def finish(self, job_id: int, worker: str, result: str, error: str = None) -> bool:
+        """
+        Function to record how a leased job ended.
+
+        Parameters:
+        - job_id (int): The job.
+        - worker (str): The worker holding the lease.
+        - result (str): The job's final stage (``downloaded``, ``timed_out``, ...).
+        - error (str): What went wrong, if anything.
+
+        Returns:
+        - bool: False if the lease was lost, e.g. the job was requeued meanwhile.
+        """
+        status = DONE if error is None else FAILED
+        cursor = self._write(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL,"
+            " updated_at = ? WHERE id = ? AND worker = ? AND status = ?",
+            (status, result, error, time.time(), job_id, worker, LEASED),
+        )
+        return cursor.rowcount == 1
+
+    def requeue(self, worker: str = None, expired_only: bool = False) -> int:
+        """
+        Function to put leased jobs back in the queue.
+
+        Jobs already tried `max_attempts` times are marked failed instead.
+
+        Parameters:
+        - worker (str): Only the jobs leased by this worker. Defaults to every worker.
+        - expired_only (bool): Only the jobs whose lease ran out.
+
+        Returns:
+        - int: Jobs requeued or failed.
+        """
+        clauses, values = ["status = ?"], [LEASED]
+        if worker:
+            clauses.append("worker = ?")
+            values.append(worker)
+        if expired_only:
+            clauses.append("lease_until < ?")
+            values.append(time.time())
+        cursor = self._write(
+            "UPDATE jobs SET"
+            " status = CASE WHEN attempts >= ? THEN ? ELSE ? END,"
+            " error = CASE WHEN attempts >= ? THEN 'lease lost too many times' END,"
+            " worker = NULL, lease_until = NULL, updated_at = ?"
+            " WHERE " + " AND ".join(clauses),
+            [self.max_attempts, FAILED, QUEUED, self.max_attempts, time.time(), *values],
+        )
+        return cursor.rowcount
+
+    def counts(self, batch: str) -> dict[str, int]:
+        """Return the number of jobs of `batch` in each status."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM jobs WHERE batch = ? GROUP BY status",
+                (batch,),
+            ).fetchall()
+        return dict(rows)
+
+    def pending(self, batch: str) -> int:
+        """Return the number of jobs of `batch` queued or leased."""
+        counts = self.counts(batch)
+        return counts.get(QUEUED, 0) + counts.get(LEASED, 0)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
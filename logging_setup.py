@@ -0,0 +1,125 @@
+import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+
+from loguru import logger
+
+TEXT_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - "
+    "{extra[job]}<level>{message}</level>"
+)
+
+_job_context: ContextVar[dict] = ContextVar("job_context", default={})
+
+_throttle_lock = threading.Lock()
+_throttled: dict[str, tuple[float, int]] = {}
+
+
+def set_job_context(**fields):
+    """
+    Attach fields (job_id, stage, ...) to every record logged from the
+    current asyncio task from now on. Setting `stage` also restarts the
+    stage clock reported as `elapsed`.
+    """
+    context = dict(_job_context.get())
+    context.update(fields)
+    if "stage" in fields:
+        context["stage_started"] = time.monotonic()
+    _job_context.set(context)
+
+
+def _patch(record):
+    context = _job_context.get()
+    extra = record["extra"]
+    if not context:
+        extra.setdefault("job", "")
+        return
+    extra["job_id"] = context.get("job_id")
+    extra["stage"] = context.get("stage")
+    if "stage_started" in context:
+        extra["elapsed"] = round(time.monotonic() - context["stage_started"], 3)
+    extra["job"] = f"[{str(extra['job_id'])[:8]} {extra['stage']}] "
+
+
+def log_throttled(key: str, message: str, interval: float = 60.0, level: str = "INFO"):
+    """
+    Log `message` at most once per `interval` seconds for `key`. The next
+    message that gets through says how many were dropped in between.
+    """
+    now = time.monotonic()
+    with _throttle_lock:
+        last, suppressed = _throttled.get(key, (None, 0))
+        if last is not None and now - last < interval:
+            _throttled[key] = (last, suppressed + 1)
+            return
+        _throttled[key] = (now, 0)
+    if suppressed:
+        message = f"{message} ({suppressed} similar messages suppressed)"
+    logger.opt(depth=1).log(level, message)
+
+
+def configure_logging(log_format: str = None, name: str = None):
+    """
+    Configure logging with a unique filename for each run.
+
+    All sinks are enqueued, so formatting and disk writes happen on loguru's
+    worker thread instead of the asyncio loop. Variable values in tracebacks
+    (`diagnose`) are only rendered into a separate errors log.
+
+    Parameters:
+    - log_format (str): ``text`` or ``json``. Defaults to `LOG_FORMAT`, then ``text``.
+    - name (str): Appended to the file names, so processes started together get their own logs.
+
+    Returns:
+    - None
+    """
+    log_format = (log_format or os.environ.get("LOG_FORMAT", "text")).lower()
+    # Create logs directory if it doesn't exist
+    os.makedirs("logs", exist_ok=True)
+
+    # Generate unique filename with timestamp
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if name:
+        timestamp = f"{timestamp}_{name}"
+    extension = "jsonl" if log_format == "json" else "log"
+    log_file = f"logs/midjourney_bot_{timestamp}.{extension}"
+    error_file = f"logs/midjourney_bot_{timestamp}.errors.log"
+
+    logger.remove()
+    logger.configure(patcher=_patch, extra={"job": ""})
+    logger.add(
+        log_file,
+        rotation="1 day",
+        retention="7 days",
+        level="INFO",
+        format=TEXT_FORMAT,
+        serialize=log_format == "json",
+        enqueue=True,
+        backtrace=False,
+        diagnose=False,
+    )
+    # Windowed builds have no console at all
+    if sys.stderr is not None:
+        logger.add(
+            sys.stderr,
+            level="INFO",
+            format=TEXT_FORMAT,
+            enqueue=True,
+            backtrace=False,
+            diagnose=False,
+        )
+    logger.add(
+        error_file,
+        level="ERROR",
+        format=TEXT_FORMAT,
+        delay=True,
+        enqueue=True,
+        backtrace=True,
+        diagnose=True,
+    )
+
+    logger.info(f"Logging configured. Log file: {log_file}")
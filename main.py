@@ -1,9 +1,14 @@
+# Imported first so the startup clock starts as close to process start as possible.
+import startup
+
+import argparse
 import asyncio
-import os
+import sys
 
 from dotenv import load_dotenv
 
-from utils import main
+from config import ConfigError, load_settings
+from logging_setup import configure_logging
 
 load_dotenv()
 
@@ -12,10 +17,35 @@ bot_command = "/imagine"
 topic = ""
 descriptors = ""
 
-channel_url = os.environ.get("DISCORD_CHANNEL_URL")
 # PROMPT = f"Generate a Midjourney prompt to result in an {art_type} image about {topic} include {descriptors}"
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit prompts.txt to the Midjourney bot.")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Estimate duration and GPU usage of the batch without touching Discord.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Jobs in flight assumed by --dry-run. Defaults to CONCURRENCY.",
+    )
+    parser.add_argument(
+        "--sessions",
+        help="Comma-separated Chrome debugging URLs; runs one worker process per session.",
+    )
+    parser.add_argument("--profile-startup", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    configure_logging()
+
+    # Validate settings before anything is submitted
+    try:
+        settings = load_settings()
+    except ConfigError as e:
+        sys.exit(str(e))
+
     # Read prompts from a file
     PROMPTS = []
 
@@ -26,6 +56,27 @@ if __name__ == "__main__":
                 PROMPTS.append(line.strip())
             line = f.readline()
 
+    if args.dry_run:
+        from planner import format_plan, plan_batch
+
+        concurrency = args.concurrency or settings.concurrency
+        print(format_plan(plan_batch(PROMPTS, settings, concurrency=concurrency)))
+        sys.exit(0)
+
     print(PROMPTS)
 
-    asyncio.run(main(bot_command, channel_url, PROMPTS))
+    if args.sessions:
+        from pipeline import BatchOptions
+        from supervisor import run_supervised
+
+        sessions = [url.strip() for url in args.sessions.split(",") if url.strip()]
+        run_supervised(sessions, PROMPTS, BatchOptions(bot_command=bot_command), settings)
+        sys.exit(0)
+
+    # Playwright and friends are only loaded once there is work to do
+    from pipeline import main
+
+    startup.mark("pipeline modules loaded")
+    startup.report()
+
+    asyncio.run(main(bot_command, settings, PROMPTS))
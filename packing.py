@@ -0,0 +1,161 @@
+"""
+Prompt packing: submit several lines of a prompt file with one `/imagine`.
+
+Consecutive lines that are identical become one submission with
+``--repeat N``. Consecutive lines that differ only in one run of words
+become one permutation prompt, e.g.
+
+    a red fox in the snow
+    a grey wolf in the snow
+    a brown bear in the snow
+
+is submitted as ``a {red fox, grey wolf, brown bear} in the snow``. The bot
+answers a packed submission with one grid per line, quoting the line's own
+prompt, so every line still runs as its own job with its own job id.
+
+Only lines with the same ``##`` options and the same ``--`` parameters are
+packed together. Lines that already are a permutation or carry ``--repeat``
+are never packed, since the bot would multiply their jobs again.
+
+Midjourney asks to confirm a packed submission before running it; the
+pipeline answers Yes (see `utils.confirm_submission`).
+"""
+
+import re
+from dataclasses import dataclass, field
+
+from download_profiles import PROMPT_OPTIONS_MARKER, split_prompt_options
+
+# Largest group Midjourney accepts, on the Pro and Mega plans
+MAX_PACK_SIZE = 40
+
+# `--repeat` and its short form `--r`
+_REPEAT = re.compile(r"(^|\s)--r(epeat)?\b")
+
+
+@dataclass
+class PackedPrompt:
+    """
+    One submission and the lines it stands for.
+
+    Attributes:
+    - text (str): The prompt to submit.
+    - members (list[tuple[int, str]]): Sequence number and line of every packed line, in order.
+    """
+
+    text: str
+    members: list[tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def packed(self) -> bool:
+        return len(self.members) > 1
+
+
+def _parts(line: str) -> tuple[list[str], str, str]:
+    """Split a line into the words of its prompt text, its ``--`` parameters and its ``##`` options."""
+    prompt, _, options = line.partition(PROMPT_OPTIONS_MARKER)
+    text, marker, parameters = prompt.strip().partition(" --")
+    return text.split(), marker + parameters, options.strip()
+
+
+def _slots(texts: list[list[str]]) -> tuple[list[str], list[str], list[str]]:
+    """Return the common leading words, the differing words of each text and the common trailing words."""
+    shortest = min(len(words) for words in texts)
+    start = 0
+    while start < shortest and all(words[start] == texts[0][start] for words in texts):
+        start += 1
+    end = 0
+    while end < shortest - start and all(
+        words[-1 - end] == texts[0][-1 - end] for words in texts
+    ):
+        end += 1
+    slots = [" ".join(words[start : len(words) - end]) for words in texts]
+    return texts[0][:start], slots, texts[0][len(texts[0]) - end :]
+
+
+def _permutation(lines: list[str]) -> str:
+    """Return the permutation prompt of `lines`, or None if they do not differ in exactly one slot."""
+    parts = [_parts(line) for line in lines]
+    if len({(parameters, options) for _, parameters, options in parts}) > 1:
+        return None
+    prefix, slots, suffix = _slots([words for words, _, _ in parts])
+    if not (prefix or suffix) or not all(slots) or len(set(slots)) < len(slots):
+        return None
+    # Commas separate the options of a permutation, so commas inside one are escaped
+    options = ", ".join(slot.replace(",", "\\,") for slot in slots)
+    text = " ".join([*prefix, "{" + options + "}", *suffix])
+    return text + parts[0][1]
+
+
+def _submission(lines: list[str]) -> str:
+    """Return the prompt submitting every line of `lines` at once, or None if they cannot be packed."""
+    if len(lines) == 1:
+        return split_prompt_options(lines[0])[0]
+    for words, parameters, _ in (_parts(line) for line in lines):
+        if _REPEAT.search(parameters) or any(c in word for word in words for c in "{}"):
+            return None
+    if len(set(lines)) == 1:
+        return f"{split_prompt_options(lines[0])[0]} --repeat {len(lines)}"
+    return _permutation(lines)
+
+
+def pack_prompts(lines: list[str], max_size: int) -> list[PackedPrompt]:
+    """
+    Function to group consecutive lines into as few submissions as possible.
+
+    Parameters:
+    - lines (list[str]): The lines of the prompt file, options included.
+    - max_size (int): Most lines in one submission; 1 or less disables packing.
+
+    Returns:
+    - list[PackedPrompt]: The submissions, in order. Lines whose options cannot be parsed stay alone.
+    """
+    max_size = min(max_size, MAX_PACK_SIZE)
+    packs: list[PackedPrompt] = []
+    group: list[tuple[int, str]] = []
+
+    def flush():
+        if group:
+            text = _submission([line for _, line in group])
+            packs.append(PackedPrompt(text, list(group)))
+            group.clear()
+
+    for i, line in enumerate(lines):
+        try:
+            split_prompt_options(line)
+        except ValueError:
+            flush()
+            # Left alone, so the batch reports the problem for this line
+            packs.append(PackedPrompt(line, [(i + 1, line)]))
+            continue
+        if (
+            group
+            and len(group) < max_size
+            and _submission([member for _, member in group] + [line]) is not None
+        ):
+            group.append((i + 1, line))
+            continue
+        flush()
+        group.append((i + 1, line))
+    flush()
+    return packs
+
+
+def split_pack(pack: PackedPrompt, max_size: int) -> list[PackedPrompt]:
+    """
+    Function to split a submission into submissions of at most `max_size` lines.
+
+    Parameters:
+    - pack (PackedPrompt): The submission.
+    - max_size (int): Most lines in one submission.
+
+    Returns:
+    - list[PackedPrompt]: The submissions, in order, with the lines' own sequence numbers.
+    """
+    if len(pack.members) <= max_size:
+        return [pack]
+    lines = [line for _, line in pack.members]
+    return [
+        PackedPrompt(part.text, [pack.members[i - 1] for i, _ in part.members])
+        for part in pack_prompts(lines, max_size)
+    ]
@@ -0,0 +1,755 @@
+import asyncio
+import collections
+import random
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Sized
+
+from loguru import logger
+from playwright.async_api import async_playwright
+
+from adaptive import AimdController, create_controller
+from config import Settings, SettingsWatcher
+from control import BatchCancelled, BatchControl, JobSkipped
+from dom_selectors import registry
+from download_profiles import DownloadProfile, split_prompt_options
+from logging_setup import set_job_context
+from packing import PackedPrompt, pack_prompts, split_pack
+from preview import GRID as GRID_PREVIEW
+from preview import OFF, GridPreview, save_grid_preview
+from profiling import JobProfiler
+from storage import ShardedStorage, create_storage
+from router import GRID, UPSCALE, MessageRouter, prompt_key
+from utils import (
+    ChannelMessage,
+    DownloadResult,
+    DownloadStatus,
+    acquire_channel_page,
+    confirm_submission,
+    read_messages,
+    save_message_images,
+    select_upscale_option,
+    submit_prompt,
+)
+from workflow import (
+    DEFAULT_WORKFLOW,
+    NUMBERED_ACTIONS,
+    Workflow,
+    WorkflowNode,
+    default_workflow,
+    load_workflows,
+)
+
+
+@dataclass
+class BatchOptions:
+    """
+    Choices made for one batch, on top of the `Settings`.
+
+    Attributes:
+    - bot_command (str): The slash command used to submit prompts.
+    - output_dir (str): Directory to write the images into. Defaults to `Settings.output_dir`.
+    - upscale (bool): Run `Upscale (Subtle)` on the selected images.
+    - download_profile (str): Rendition to download, e.g. ``webp:2048``. Defaults to `Settings.download_profile`.
+    - workflow (str): Name of the workflow run on each prompt. Defaults to `Settings.workflow`.
+    - review (Callable[[GridPreview], set[int]]): Called with each job's grid preview; returns the
+      image numbers (1-4) not to upscale or vary. May be a coroutine function.
+    - review_timeout (float): Seconds the workflow waits for `review` before going on without it.
+    """
+
+    bot_command: str = "/imagine"
+    output_dir: str = None
+    upscale: bool = False
+    download_profile: str = None
+    workflow: str = None
+    review: Callable[[GridPreview], Awaitable[set[int]] | set[int]] = None
+    review_timeout: float = 120
+
+
+@dataclass
+class JobEvent:
+    """A job entered a new stage."""
+
+    job_id: str
+    sequence_number: int
+    prompt: str
+    stage: str
+    elapsed: float
+
+
+@dataclass
+class BatchStats:
+    """Running totals of a batch, with throughput and ETA derived from them."""
+
+    total: int
+    completed: int = 0
+    failed: list[int] = field(default_factory=list)
+    skipped: list[int] = field(default_factory=list)
+    bytes_saved: dict[str, int] = field(default_factory=dict)
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def processed(self) -> int:
+        return self.completed + len(self.failed) + len(self.skipped)
+
+    @property
+    def throughput(self) -> float:
+        """Jobs processed per hour so far."""
+        elapsed = time.monotonic() - self.started_at
+        return self.processed * 3600 / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> float:
+        """Seconds until the remaining jobs are processed, or None before the first job finishes."""
+        if not self.processed:
+            return None
+        elapsed = time.monotonic() - self.started_at
+        return elapsed / self.processed * (self.total - self.processed)
+
+
+async def _iterate(prompts: Iterable[str] | AsyncIterable[str]) -> AsyncIterator[str]:
+    """Yield the lines of a list, or of an async source that produces them on demand."""
+    if isinstance(prompts, AsyncIterable):
+        async for line in prompts:
+            yield line
+    else:
+        for line in prompts:
+            yield line
+
+
+async def _submissions(
+    prompts: Iterable[str] | AsyncIterable[str], pack_size: int
+) -> AsyncIterator[PackedPrompt]:
+    """
+    Yield the submissions of a batch: the packed groups of a prompt list when
+    `pack_size` is above 1, one submission per line otherwise. Streamed
+    prompts are never packed.
+    """
+    if pack_size > 1 and isinstance(prompts, Sized):
+        for pack in pack_prompts(list(prompts), pack_size):
+            yield pack
+        return
+    sequence_number = 0
+    async for line in _iterate(prompts):
+        sequence_number += 1
+        yield PackedPrompt(line, [(sequence_number, line)])
+
+
+def _stage_durations(stage_log: list[tuple[str, float]]) -> dict[str, float]:
+    """Turn (stage, start time) pairs into seconds spent in each stage but the last."""
+    return {
+        stage: round(next_started - started, 3)
+        for (stage, started), (_, next_started) in zip(stage_log, stage_log[1:])
+    }
+
+
+async def process_prompt(
+    router: MessageRouter,
+    prompt: str,
+    sequence_number: int,
+    options: BatchOptions,
+    settings: Settings,
+    control: BatchControl,
+    on_stage: Callable[[str], None],
+    storage: ShardedStorage,
+    job_id: str,
+    profile: DownloadProfile = None,
+    workflow: Workflow = None,
+    submitted: asyncio.Future = None,
+    on_grid: Callable[[float], None] = None,
+) -> DownloadResult:
+    """
+    Function to submit one prompt and run its workflow.
+
+    Every node of the workflow runs as its own task and starts as soon as its
+    parent has clicked, so sibling branches proceed together. A node's stage
+    covers waiting for the replies it acts on and acting on them. With a grid
+    preview enabled, the grid is stored alongside, while the first buttons
+    are clicked; with a review hook, the nodes picking images of the grid
+    wait for its verdict.
+
+    Parameters:
+    - router (MessageRouter): Routes the channel's replies to this job.
+    - prompt (str): The prompt text.
+    - sequence_number (int): Position of the prompt in the batch.
+    - options (BatchOptions): The batch choices.
+    - settings (Settings): The settings in effect for this job.
+    - control (BatchControl): The control channel, checked between stages.
+    - on_stage (Callable[[str], None]): Called with the name of each stage as it starts.
+    - storage (ShardedStorage): Where the images are written and recorded.
+    - job_id (str): Identifier of the job in the output manifest.
+    - profile (DownloadProfile): Rendition to download. Defaults to the original.
+    - workflow (Workflow): The actions to run. Defaults to `default_workflow` for the settings.
+    - submitted (asyncio.Future): Set once a packed submission including this prompt was sent.
+      The job then does not submit the prompt itself.
+    - on_grid (Callable[[float], None]): Called with the seconds from submitting to the finished grid.
+
+    Returns:
+    - DownloadResult: The files downloaded by the workflow and how the job ended.
+    """
+    number_of_images = settings.number_of_upscaled_images
+    workflow = workflow or default_workflow(number_of_images, options.upscale)
+    key = prompt_key(prompt)
+    timeouts = {
+        GRID: settings.wait_for_upscale_timeout,
+        UPSCALE: settings.wait_for_download_timeout,
+    }
+    parameters = {
+        "bot_command": options.bot_command,
+        "upscale": options.upscale,
+        "number_of_images": number_of_images,
+        "workflow": workflow.name,
+    }
+    several_downloads = len(workflow.downloads) > 1
+    loop = asyncio.get_running_loop()
+    # Replies each node will produce, known once it has clicked. None is the prompt's grid.
+    produced: dict[str, asyncio.Future] = {
+        node.id: loop.create_future() for node in workflow.nodes
+    }
+    produced[None] = loop.create_future()
+    paths: list[str] = []
+    bytes_saved = 0
+    preview_mode = settings.grid_preview
+    if options.review and preview_mode == OFF:
+        preview_mode = GRID_PREVIEW
+    # Image numbers of the grid rejected by the review hook
+    verdict = loop.create_future()
+
+    async def run_preview():
+        rejected = set()
+        try:
+            grid = await router.wait(await produced[None], timeouts[GRID])
+            preview = await save_grid_preview(
+                grid[0],
+                prompt,
+                storage,
+                preview_mode,
+                sequence_number=sequence_number,
+                job_id=job_id,
+                parameters=parameters,
+            )
+            if options.review:
+                if asyncio.iscoroutinefunction(options.review):
+                    review = options.review(preview)
+                else:
+                    review = asyncio.to_thread(options.review, preview)
+                rejected = set(await asyncio.wait_for(review, options.review_timeout))
+                if rejected:
+                    logger.info(f"Review rejected images {sorted(rejected)} of the grid.")
+        except TimeoutError:
+            logger.warning("No grid preview or review in time; going on without it.")
+        except Exception as e:
+            logger.warning(f"Grid preview failed: {e}")
+        finally:
+            verdict.set_result(rejected)
+
+    async def time_grid(grid, submitted_at: float):
+        await grid.done.wait()
+        on_grid(time.monotonic() - submitted_at)
+
+    async def run_node(node: WorkflowNode):
+        nonlocal bytes_saved
+        expectation = await produced[node.after]
+        on_stage(node.id)
+        messages = await router.wait(expectation, timeouts[expectation.kind])
+        messages = messages[: node.limit] if node.limit else messages
+        rejected = set()
+        if options.review and node.after is None and node.action in NUMBERED_ACTIONS:
+            rejected = await verdict
+        await control.checkpoint()
+
+        if node.action == "download":
+            bytes_saved += await save_message_images(
+                messages,
+                prompt,
+                storage,
+                paths,
+                sequence_number=sequence_number,
+                job_id=job_id,
+                parameters=parameters,
+                profile=profile,
+                name_suffix=f"_{node.id}" if several_downloads else "",
+            )
+            return
+
+        clicks = [
+            (m, label) for m in messages for label in node.buttons(random.sample, rejected)
+        ]
+        replies = router.expect(key, node.produces, len(clicks))
+        for message, label in clicks:
+            async with router.lock:
+                await select_upscale_option(router.page, label, message.id)
+            await asyncio.sleep(random.randint(5, 10))
+        produced[node.id].set_result(replies)
+
+    tasks = []
+    try:
+        on_stage("submit")
+        grid = router.expect(key, GRID, 1)
+        if submitted is not None:
+            # Shared by the jobs of the pack, so skipping this one must not cancel it
+            await asyncio.shield(submitted)
+        else:
+            async with router.lock:
+                await submit_prompt(
+                    router.page,
+                    options.bot_command,
+                    prompt,
+                    fast=settings.fast_submit,
+                    placeholder=settings.message_placeholder,
+                )
+        produced[None].set_result(grid)
+        await control.checkpoint()
+
+        tasks = [asyncio.create_task(run_node(node)) for node in workflow.nodes]
+        if on_grid:
+            tasks.append(asyncio.create_task(time_grid(grid, time.monotonic())))
+        if preview_mode != OFF:
+            tasks.append(asyncio.create_task(run_preview()))
+        await asyncio.gather(*tasks)
+        return DownloadResult(DownloadStatus.DOWNLOADED, paths, bytes_saved=bytes_saved)
+    except BatchCancelled:
+        raise
+    except TimeoutError as e:
+        logger.warning(f"Gave up waiting for the bot: {e}")
+        return DownloadResult(DownloadStatus.TIMED_OUT, paths, e, bytes_saved)
+    except Exception as e:
+        logger.error(f"An error occurred while running workflow {workflow.name}: {e}")
+        return DownloadResult(DownloadStatus.ERROR, paths, e, bytes_saved)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class JobScheduler:
+    """
+    The job slots, pacing and message router of one channel tab, shared by
+    every batch running on it.
+
+    Batches started with the same scheduler run side by side: together they
+    keep at most `limit` jobs in flight (a packed submission holds a slot for
+    each of its jobs), their submissions are spaced by the job pacing, and
+    one router sends each reply to its job whichever batch it belongs to. With a `controller` the limit follows Midjourney's
+    load (see `adaptive`); otherwise it is `concurrency`.
+    """
+
+    def __init__(self, page, concurrency: int = 1, controller: AimdController = None):
+        self.page = page
+        self.concurrency = concurrency
+        self.controller = controller
+        self.router = MessageRouter(page, on_throttle=self._on_throttle)
+        self.in_flight = 0
+        self._freed = asyncio.Event()
+        self._batches = 0
+        self._last_submit: float = None
+
+    @property
+    def limit(self) -> int:
+        """Jobs allowed in flight now."""
+        return self.controller.limit if self.controller else self.concurrency
+
+    async def acquire(self):
+        """Wait for a free job slot and take it."""
+        while self.in_flight >= self.limit:
+            self._freed.clear()
+            await self._freed.wait()
+        self.in_flight += 1
+
+    def take(self, count: int) -> int:
+        """Take up to `count` of the free job slots without waiting. Returns how many were taken."""
+        taken = max(min(count, self.limit - self.in_flight), 0)
+        self.in_flight += taken
+        return taken
+
+    def release(self):
+        """Give back a job slot."""
+        self.in_flight -= 1
+        self._freed.set()
+
+    def on_grid(self, latency: float):
+        """Feed the latency of a grid to the controller, which may allow more jobs."""
+        if self.controller:
+            self.controller.on_grid(latency, self.in_flight)
+            self._freed.set()
+
+    def _on_throttle(self, message: ChannelMessage):
+        if self.controller:
+            self.controller.on_throttle(message.text, self.in_flight)
+
+    async def attach(self):
+        """Register a batch, starting the router for the first one."""
+        self._batches += 1
+        if self._batches == 1:
+            await self.router.start()
+
+    async def detach(self):
+        """Unregister a batch, stopping the router after the last one."""
+        self._batches -= 1
+        if not self._batches:
+            await self.router.stop()
+
+    async def pace(self, control: BatchControl, settings: Settings):
+        """
+        Wait until the next submission is due, `job_pacing` after the one before, in any batch.
+        With a `controller` the pause is scaled by its `pacing`.
+        """
+        now = time.monotonic()
+        if self._last_submit is None:
+            self._last_submit = now
+            return
+        gap = random.uniform(settings.job_pacing_min, settings.job_pacing_max)
+        if self.controller:
+            gap *= self.controller.pacing
+        # Reserved before sleeping, so concurrent batches queue up behind each other
+        self._last_submit = max(self._last_submit, now) + gap
+        await control.sleep(self._last_submit - now)
+
+
+async def run_batch(
+    page,
+    prompts: Iterable[str] | AsyncIterable[str],
+    options: BatchOptions,
+    settings: Settings,
+    control: BatchControl = None,
+    on_stage: Callable[[JobEvent], None] = None,
+    on_progress: Callable[[BatchStats], None] = None,
+    watcher: SettingsWatcher = None,
+    scheduler: JobScheduler = None,
+) -> BatchStats:
+    """
+    Function to run every prompt of a batch on an already opened channel page.
+
+    Up to `Settings.concurrency` submissions are in flight at once, or with
+    `Settings.adaptive_concurrency` as many as the load allows. Prompts
+    are submitted in order, spaced by the job pacing, and a prompt waits
+    while another job with the same prompt is in flight. With
+    `Settings.pack_prompts`, consecutive lines are packed into one
+    submission (see `packing`) and still run as one job each. Batches given
+    the same `scheduler` share its slots and pacing.
+
+    Parameters:
+    - page: The page object representing the current browser context.
+    - prompts (Iterable[str] | AsyncIterable[str]): The prompts to submit, in order. Options may follow
+      ``##`` (see `split_prompt_options`). An async source is read one prompt at a time, as slots free up.
+    - options (BatchOptions): The batch choices.
+    - settings (Settings): The validated settings to start with.
+    - control (BatchControl): Control channel for pause, skip and cancel.
+    - on_stage (Callable[[JobEvent], None]): Called whenever a job enters a stage.
+    - on_progress (Callable[[BatchStats], None]): Called after each job with the running totals.
+    - watcher (SettingsWatcher): Polled between jobs so edits to `.env` apply to the running batch.
+    - scheduler (JobScheduler): Shared with other batches on the same page. Defaults to one of its own.
+
+    Returns:
+    - BatchStats: The totals. `BatchCancelled` is raised if the batch was cancelled,
+      `SelectorError` if the page does not match the selector registry and
+      `ValueError` if the batch's workflow is not defined.
+    """
+    control = control or BatchControl()
+    # Streamed prompts are counted as they arrive
+    streamed = not isinstance(prompts, Sized)
+    stats = BatchStats(total=0 if streamed else len(prompts))
+    workflows = load_workflows()
+    batch_workflow = options.workflow or settings.workflow
+    if batch_workflow != DEFAULT_WORKFLOW and batch_workflow not in workflows:
+        raise ValueError(f"Unknown workflow {batch_workflow!r}.")
+
+    def storage_location(settings: Settings) -> tuple[str, int]:
+        return options.output_dir or settings.output_dir, settings.output_shard_depth
+
+    scheduler = scheduler or JobScheduler(page, settings.concurrency, create_controller(settings))
+    router = scheduler.router
+    # Fail within seconds, not after hours of timeouts, if Discord changed its markup
+    await registry().self_test(
+        page,
+        options.bot_command,
+        placeholder=settings.message_placeholder,
+        lock=router.lock,
+    )
+
+    location = storage_location(settings)
+    storage = create_storage(settings, location[0])
+    # Storages replaced by a settings change, closed once their jobs are done
+    retired: list[ShardedStorage] = []
+    profiler = JobProfiler(settings)
+    jobs: set[asyncio.Task] = set()
+
+    async def run_job(
+        sequence_number: int,
+        prompt: str,
+        workflow: Workflow,
+        download_profile: DownloadProfile,
+        settings: Settings,
+        storage: ShardedStorage,
+        submitted: asyncio.Future = None,
+    ):
+        job_id = uuid.uuid4().hex
+        started = time.monotonic()
+        job_profile = (
+            profiler.job(page.context, job_id, prompt) if profiler.enabled else None
+        )
+        stage_log: list[tuple[str, float]] = []
+
+        def report(stage: str):
+            stage_log.append((stage, time.monotonic()))
+            set_job_context(job_id=job_id, sequence_number=sequence_number, stage=stage)
+            if job_profile:
+                job_profile.stage(stage)
+            if on_stage:
+                on_stage(
+                    JobEvent(
+                        job_id,
+                        sequence_number,
+                        prompt,
+                        stage,
+                        time.monotonic() - started,
+                    )
+                )
+
+        status = "error"
+        try:
+            if job_profile:
+                await job_profile.start()
+            result = await control.run_job(
+                process_prompt(
+                    router,
+                    prompt,
+                    sequence_number,
+                    options,
+                    settings,
+                    control,
+                    report,
+                    storage,
+                    job_id,
+                    download_profile,
+                    workflow,
+                    submitted,
+                    scheduler.on_grid,
+                )
+            )
+            if result.bytes_saved:
+                stats.bytes_saved[download_profile.name] = (
+                    stats.bytes_saved.get(download_profile.name, 0) + result.bytes_saved
+                )
+            if result.ok:
+                stats.completed += 1
+            else:
+                stats.failed.append(sequence_number)
+                logger.error(
+                    f"Prompt {sequence_number} produced no images ({result.status.value}): {result.error}"
+                )
+            status = result.status.value
+            report(status)
+            if result.ok:
+                # Only clean runs feed the dry-run planner's estimates
+                storage.record_timings(job_id, _stage_durations(stage_log))
+        except JobSkipped:
+            status = "skipped"
+            stats.skipped.append(sequence_number)
+            report(status)
+        except BatchCancelled:
+            status = "cancelled"
+            report(status)
+            raise
+        finally:
+            router.close(prompt_key(prompt))
+            if job_profile:
+                await job_profile.finish(status)
+
+        logger.bind(duration=round(time.monotonic() - started, 3)).info(
+            f"Iteration {sequence_number} completed."
+        )
+        if on_progress:
+            on_progress(stats)
+
+    async def run_submission(pack: PackedPrompt, members: list[tuple], settings, storage):
+        """
+        Run the jobs of one submission, sending a packed submission for them if
+        needed. Each job gives back its slot when it ends.
+        """
+
+        async def run_member(member, submitted=None):
+            try:
+                await run_job(*member, settings, storage, submitted)
+            finally:
+                scheduler.release()
+
+        if not pack.packed:
+            await run_member(members[0])
+            return
+        submitted = asyncio.get_running_loop().create_future()
+        member_jobs = [asyncio.create_task(run_member(member, submitted)) for member in members]
+        try:
+            async with router.lock:
+                last = await read_messages(router.page, tail=1)
+                await submit_prompt(
+                    router.page,
+                    options.bot_command,
+                    pack.text,
+                    fast=settings.fast_submit,
+                    placeholder=settings.message_placeholder,
+                )
+                # The bot asks before running several jobs from one prompt
+                confirmation = await confirm_submission(
+                    router.page, last[-1].id if last else None
+                )
+            router.ignore(confirmation.id)
+            submitted.set_result(None)
+            logger.info(
+                f"Submitted prompts {', '.join(str(m[0]) for m in members)} as: {pack.text}"
+            )
+        except Exception as e:
+            submitted.set_exception(e)
+        for result in await asyncio.gather(*member_jobs, return_exceptions=True):
+            if isinstance(result, BaseException):
+                raise result
+
+    def reap():
+        """Forget finished jobs, re-raising the first error one of them hit."""
+        for task in [task for task in jobs if task.done()]:
+            jobs.discard(task)
+            if not task.cancelled() and task.exception():
+                raise task.exception()
+
+    try:
+        await scheduler.attach()
+        submissions = _submissions(prompts, settings.pack_prompts)
+        # The rest of packs split to fit the free slots, submitted first
+        leftovers: collections.deque[PackedPrompt] = collections.deque()
+        while True:
+            await control.checkpoint()
+            # Pull the next prompt only once a slot is free, so a streamed
+            # source such as a job queue is not drained ahead of the batch.
+            await scheduler.acquire()
+            held = 1
+            launched = False
+            try:
+                reap()
+                if leftovers:
+                    pack = leftovers.popleft()
+                else:
+                    pack = await anext(submissions, None)
+                    if pack is None:
+                        break
+                    if streamed:
+                        stats.total += len(pack.members)
+                if pack.packed:
+                    # A packed submission starts all its jobs at once, so it
+                    # is cut down to the slots free now
+                    held += scheduler.take(len(pack.members) - 1)
+                    pack, *rest = split_pack(pack, held)
+                    leftovers.extendleft(reversed(rest))
+
+                if watcher:
+                    settings = watcher.poll()
+                    if storage_location(settings) != location:
+                        retired.append(storage)
+                        location = storage_location(settings)
+                        storage = create_storage(settings, location[0])
+                    profiler.settings = settings
+
+                members = []
+                for sequence_number, line in pack.members:
+                    try:
+                        prompt, prompt_options = split_prompt_options(line)
+                        download_profile = DownloadProfile.parse(
+                            prompt_options.pop("profile", None)
+                            or options.download_profile
+                            or settings.download_profile
+                        )
+                        workflow_name = prompt_options.pop("workflow", None) or batch_workflow
+                        if workflow_name == DEFAULT_WORKFLOW:
+                            workflow = default_workflow(
+                                settings.number_of_upscaled_images, options.upscale
+                            )
+                        elif workflow_name in workflows:
+                            workflow = workflows[workflow_name]
+                        else:
+                            raise ValueError(f"unknown workflow {workflow_name!r}")
+                    except ValueError as e:
+                        logger.error(f"Prompt {sequence_number} not submitted: {e}")
+                        stats.failed.append(sequence_number)
+                        if on_progress:
+                            on_progress(stats)
+                        continue
+                    if prompt_options:
+                        logger.warning(
+                            f"Prompt {sequence_number}: ignoring unknown options {', '.join(prompt_options)}"
+                        )
+                    members.append((sequence_number, prompt, workflow, download_profile))
+                if not members:
+                    continue
+
+                # Replies to two jobs with the same prompt could not be told apart
+                keys = {prompt_key(member[1]) for member in members}
+                while any(router.is_busy(key) for key in keys):
+                    await control.sleep(1)
+                    reap()
+                await scheduler.pace(control, settings)
+
+                for member in members:
+                    router.open(prompt_key(member[1]))
+                jobs.add(
+                    asyncio.create_task(run_submission(pack, members, settings, storage))
+                )
+                launched = True
+            finally:
+                # The jobs launched give back their own slots
+                for _ in range(held - (len(members) if launched else 0)):
+                    scheduler.release()
+
+        while jobs:
+            await asyncio.wait(jobs, return_when=asyncio.FIRST_COMPLETED)
+            reap()
+
+        for name, saved in stats.bytes_saved.items():
+            logger.info(f"Download profile {name} saved {saved / 1024 / 1024:.1f} MB this batch.")
+    finally:
+        for task in jobs:
+            task.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+        await scheduler.detach()
+        for old_storage in retired:
+            old_storage.close()
+        storage.close()
+
+    return stats
+
+
+async def main(bot_command: str, settings: Settings, PROMPTS: list[str]):
+    """
+    Main function that starts the bot and interacts with the page.
+
+    Parameters:
+    - bot_command (str): The command for the bot to execute.
+    - settings (Settings): The validated settings.
+    - PROMPTS (str): List of text prompt.
+
+    Returns:
+    - None
+    """
+    try:
+        browser = None
+        async with async_playwright() as p:
+            browser = await p.chromium.connect_over_cdp(settings.cdp_url)
+            page = await acquire_channel_page(
+                browser, settings.channel_url, settings.message_placeholder
+            )
+
+            stats = await run_batch(
+                page,
+                PROMPTS,
+                BatchOptions(bot_command=bot_command),
+                settings,
+                watcher=SettingsWatcher(settings),
+            )
+            if stats.failed:
+                logger.error(f"Prompts that produced no images: {stats.failed}")
+
+    except Exception as e:
+        logger.error(f"Error occurred: {e} while executing the main function.")
+        raise e
+    finally:
+        if browser:
+            await browser.close()
@@ -0,0 +1,191 @@
+"""
+Dry-run capacity planning: how long a batch will take and what it will cost,
+worked out from the prompt file and the output manifest without opening
+Discord.
+
+Stage durations come from the `timings` recorded for earlier successful jobs
+in the same output directory; stages with no history use conservative
+defaults. Wait times in the upscale stages stand in for GPU time, since that
+is where Midjourney renders.
+"""
+
+import math
+import os
+import statistics
+from dataclasses import dataclass, field
+
+from config import Settings
+from download_profiles import DownloadProfile, split_prompt_options
+from packing import pack_prompts
+from storage import MANIFEST_NAME, ShardedStorage
+
+DEFAULT_STAGE_SECONDS = {
+    "submit": 15.0,
+    "upscale": 75.0,
+    "super_upscale": 90.0,
+    "download": 45.0,
+}
+GPU_STAGES = ("upscale", "super_upscale")
+DEFAULT_FILE_BYTES = 6 * 1024 * 1024
+
+
+@dataclass
+class BatchPlan:
+    """
+    Projection of one batch.
+
+    Attributes:
+    - prompts (int): Non-empty lines in the prompt source.
+    - duplicates (int): Lines repeating an earlier prompt of the same source.
+    - already_done (int): Prompts that already have files in the manifest.
+    - invalid (int): Lines with options that cannot be parsed.
+    - jobs (int): Prompts that would actually be submitted.
+    - submissions (int): `/imagine` submissions for those jobs, fewer than `jobs` when prompts are packed.
+    - concurrency (int): Jobs assumed in flight at once.
+    - stage_seconds (dict[str, float]): Expected duration of each stage of one job.
+    - samples (dict[str, int]): Historical runs behind each stage estimate; 0 means a default was used.
+    - pacing_seconds (float): Average pause after each submission.
+    - wall_clock_seconds (float): Projected duration of the whole batch.
+    - jobs_per_hour (float): Projected throughput.
+    - gpu_minutes (float): Projected Midjourney GPU time.
+    - download_bytes (float): Projected size of the downloaded images.
+    """
+
+    prompts: int
+    duplicates: int
+    already_done: int
+    invalid: int
+    jobs: int
+    concurrency: int
+    submissions: int = 0
+    stage_seconds: dict[str, float] = field(default_factory=dict)
+    samples: dict[str, int] = field(default_factory=dict)
+    pacing_seconds: float = 0.0
+    wall_clock_seconds: float = 0.0
+    jobs_per_hour: float = 0.0
+    gpu_minutes: float = 0.0
+    download_bytes: float = 0.0
+
+
+def plan_batch(
+    prompts: list[str],
+    settings: Settings,
+    concurrency: int = 1,
+    upscale: bool = False,
+    download_profile: str = None,
+    output_dir: str = None,
+) -> BatchPlan:
+    """
+    Function to project the duration, throughput and GPU usage of a batch.
+
+    Parameters:
+    - prompts (list[str]): The lines of the prompt source, options included.
+    - settings (Settings): The settings the batch would run with.
+    - concurrency (int): Jobs in flight at once.
+    - upscale (bool): Whether the batch runs `Upscale (Subtle)`.
+    - download_profile (str): The batch's download profile. Defaults to `Settings.download_profile`.
+    - output_dir (str): Output directory holding the manifest. Defaults to `Settings.output_dir`.
+
+    Returns:
+    - BatchPlan: The projection.
+    """
+    concurrency = max(1, concurrency)
+    output_dir = output_dir or settings.output_dir
+    batch_profile = download_profile or settings.download_profile
+
+    history: dict[str, list[float]] = {}
+    done: set[str] = set()
+    file_bytes: dict[str, float] = {}
+    # Only read an existing manifest; a dry run should not create one.
+    if os.path.exists(os.path.join(output_dir, MANIFEST_NAME)):
+        storage = ShardedStorage(output_dir, settings.output_shard_depth)
+        try:
+            history = storage.stage_timings()
+            done = storage.prompts()
+            file_bytes = storage.average_file_bytes()
+        finally:
+            storage.close()
+
+    seen: set[str] = set()
+    counts = {"prompts": 0, "duplicates": 0, "already_done": 0, "invalid": 0}
+    profiles: list[str] = []
+    lines: list[str] = []
+    for line in prompts:
+        if not line.strip():
+            continue
+        counts["prompts"] += 1
+        try:
+            prompt, options = split_prompt_options(line)
+            profile = DownloadProfile.parse(options.get("profile") or batch_profile)
+        except ValueError:
+            counts["invalid"] += 1
+            continue
+        if prompt in seen:
+            counts["duplicates"] += 1
+            continue
+        seen.add(prompt)
+        if prompt in done:
+            counts["already_done"] += 1
+            continue
+        profiles.append(profile.name)
+        lines.append(line)
+
+    stages = ["submit", "upscale"] + (["super_upscale"] if upscale else []) + ["download"]
+    stage_seconds, samples = {}, {}
+    for stage in stages:
+        runs = history.get(stage, [])
+        samples[stage] = len(runs)
+        stage_seconds[stage] = statistics.median(runs) if runs else DEFAULT_STAGE_SECONDS[stage]
+
+    jobs = len(profiles)
+    submissions = len(pack_prompts(lines, settings.pack_prompts)) if jobs else 0
+    pacing = (settings.job_pacing_min + settings.job_pacing_max) / 2
+    work = sum(stage_seconds.values())
+    # Submissions are spaced by one pacing gap across all slots, so the batch
+    # is bound by whichever runs out first: the gaps or the slots. Packed
+    # prompts share one submission and its gap.
+    pacing_bound = max(submissions - 1, 0) * pacing + work if jobs else 0.0
+    slot_bound = math.ceil(jobs / concurrency) * work
+    rates = [concurrency / work]
+    if pacing and submissions:
+        rates.append(jobs / submissions / pacing)
+    per_file = file_bytes.get("original", DEFAULT_FILE_BYTES)
+
+    return BatchPlan(
+        jobs=jobs,
+        submissions=submissions,
+        concurrency=concurrency,
+        stage_seconds=stage_seconds,
+        samples=samples,
+        pacing_seconds=pacing,
+        wall_clock_seconds=max(pacing_bound, slot_bound),
+        jobs_per_hour=3600 * min(rates),
+        gpu_minutes=jobs * sum(stage_seconds.get(s, 0.0) for s in GPU_STAGES) / 60,
+        download_bytes=settings.number_of_upscaled_images
+        * sum(file_bytes.get(name, per_file) for name in profiles),
+        **counts,
+    )
+
+
+def _duration(seconds: float) -> str:
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}h {rest // 60:02d}m"
+
+
+def format_plan(plan: BatchPlan) -> str:
+    """Return a short human readable report of `plan`."""
+    lines = [
+        f"Prompts: {plan.prompts} ({plan.duplicates} duplicate, "
+        f"{plan.already_done} already downloaded, {plan.invalid} invalid)",
+        f"Jobs to run: {plan.jobs} in {plan.submissions} submissions at concurrency {plan.concurrency}",
+        f"Wall clock: {_duration(plan.wall_clock_seconds)} "
+        f"({plan.jobs_per_hour:.1f} jobs/h)",
+        f"GPU time: {plan.gpu_minutes / 60:.1f} h ({plan.gpu_minutes:.0f} min)",
+        f"Download: {plan.download_bytes / 1024 ** 3:.2f} GB",
+        "Per job:",
+    ]
+    for stage, seconds in plan.stage_seconds.items():
+        source = f"{plan.samples[stage]} runs" if plan.samples[stage] else "default"
+        lines.append(f"  {stage}: {seconds:.0f}s ({source})")
+    lines.append(f"  pacing: {plan.pacing_seconds:.0f}s per submission (settings)")
+    return "\n".join(lines)
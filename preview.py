@@ -0,0 +1,157 @@
+"""
+Grid previews: the 2x2 grid of a job, stored as soon as the bot posts it.
+
+With `GRID_PREVIEW=grid` the grid image is downloaded while the upscale
+buttons are being clicked, so reviewers can look at a job minutes before its
+upscales finish. `GRID_PREVIEW=tiles` also splits it into its four images,
+numbered like the U buttons (1 top left, 2 top right, 3 bottom left,
+4 bottom right). Splitting needs the optional `Pillow` package and runs on a
+process pool, off the event loop.
+
+A review hook (`BatchOptions.review`) can look at the preview and reject
+some of the four images; the job's workflow then does not upscale or vary
+them.
+"""
+
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import requests
+from loguru import logger
+
+from storage import ManifestEntry, ShardedStorage
+from utils import ChannelMessage, build_image_name
+
+OFF = "off"
+GRID = "grid"
+TILES = "tiles"
+MODES = (OFF, GRID, TILES)
+
+_pool: ProcessPoolExecutor = None
+_warned_no_pillow = False
+
+
+@dataclass
+class GridPreview:
+    """
+    The stored preview of one job's grid.
+
+    Attributes:
+    - job_id (str): The job.
+    - prompt (str): The prompt of the job.
+    - sequence_number (int): Position of the prompt in the batch.
+    - message (ChannelMessage): The grid message.
+    - grid_path (str): Location of the grid image.
+    - tile_paths (list[str]): Locations of the four tiles, in button order; empty without tiles.
+    """
+
+    job_id: str
+    prompt: str
+    sequence_number: int
+    message: ChannelMessage
+    grid_path: str
+    tile_paths: list[str] = field(default_factory=list)
+
+
+def split_grid(data: bytes) -> list[bytes]:
+    """Split a 2x2 grid image into its four PNG tiles, in button order. Runs in a worker process."""
+    from PIL import Image
+
+    tiles = []
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        for top in (0, height // 2):
+            for left in (0, width // 2):
+                buffer = io.BytesIO()
+                image.crop((left, top, left + width // 2, top + height // 2)).save(buffer, "PNG")
+                tiles.append(buffer.getvalue())
+    return tiles
+
+
+def _can_split() -> bool:
+    global _warned_no_pillow
+    try:
+        import PIL  # noqa: F401
+
+        return True
+    except ImportError:
+        if not _warned_no_pillow:
+            logger.warning(
+                "GRID_PREVIEW=tiles needs Pillow (`pip install Pillow`); storing whole grids only."
+            )
+            _warned_no_pillow = True
+        return False
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+    return _pool
+
+
+def _fetch(url: str) -> bytes:
+    response = requests.get(url, timeout=60)
+    response.raise_for_status()
+    return response.content
+
+
+async def save_grid_preview(
+    message: ChannelMessage,
+    prompt_text: str,
+    storage: ShardedStorage,
+    mode: str = GRID,
+    sequence_number: int = None,
+    job_id: str = None,
+    parameters: dict = None,
+) -> GridPreview:
+    """
+    Function to store the grid of a job and, in ``tiles`` mode, its four tiles.
+
+    Parameters:
+    - message (ChannelMessage): The grid message.
+    - prompt_text (str): The prompt of the job.
+    - storage (ShardedStorage): Where to write the images and record them.
+    - mode (str): ``grid`` or ``tiles``.
+    - sequence_number (int): Position of the prompt in the batch, if any.
+    - job_id (str): Job identifier recorded in the manifest.
+    - parameters (dict): Job settings recorded in the manifest.
+
+    Returns:
+    - GridPreview: The stored preview. Exceptions from the download are raised.
+    """
+    url = next(iter(message.attachments), None)
+    if not url:
+        raise ValueError("the grid message has no image")
+    data = await asyncio.to_thread(_fetch, url)
+    name = build_image_name(prompt_text, 0, 1, sequence_number) + "_grid"
+
+    def store(file_name: str, content: bytes, **extra) -> str:
+        relative, size = storage.write_stream(file_name, io.BytesIO(content))
+        storage.record(
+            ManifestEntry(
+                job_id=job_id,
+                prompt=prompt_text,
+                path=relative,
+                source_url=url,
+                message_id=message.message_id,
+                parameters=dict(parameters or {}, sequence_number=sequence_number, **extra),
+                bytes=size,
+            )
+        )
+        return storage.location(relative)
+
+    preview = GridPreview(job_id, prompt_text, sequence_number, message, None)
+    preview.grid_path = await asyncio.to_thread(store, f"{name}.png", data, preview=GRID)
+    logger.info(f"Stored grid preview at {preview.grid_path}")
+
+    if mode == TILES and _can_split():
+        tiles = await asyncio.get_running_loop().run_in_executor(_executor(), split_grid, data)
+        for n, tile in enumerate(tiles, start=1):
+            preview.tile_paths.append(
+                await asyncio.to_thread(store, f"{name}_{n}.png", tile, preview="tile", tile=n)
+            )
+    return preview
@@ -0,0 +1,220 @@
+"""
+Opt-in profiling of batch jobs.
+
+A sample of jobs (`PROFILE_SAMPLE_RATE`) is traced with Playwright from the
+start. Any job still running after `PROFILE_SLOW_JOB_SECONDS` is traced from
+that point on, and the asyncio tasks are dumped at that moment so the dump
+shows where the job is stuck. Traced, slow and failed jobs get a folder under
+`PROFILE_TRACE_DIR` with `trace.zip`, `timing.json` and `tasks.txt`; the
+oldest folders are deleted once the directory exceeds `PROFILE_TRACE_MAX_MB`.
+"""
+
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import time
+from datetime import datetime
+
+from loguru import logger
+
+from config import Settings
+
+
+def dump_tasks() -> str:
+    """Return the stack of every task on the running loop, as text."""
+    buffer = io.StringIO()
+    current = asyncio.current_task()
+    for task in asyncio.all_tasks():
+        marker = " (profiler)" if task is current else ""
+        buffer.write(f"{task!r}{marker}\n")
+        task.print_stack(limit=20, file=buffer)
+        buffer.write("\n")
+    return buffer.getvalue()
+
+
+def _folder_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class JobProfile:
+    """
+    Profiling state of one job. Created by `JobProfiler.job`; call `stage`
+    whenever the job moves on and `finish` once it is over.
+    """
+
+    def __init__(
+        self, profiler: "JobProfiler", context, job_id: str, prompt: str, sampled: bool
+    ):
+        self.profiler = profiler
+        self.context = context
+        self.job_id = job_id
+        self.prompt = prompt
+        self.sampled = sampled
+        self.slow = False
+        self.tracing = False
+        self.task_dump = None
+        self.started = time.monotonic()
+        self.stages: list[tuple[str, float]] = []
+        self._watchdog: asyncio.Task = None
+
+    def stage(self, name: str):
+        """Record that the job entered stage `name` now."""
+        self.stages.append((name, time.monotonic() - self.started))
+
+    async def start(self):
+        if self.sampled:
+            await self.profiler._start_tracing(self)
+        threshold = self.profiler.settings.profile_slow_job_seconds
+        if threshold > 0:
+            self._watchdog = asyncio.create_task(self._watch(threshold))
+
+    async def _watch(self, threshold: float):
+        await asyncio.sleep(threshold)
+        self.slow = True
+        self.task_dump = dump_tasks()
+        logger.warning(
+            f"Job {self.job_id[:8]} is still running after {threshold:g}s; profiling it."
+        )
+        if not self.tracing:
+            await self.profiler._start_tracing(self)
+
+    def timing(self, status: str) -> dict:
+        """Return the per-stage timing breakdown of the job."""
+        total = time.monotonic() - self.started
+        breakdown = []
+        for i, (name, offset) in enumerate(self.stages):
+            end = self.stages[i + 1][1] if i + 1 < len(self.stages) else total
+            breakdown.append(
+                {"stage": name, "started": round(offset, 3), "seconds": round(end - offset, 3)}
+            )
+        return {
+            "job_id": self.job_id,
+            "prompt": self.prompt,
+            "status": status,
+            "sampled": self.sampled,
+            "slow": self.slow,
+            "total_seconds": round(total, 3),
+            "stages": breakdown,
+        }
+
+    async def finish(self, status: str):
+        """
+        Stop the watchdog and tracing, and save the profile if the job was
+        sampled, slow, timed out or failed.
+        """
+        if self._watchdog:
+            self._watchdog.cancel()
+            try:
+                await self._watchdog
+            except asyncio.CancelledError:
+                pass
+        keep = self.sampled or self.slow or status in ("timed_out", "error")
+        folder = None
+        if keep:
+            stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            folder = os.path.join(self.profiler.trace_dir, f"{stamp}_{self.job_id[:8]}")
+            os.makedirs(folder, exist_ok=True)
+        if self.tracing:
+            await self.profiler._stop_tracing(
+                self, os.path.join(folder, "trace.zip") if folder else None
+            )
+        if not folder:
+            return
+
+        with open(os.path.join(folder, "timing.json"), "w", encoding="utf-8") as f:
+            json.dump(self.timing(status), f, ensure_ascii=False, indent=2)
+        if self.task_dump:
+            with open(os.path.join(folder, "tasks.txt"), "w", encoding="utf-8") as f:
+                f.write(self.task_dump)
+        logger.info(f"Saved profile of job {self.job_id[:8]} to {folder}")
+        self.profiler.rotate()
+
+
+class JobProfiler:
+    """
+    Decides which jobs to profile and owns the Playwright tracing of the
+    browser context. A context can only record one trace at a time, so a job
+    that wants tracing while another job holds it gets timings only.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self._lock = asyncio.Lock()
+        self._owner: JobProfile = None
+
+    @property
+    def enabled(self) -> bool:
+        return (
+            self.settings.profile_sample_rate > 0
+            or self.settings.profile_slow_job_seconds > 0
+        )
+
+    @property
+    def trace_dir(self) -> str:
+        return self.settings.profile_trace_dir
+
+    def job(self, context, job_id: str, prompt: str) -> JobProfile:
+        """Return the profile of a new job running in browser `context`."""
+        sampled = random.random() < self.settings.profile_sample_rate
+        return JobProfile(self, context, job_id, prompt, sampled)
+
+    async def _start_tracing(self, profile: JobProfile):
+        async with self._lock:
+            if self._owner is not None:
+                logger.debug(
+                    f"Trace already recording for job {self._owner.job_id[:8]}; "
+                    f"job {profile.job_id[:8]} gets timings only."
+                )
+                return
+            try:
+                await profile.context.tracing.start(
+                    name=profile.job_id, screenshots=True, snapshots=True
+                )
+            except Exception as e:
+                logger.warning(f"Could not start tracing: {e}")
+                return
+            self._owner = profile
+            profile.tracing = True
+
+    async def _stop_tracing(self, profile: JobProfile, path: str = None):
+        async with self._lock:
+            if self._owner is not profile:
+                return
+            try:
+                await profile.context.tracing.stop(path=path)
+            except Exception as e:
+                logger.warning(f"Could not save the trace of job {profile.job_id[:8]}: {e}")
+            finally:
+                self._owner = None
+                profile.tracing = False
+
+    def rotate(self):
+        """Delete the oldest saved profiles until the folder fits its size limit."""
+        limit = self.settings.profile_trace_max_mb * 1024 * 1024
+        try:
+            folders = sorted(
+                os.path.join(self.trace_dir, name)
+                for name in os.listdir(self.trace_dir)
+                if os.path.isdir(os.path.join(self.trace_dir, name))
+            )
+        except OSError:
+            return
+        sizes = {folder: _folder_size(folder) for folder in folders}
+        total = sum(sizes.values())
+        # Folder names start with a timestamp, so sorted order is oldest first.
+        for folder in folders[:-1]:
+            if total <= limit:
+                break
+            shutil.rmtree(folder, ignore_errors=True)
+            total -= sizes[folder]
+            logger.info(f"Deleted old profile {folder}")
@@ -0,0 +1,258 @@
+"""
+Routes the Midjourney bot's replies in the channel to the jobs waiting for them.
+
+Several jobs can be in flight at once, so "the last message" no longer
+belongs to the current job. A single poller reads the messages posted since
+the previous poll and hands each finished one to the job whose prompt it
+quotes. Jobs register what they expect (one grid after submitting, one
+upscale per U button clicked, ...) and wait for it.
+"""
+
+import asyncio
+import re
+from typing import Callable
+
+from loguru import logger
+
+from utils import ChannelMessage, MessageCursor, is_upscale_ready, read_messages
+
+GRID = "grid"
+UPSCALE = "upscale"
+
+# Bot replies saying it will not take more work for now
+THROTTLE_PATTERN = re.compile(
+    r"queue (is )?full|job queued|maximum (allowed )?number of (concurrent|queued) jobs"
+    r"|too many (queued |concurrent )?jobs|rate.?limit|slow down",
+    re.IGNORECASE,
+)
+
+
+def message_kind(message: ChannelMessage) -> str:
+    """Return ``grid`` or ``upscale`` for a finished bot reply, None while it is still rendering."""
+    if "U1" in message.buttons:
+        return GRID
+    if is_upscale_ready(message.text):
+        return UPSCALE
+    return None
+
+
+def normalise(text: str) -> str:
+    """Return `text` without markdown, lower-cased, with single spaces."""
+    return " ".join(re.sub(r"[*_`]", "", text).lower().split())
+
+
+def prompt_key(prompt: str) -> str:
+    """
+    Return the part of `prompt` that the bot quotes back in its replies,
+    normalised for matching: the text before any ``--`` parameters, without
+    markdown, lower-cased, with single spaces.
+    """
+    return normalise(prompt.split(" --", 1)[0])
+
+
+class Expectation:
+    """Replies of one kind that a job is waiting for."""
+
+    def __init__(self, key: str, kind: str, count: int):
+        self.key = key
+        self.kind = kind
+        self.count = count
+        self.messages: list[ChannelMessage] = []
+        self.done = asyncio.Event()
+        if count <= 0:
+            self.done.set()
+
+    def add(self, message: ChannelMessage):
+        self.messages.append(message)
+        if len(self.messages) >= self.count:
+            self.done.set()
+
+
+class MessageRouter:
+    """
+    Polls the channel and routes finished replies to the jobs in flight.
+
+    Two jobs with the same prompt key must not be in flight together (see
+    `is_busy`), since their replies could not be told apart; the jobs of a
+    ``--repeat`` submission are the exception, their replies being
+    interchangeable. `lock` is held
+    for every interaction with the page, so typing a prompt, clicking a
+    button and reading the channel never interleave.
+    """
+
+    def __init__(
+        self,
+        page,
+        poll_interval: float = 5.0,
+        tail: int = 50,
+        on_throttle: Callable[[ChannelMessage], None] = None,
+    ):
+        self.page = page
+        self.poll_interval = poll_interval
+        self.tail = tail
+        # Called once for each throttling reply of the bot
+        self.on_throttle = on_throttle
+        self.lock = asyncio.Lock()
+        self._cursor = MessageCursor(page)
+        # Jobs in flight for each prompt key
+        self._open: dict[str, int] = {}
+        self._pending: dict[str, list[Expectation]] = {}
+        self._unclaimed: dict[str, list[ChannelMessage]] = {}
+        # Ids of settled messages, oldest first; only the recent ones can be read again
+        self._routed: dict[str, None] = {}
+        self._throttles: dict[str, None] = {}
+        self._task: asyncio.Task = None
+
+    async def start(self):
+        """Skip the channel history and start polling in the background."""
+        async with self.lock:
+            existing = await read_messages(self.page, tail=self.tail)
+        # Replies already on screen belong to earlier runs
+        for message in existing:
+            self._remember(message.id)
+        if existing:
+            self._cursor.advance(existing[-1].id)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def is_busy(self, key: str) -> bool:
+        """Whether a job with prompt key `key` is in flight."""
+        return key in self._open
+
+    def open(self, key: str):
+        """
+        Start routing replies quoting `key`. Jobs of one ``--repeat``
+        submission share their key and open it once each.
+        """
+        self._open[key] = self._open.get(key, 0) + 1
+        self._pending.setdefault(key, [])
+        self._unclaimed.setdefault(key, [])
+
+    def close(self, key: str):
+        """Stop routing replies quoting `key` once every job that opened it is done; late replies are ignored."""
+        self._open[key] = self._open.get(key, 1) - 1
+        if self._open[key] <= 0:
+            del self._open[key]
+            self._pending.pop(key, None)
+            self._unclaimed.pop(key, None)
+
+    def ignore(self, message_id: str):
+        """Never route `message_id`, e.g. a confirmation the batch answered itself."""
+        self._remember(message_id)
+
+    def expect(self, key: str, kind: str, count: int) -> Expectation:
+        """
+        Register that the job `key` waits for `count` replies of `kind`.
+        Register before the click that triggers them; replies that arrived
+        unasked are claimed first.
+        """
+        expectation = Expectation(key, kind, count)
+        unclaimed = self._unclaimed.get(key, [])
+        for message in [m for m in unclaimed if message_kind(m) == kind][:count]:
+            unclaimed.remove(message)
+            expectation.add(message)
+        if not expectation.done.is_set():
+            self._pending.setdefault(key, []).append(expectation)
+        return expectation
+
+    async def wait(self, expectation: Expectation, timeout: float) -> list[ChannelMessage]:
+        """
+        Function to wait until `expectation` is met.
+
+        Parameters:
+        - expectation (Expectation): What `expect` returned.
+        - timeout (float): Seconds to wait.
+
+        Returns:
+        - list[ChannelMessage]: The replies, in arrival order. `TimeoutError` if they did not all arrive.
+        """
+        try:
+            await asyncio.wait_for(expectation.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(
+                f"Timeout while waiting for {expectation.count} {expectation.kind} "
+                f"message(s), got {len(expectation.messages)}."
+            ) from None
+        finally:
+            pending = self._pending.get(expectation.key, [])
+            if expectation in pending:
+                pending.remove(expectation)
+        return expectation.messages
+
+    def _remember(self, message_id: str, seen: dict = None):
+        seen = self._routed if seen is None else seen
+        seen[message_id] = None
+        # Polls read at most `tail` messages, so older ids are never seen again
+        while len(seen) > self.tail * 4:
+            del seen[next(iter(seen))]
+
+    def _check_throttle(self, message: ChannelMessage):
+        # A queued job's message later turns into its grid, so it is still routed
+        if message.id in self._throttles or message_kind(message) is not None:
+            return
+        # Progress replies and the bot's notices quote the prompt, which may
+        # itself read like a throttling reply ("slow down", ...)
+        text = normalise(message.text)
+        for key in self._open:
+            if key:
+                text = text.replace(key, " ")
+        if THROTTLE_PATTERN.search(text):
+            self._remember(message.id, self._throttles)
+            logger.warning(f"The bot is throttling: {message.text.strip()[:200]}")
+            if self.on_throttle:
+                self.on_throttle(message)
+
+    def _match(self, message: ChannelMessage) -> str:
+        text = normalise(message.text)
+        # The longest key wins, so "a cat" does not take replies for "a cat in a hat"
+        keys = [key for key in self._open if key and key in text]
+        return max(keys, key=len) if keys else None
+
+    def _route(self, message: ChannelMessage) -> bool:
+        """Route one message. Returns False while it is an unfinished reply to a job in flight."""
+        if message.id in self._routed:
+            return True
+        self._check_throttle(message)
+        key = self._match(message)
+        if key is None:
+            return True
+        kind = message_kind(message)
+        if kind is None:
+            return False
+
+        self._remember(message.id)
+        for expectation in self._pending[key]:
+            if expectation.kind == kind and not expectation.done.is_set():
+                expectation.add(message)
+                return True
+        self._unclaimed[key].append(message)
+        return True
+
+    async def poll(self):
+        """Read the messages after the cursor and route the finished ones."""
+        async with self.lock:
+            messages = await self._cursor.peek(tail=self.tail)
+        settled = True
+        for message in messages:
+            routed = self._route(message)
+            # Step over the leading run of settled messages so the next poll
+            # starts at the first reply still rendering.
+            settled = settled and routed
+            if settled:
+                self._cursor.advance(message.id)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.warning(f"Error reading the channel: {e}")
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,124 @@
+import asyncio
+import concurrent.futures
+import threading
+
+from loguru import logger
+
+
+class BrowserSession:
+    """
+    One long-lived asyncio loop on a daemon thread, holding the Playwright
+    driver and the CDP connection to Chrome.
+
+    Playwright is imported and the connection made on the session's loop, so
+    the caller (e.g. the Qt thread) never blocks on either. Coroutines that
+    use the browser are handed to `submit` and run on the same loop, where
+    every batch shares the channel tab's `JobScheduler`.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._run_loop, name="browser-session", daemon=True
+        )
+        self._playwright = None
+        self._browser = None
+        self._cdp_url = None
+        self._connect_lock: asyncio.Lock = None
+        self._scheduler_lock: asyncio.Lock = None
+        self._scheduler = None
+        self._scheduler_url = None
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self._connect_lock = asyncio.Lock()
+        self._scheduler_lock = asyncio.Lock()
+        self.loop.run_forever()
+
+    def start(self):
+        """Start the session thread."""
+        self._thread.start()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Run `coro` on the session loop and return a future for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def get_browser(self, cdp_url: str):
+        """
+        Return the browser connected over CDP at `cdp_url`, connecting or
+        reconnecting when needed. Must be awaited on the session loop.
+        """
+        async with self._connect_lock:
+            if (
+                self._browser
+                and self._browser.is_connected()
+                and self._cdp_url == cdp_url
+            ):
+                return self._browser
+
+            if self._playwright is None:
+                from playwright.async_api import async_playwright
+
+                self._playwright = await async_playwright().start()
+            if self._browser:
+                try:
+                    await self._browser.close()
+                except Exception as e:
+                    logger.warning(f"Error dropping the previous browser connection: {e}")
+
+            self._browser = await self._playwright.chromium.connect_over_cdp(cdp_url)
+            self._cdp_url = cdp_url
+            logger.info(f"Connected to Chrome at {cdp_url}.")
+            return self._browser
+
+    async def get_scheduler(self, settings):
+        """
+        Return the job scheduler of the channel tab, opening the tab when
+        needed. Batches of the session share it, so they share its job
+        slots. Must be awaited on the session loop.
+        """
+        async with self._scheduler_lock:
+            browser = await self.get_browser(settings.cdp_url)
+            scheduler = self._scheduler
+            if (
+                scheduler
+                and self._scheduler_url == settings.channel_url
+                and not scheduler.page.is_closed()
+                and scheduler.page.context.browser is browser
+            ):
+                return scheduler
+
+            from adaptive import create_controller
+            from pipeline import JobScheduler
+            from utils import acquire_channel_page
+
+            # The channel tab is left open so the next session can adopt it.
+            page = await acquire_channel_page(
+                browser, settings.channel_url, settings.message_placeholder
+            )
+            self._scheduler = JobScheduler(
+                page, settings.concurrency, create_controller(settings)
+            )
+            self._scheduler_url = settings.channel_url
+            return self._scheduler
+
+    def connect(self, cdp_url: str) -> concurrent.futures.Future:
+        """Connect in the background; the future resolves to the browser."""
+        return self.submit(self.get_browser(cdp_url))
+
+    async def _shutdown(self):
+        if self._browser:
+            await self._browser.close()
+        if self._playwright:
+            await self._playwright.stop()
+
+    def close(self, timeout: float = 10):
+        """Disconnect from Chrome (its tabs stay open) and stop the loop."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self.submit(self._shutdown()).result(timeout)
+        except Exception as e:
+            logger.warning(f"Error closing the browser session: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
@@ -0,0 +1,321 @@
+"""
+Soak test: run the real pipeline against the fake Discord channel for hours
+at accelerated timings and check that memory and handles stay flat.
+
+The fake channel (`fake_discord.py`) is served from this process. Chrome
+must already run with ``--remote-debugging-port`` (see `CDP_URL`). Prompts
+are generated on demand, so the run holds no prompt list however long it
+lasts. Every `--sample-interval` seconds the runner records:
+- rss_mb: resident memory of this process (needs `psutil` off Linux).
+- python_heap_mb: memory traced by `tracemalloc`.
+- playwright_objects: Playwright objects (handles, frames, requests, ...) alive on the connection.
+- js_heap_mb, dom_nodes, js_listeners: from the channel tab, through the DevTools `Performance` domain.
+
+After the run the growth of each metric per thousand jobs is the slope of a
+least-squares fit over the samples taken after the warm-up. The run fails
+(exit status 1) when any growth is above its limit. The samples, the
+largest Python allocations and a summary are written under `--output`.
+
+Usage:
+    python soak.py --hours 4 --speed 20
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from config import ConfigError, load_settings
+from logging_setup import configure_logging
+
+# Allowed growth per thousand jobs
+DEFAULT_LIMITS = {
+    "rss_mb": 50.0,
+    "python_heap_mb": 20.0,
+    "playwright_objects": 100.0,
+    "js_heap_mb": 30.0,
+    "dom_nodes": 5000.0,
+    "js_listeners": 500.0,
+}
+
+
+def _rss_mb() -> float:
+    """Return the resident memory of this process in MB, or None if it cannot be read."""
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _playwright_objects(page) -> int:
+    """
+    Return the number of Playwright objects alive on the page's connection.
+
+    Playwright keeps every live remote object (element handles, JS handles,
+    requests, ...) in its connection's registry until it is disposed. The
+    registry is internal to Playwright, so a `RuntimeError` is raised when it
+    cannot be found instead of silently dropping the metric.
+    """
+    try:
+        return len(page._impl_obj._connection._objects)
+    except AttributeError as e:
+        raise RuntimeError(
+            f"Cannot read Playwright's object registry ({e}); this Playwright version is not supported."
+        ) from e
+
+
+def growth_per_thousand(samples: list[dict], metric: str, warmup_jobs: int = 0) -> float:
+    """
+    Function to estimate how much a metric grows per thousand jobs.
+
+    Parameters:
+    - samples (list[dict]): The samples, each with ``jobs`` and the metric.
+    - metric (str): The metric to fit.
+    - warmup_jobs (int): Samples taken before this many jobs are ignored.
+
+    Returns:
+    - float: The slope of the least-squares line, times 1000, or None with fewer than three usable samples.
+    """
+    points = [
+        (s["jobs"], s[metric])
+        for s in samples
+        if s["jobs"] >= warmup_jobs and s.get(metric) is not None
+    ]
+    if len(points) < 3:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+    return slope * 1000
+
+
+class Sampler:
+    """Takes the resource samples of a soak run and appends them to a JSONL file."""
+
+    def __init__(self, page, path: str):
+        self.page = page
+        self.path = path
+        self.samples: list[dict] = []
+        self._cdp = None
+
+    async def start(self):
+        tracemalloc.start()
+        self._cdp = await self.page.context.new_cdp_session(self.page)
+        await self._cdp.send("Performance.enable")
+
+    async def _browser_metrics(self) -> dict:
+        await self._cdp.send("HeapProfiler.collectGarbage")
+        raw = await self._cdp.send("Performance.getMetrics")
+        metrics = {m["name"]: m["value"] for m in raw["metrics"]}
+        return {
+            "js_heap_mb": metrics.get("JSHeapUsedSize", 0) / 1024 / 1024,
+            "dom_nodes": metrics.get("Nodes"),
+            "js_listeners": metrics.get("JSEventListeners"),
+        }
+
+    async def sample(self, jobs: int) -> dict:
+        """Record one sample, after a garbage collection on both sides."""
+        gc.collect()
+        traced, _ = tracemalloc.get_traced_memory()
+        sample = {
+            "time": time.time(),
+            "jobs": jobs,
+            "rss_mb": _rss_mb(),
+            "python_heap_mb": traced / 1024 / 1024,
+            "playwright_objects": _playwright_objects(self.page),
+        }
+        try:
+            sample.update(await self._browser_metrics())
+        except Exception as e:
+            logger.warning(f"Could not read the browser metrics: {e}")
+        self.samples.append(sample)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(sample) + "\n")
+        return sample
+
+    def top_allocations(self, limit: int = 25) -> list[str]:
+        """Return the lines of code holding the most traced memory."""
+        stats = tracemalloc.take_snapshot().statistics("lineno")
+        return [str(stat) for stat in stats[:limit]]
+
+
+async def soak_prompts(deadline: float, max_jobs: int = None):
+    """Yield distinct prompts until `deadline` (monotonic) or `max_jobs` prompts."""
+    n = 0
+    while time.monotonic() < deadline and (max_jobs is None or n < max_jobs):
+        n += 1
+        # No prompt is a prefix of another, so replies are never misrouted
+        yield f"soak {n} lighthouse at dusk, oil painting"
+
+
+async def run_soak(args) -> int:
+    """
+    Function to run one soak test.
+
+    Parameters:
+    - args: The parsed command line.
+
+    Returns:
+    - int: 0 when every metric stayed under its limit, 1 otherwise.
+    """
+    from playwright.async_api import async_playwright
+
+    from fake_discord import make_server
+    from pipeline import BatchOptions, run_batch
+    from utils import acquire_channel_page
+
+    run_dir = os.path.join(args.output, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    os.makedirs(run_dir, exist_ok=True)
+    server = make_server(args.port, args.speed, args.placeholder)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    channel_url = f"http://localhost:{args.port}/channels/1/2"
+
+    # Timeouts and pauses shrink with the fake bot's speed
+    scale = max(args.speed, 1.0)
+    output_dir = tempfile.mkdtemp(prefix="soak_")
+    # Helpers that fall back to the environment must see the fake channel too
+    os.environ["DISCORD_CHANNEL_MESSAGE_PLACEHOLDER"] = args.placeholder
+    settings = load_settings(
+        overrides={
+            "DISCORD_CHANNEL_URL": channel_url,
+            "DISCORD_CHANNEL_MESSAGE_PLACEHOLDER": args.placeholder,
+            "OUTPUT_DIR": output_dir,
+            "JOB_PACING_MIN": str(20 / scale),
+            "JOB_PACING_MAX": str(30 / scale),
+            "WAIT_FOR_UPSCALE_TIMEOUT": str(max(int(120 / scale), 10)),
+            "WAIT_FOR_DOWNLOAD_TIMEOUT": str(max(int(600 / scale), 10)),
+        }
+    )
+    deadline = time.monotonic() + args.hours * 3600
+    processed = 0
+
+    def on_progress(stats):
+        nonlocal processed
+        processed = stats.processed
+
+    try:
+        async with async_playwright() as p:
+            browser = await p.chromium.connect_over_cdp(settings.cdp_url)
+            page = await acquire_channel_page(browser, channel_url, args.placeholder)
+            sampler = Sampler(page, os.path.join(run_dir, "samples.jsonl"))
+            await sampler.start()
+            await sampler.sample(0)
+
+            async def sample_periodically():
+                while True:
+                    await asyncio.sleep(args.sample_interval)
+                    await sampler.sample(processed)
+
+            sampling = asyncio.create_task(sample_periodically())
+            try:
+                stats = await run_batch(
+                    page,
+                    soak_prompts(deadline, args.jobs),
+                    BatchOptions(upscale=args.upscale),
+                    settings,
+                    on_progress=on_progress,
+                )
+            finally:
+                sampling.cancel()
+            await sampler.sample(processed)
+            top = sampler.top_allocations()
+            await browser.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    with open(os.path.join(run_dir, "tracemalloc_top.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(top) + "\n")
+
+    growth = {
+        metric: growth_per_thousand(sampler.samples, metric, args.warmup_jobs)
+        for metric in DEFAULT_LIMITS
+    }
+    limits = {metric: getattr(args, f"max_{metric}") for metric in DEFAULT_LIMITS}
+    exceeded = [
+        metric
+        for metric, value in growth.items()
+        if value is not None and value > limits[metric]
+    ]
+    # Without this metric a Playwright handle leak would go unnoticed
+    unmeasured = ["playwright_objects"] if growth["playwright_objects"] is None else []
+    summary = {
+        "jobs": stats.processed,
+        "completed": stats.completed,
+        "failed": len(stats.failed),
+        "hours": args.hours,
+        "growth_per_1000_jobs": growth,
+        "limits": limits,
+        "exceeded": exceeded,
+        "unmeasured": unmeasured,
+    }
+    with open(os.path.join(run_dir, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+    for metric, value in growth.items():
+        shown = "not enough samples" if value is None else f"{value:+.2f} per 1000 jobs"
+        logger.info(f"{metric}: {shown} (limit {limits[metric]})")
+    if exceeded:
+        logger.error(f"Soak test failed, growth above the limit for: {', '.join(exceeded)}")
+        return 1
+    if unmeasured:
+        logger.error(
+            f"Soak test failed, not enough samples of: {', '.join(unmeasured)}. "
+            "Run longer or sample more often."
+        )
+        return 1
+    logger.info(f"Soak test passed after {stats.processed} jobs. Results in {run_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Soak-test the pipeline against the fake channel.")
+    parser.add_argument("--hours", type=float, default=1.0, help="How long to run.")
+    parser.add_argument("--jobs", type=int, help="Stop after this many jobs instead.")
+    parser.add_argument("--speed", type=float, default=20.0, help="Fake bot speed-up.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--placeholder", default="Message #general")
+    parser.add_argument("--upscale", action="store_true", help="Also run Upscale (Subtle).")
+    parser.add_argument("--sample-interval", type=float, default=60.0, help="Seconds between samples.")
+    parser.add_argument(
+        "--warmup-jobs", type=int, default=50, help="Jobs before the samples count."
+    )
+    parser.add_argument("--output", default="soak", help="Directory for the results.")
+    for metric, limit in DEFAULT_LIMITS.items():
+        parser.add_argument(
+            f"--max-{metric.replace('_', '-')}",
+            type=float,
+            default=limit,
+            help=f"Allowed {metric} growth per 1000 jobs.",
+        )
+    args = parser.parse_args()
+
+    load_dotenv()
+    configure_logging()
+    try:
+        sys.exit(asyncio.run(run_soak(args)))
+    except ConfigError as e:
+        sys.exit(str(e))
@@ -0,0 +1,368 @@
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass, field
+
+from loguru import logger
+
+from config import Settings
+
+MANIFEST_NAME = "manifest.sqlite3"
+
+# Grid previews (see `preview`) share the table but are not downloads
+_DOWNLOADS = "json_extract(parameters, '$.preview') IS NULL"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    path TEXT NOT NULL,
+    source_url TEXT,
+    message_id TEXT,
+    parameters TEXT NOT NULL DEFAULT '{}',
+    bytes INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_job_id ON files (job_id);
+CREATE INDEX IF NOT EXISTS files_prompt ON files (prompt);
+CREATE INDEX IF NOT EXISTS files_message_id ON files (message_id);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE TABLE IF NOT EXISTS timings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS timings_stage ON timings (stage);
+"""
+
+
+@dataclass
+class ManifestEntry:
+    """
+    One stored file and where it came from.
+
+    Attributes:
+    - job_id (str): The job that produced the file.
+    - prompt (str): The prompt submitted for the job.
+    - path (str): Location of the file, relative to the storage root.
+    - source_url (str): The Discord CDN URL the file was downloaded from.
+    - message_id (str): The Discord message holding the attachment.
+    - parameters (dict): Job settings worth keeping with the file (upscale mode, sequence number, ...).
+    - bytes (int): Size of the file.
+    - created_at (float): Unix time the file was written.
+    """
+
+    job_id: str
+    prompt: str
+    path: str
+    source_url: str = None
+    message_id: str = None
+    parameters: dict = field(default_factory=dict)
+    bytes: int = 0
+    created_at: float = field(default_factory=time.time)
+
+
+class StorageBackend(ABC):
+    """
+    Destination for downloaded files. Keys are ``/``-separated paths relative
+    to the backend root.
+    """
+
+    @abstractmethod
+    def write_stream(self, key: str, stream) -> int:
+        """Copy a readable binary stream to `key` and return the number of bytes written."""
+
+    @abstractmethod
+    def location(self, key: str) -> str:
+        """Return a human readable location of `key` (a path or URL)."""
+
+
+class LocalDiskBackend(StorageBackend):
+    """
+    Writes files under a local directory. Each file is written to a temporary
+    name next to its target first and renamed into place, so a crash never
+    leaves a truncated image behind.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root or ".")
+        os.makedirs(self.root, exist_ok=True)
+
+    def write_stream(self, key: str, stream) -> int:
+        target = os.path.join(self.root, *key.split("/"))
+        directory = os.path.dirname(target)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out_file:
+                shutil.copyfileobj(stream, out_file)
+                out_file.flush()
+                os.fsync(out_file.fileno())
+            os.replace(tmp_path, target)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return os.path.getsize(target)
+
+    def location(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+
+class _CountingReader:
+    """File-like wrapper that counts the bytes read through it."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.stream.read(size)
+        self.bytes += len(chunk)
+        return chunk
+
+
+class S3Backend(StorageBackend):
+    """
+    Streams files into an S3-compatible bucket (AWS S3, MinIO, ...).
+
+    The source stream is fed straight into a multipart upload in
+    `chunk_size` parts, so nothing touches the local disk. Requires the
+    optional `boto3` package.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: str = None,
+        region_name: str = None,
+        chunk_size: int = 8 * 1024 * 1024,
+    ):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError as e:
+            raise ImportError(
+                "The S3 storage backend requires boto3. Install it with `pip install boto3`."
+            ) from e
+
+        if not bucket:
+            raise ValueError("S3_BUCKET must be set to use the S3 storage backend.")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client(
+            "s3", endpoint_url=endpoint_url or None, region_name=region_name or None
+        )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=chunk_size, multipart_chunksize=chunk_size
+        )
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def write_stream(self, key: str, stream) -> int:
+        reader = _CountingReader(stream)
+        self.client.upload_fileobj(
+            reader, self.bucket, self._object_key(key), Config=self.transfer_config
+        )
+        return reader.bytes
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self._object_key(key)}"
+
+
+class ShardedStorage:
+    """
+    Spreads files over hashed subdirectories of a `StorageBackend` and keeps
+    an append-only SQLite manifest of every file written.
+
+    A file named ``pic_1.png`` with ``shard_depth=2`` is stored under the key
+    ``3f/a2/pic_1.png``, where ``3fa2...`` is the SHA-1 of the name. The
+    manifest always lives on the local disk, in `manifest_dir`.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        shard_depth: int = 2,
+        backend: StorageBackend = None,
+        manifest_dir: str = None,
+    ):
+        self.backend = backend or LocalDiskBackend(root)
+        self.root = os.path.abspath(manifest_dir or root or ".")
+        self.shard_depth = shard_depth
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(self.root, MANIFEST_NAME), check_same_thread=False
+        )
+        self._db.executescript(_SCHEMA)
+
+    def relative_path(self, name: str) -> str:
+        """Return the sharded key of `name`."""
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()
+        shards = [digest[i * 2 : i * 2 + 2] for i in range(self.shard_depth)]
+        return "/".join([*shards, name])
+
+    def location(self, relative: str) -> str:
+        """Return where the backend stored `relative`."""
+        return self.backend.location(relative)
+
+    def write_stream(self, name: str, stream) -> tuple[str, int]:
+        """
+        Copy a binary stream into the sharded location of `name`.
+
+        Parameters:
+        - name (str): File name, including the extension.
+        - stream: A readable binary file object.
+
+        Returns:
+        - tuple[str, int]: The key written and its size in bytes.
+        """
+        relative = self.relative_path(name)
+        size = self.backend.write_stream(relative, stream)
+        return relative, size
+
+    def record(self, entry: ManifestEntry):
+        """Append `entry` to the manifest."""
+        row = asdict(entry)
+        row["parameters"] = json.dumps(entry.parameters, sort_keys=True)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO files (job_id, prompt, path, source_url, message_id,"
+                " parameters, bytes, created_at) VALUES (:job_id, :prompt, :path,"
+                " :source_url, :message_id, :parameters, :bytes, :created_at)",
+                row,
+            )
+
+    def lookup(
+        self, job_id: str = None, prompt: str = None, message_id: str = None
+    ) -> list[ManifestEntry]:
+        """
+        Return the manifest entries matching every given field.
+
+        Parameters:
+        - job_id (str): Filter by job.
+        - prompt (str): Filter by exact prompt text.
+        - message_id (str): Filter by Discord message.
+
+        Returns:
+        - list[ManifestEntry]: The entries, oldest first.
+        """
+        filters = {"job_id": job_id, "prompt": prompt, "message_id": message_id}
+        clauses = [f"{column} = ?" for column, value in filters.items() if value]
+        values = [value for value in filters.values() if value]
+        query = (
+            "SELECT job_id, prompt, path, source_url, message_id, parameters,"
+            " bytes, created_at FROM files"
+        )
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY id", values).fetchall()
+        return [
+            ManifestEntry(*row[:5], json.loads(row[5]), *row[6:]) for row in rows
+        ]
+
+    def record_timings(self, job_id: str, stages: dict[str, float]):
+        """Append how many seconds each stage of a finished job took."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO timings (job_id, stage, seconds, created_at) VALUES (?, ?, ?, ?)",
+                [(job_id, stage, seconds, now) for stage, seconds in stages.items()],
+            )
+
+    def stage_timings(self, limit: int = 500) -> dict[str, list[float]]:
+        """Return the durations of the last `limit` recorded runs of each stage."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT stage, seconds FROM ("
+                " SELECT stage, seconds, ROW_NUMBER() OVER"
+                " (PARTITION BY stage ORDER BY id DESC) AS n FROM timings"
+                ") WHERE n <= ?",
+                (limit,),
+            ).fetchall()
+        timings: dict[str, list[float]] = {}
+        for stage, seconds in rows:
+            timings.setdefault(stage, []).append(seconds)
+        return timings
+
+    def prompts(self) -> set[str]:
+        """Return every prompt that has at least one downloaded file in the manifest."""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT DISTINCT prompt FROM files WHERE {_DOWNLOADS}"
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def average_file_bytes(self) -> dict[str, float]:
+        """Return the average size of a downloaded file, per download profile."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT COALESCE(json_extract(parameters, '$.profile'), 'original'),"
+                f" AVG(bytes) FROM files WHERE {_DOWNLOADS} GROUP BY 1"
+            ).fetchall()
+        return dict(rows)
+
+    def bytes_saved_by_profile(self) -> dict[str, tuple[int, int]]:
+        """
+        Return, per download profile, the bytes downloaded and the bytes saved
+        against the original, over every downloaded file in the manifest.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT COALESCE(json_extract(parameters, '$.profile'), 'original'),"
+                " SUM(bytes),"
+                " SUM(COALESCE(json_extract(parameters, '$.original_bytes') - bytes, 0))"
+                f" FROM files WHERE {_DOWNLOADS} GROUP BY 1 ORDER BY 1"
+            ).fetchall()
+        return {profile: (downloaded, saved) for profile, downloaded, saved in rows}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+        logger.info(f"Closed output manifest in {self.root}")
+
+
+def create_storage(settings: Settings, output_dir: str = None) -> ShardedStorage:
+    """
+    Function to build the storage selected by the settings.
+
+    `STORAGE_BACKEND=s3` streams files to `S3_BUCKET` (under `S3_PREFIX`,
+    through `S3_ENDPOINT_URL` for MinIO and other S3-compatible stores);
+    anything else writes to the output directory. The manifest stays in the
+    output directory.
+
+    Parameters:
+    - settings (Settings): The validated settings.
+    - output_dir (str): Local output directory. Defaults to `Settings.output_dir`.
+
+    Returns:
+    - ShardedStorage: The storage.
+    """
+    output_dir = output_dir or settings.output_dir
+    if settings.storage_backend == "s3":
+        backend = S3Backend(
+            bucket=settings.s3_bucket,
+            prefix=settings.s3_prefix,
+            endpoint_url=settings.s3_endpoint_url or None,
+            region_name=settings.s3_region or None,
+        )
+        logger.info(f"Streaming images to {backend.location('')}")
+        return ShardedStorage(output_dir, settings.output_shard_depth, backend=backend)
+    return ShardedStorage(output_dir, settings.output_shard_depth)
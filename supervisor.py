@@ -0,0 +1,283 @@
+"""
+Runs a batch on several browser sessions at once, one worker process each.
+
+The supervisor puts the prompts in a `JobStore` and starts a worker per
+Chrome debugging URL. Each worker runs `run_batch` on its own channel tab,
+fed from the store one leased job at a time, and sends heartbeats while it
+works. A worker that exits with an error or stops sending heartbeats (a
+crash, a stalled event loop) is killed and restarted, and the jobs it had
+leased go back to the queue. A worker that exits cleanly found nothing left
+to lease and is not restarted.
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from config import ConfigError, SettingsWatcher, load_settings
+from jobstore import JOBS_NAME, Job, JobStore
+from logging_setup import configure_logging
+
+LEASE_SECONDS = 120
+HEARTBEAT_SECONDS = 15
+
+# Final job stages and the error recorded for them; None means done.
+_FINAL_STAGES = {
+    "downloaded": None,
+    "timed_out": "timed out",
+    "error": "error",
+}
+
+
+def batch_id(prompts: list[str]) -> str:
+    """Return an identifier of a list of prompts, stable across runs."""
+    return hashlib.sha1("\n".join(prompts).encode("utf-8")).hexdigest()[:12]
+
+
+def run_worker(worker: str, cdp_url: str, store_path: str, batch: str, options):
+    """
+    Function run in each worker process.
+
+    Parameters:
+    - worker (str): Name of the worker.
+    - cdp_url (str): Chrome debugging URL of the worker's browser session.
+    - store_path (str): Path of the job store.
+    - batch (str): The batch to work on.
+    - options (BatchOptions): The batch choices.
+
+    Returns:
+    - None. Exits with status 2 if the settings are invalid.
+    """
+    load_dotenv()
+    configure_logging(name=worker)
+    try:
+        settings = load_settings(overrides={"CDP_URL": cdp_url})
+    except ConfigError as e:
+        logger.error(f"{worker}: {e}")
+        sys.exit(2)
+    asyncio.run(_work(worker, settings, store_path, batch, options))
+
+
+async def _work(worker, settings, store_path, batch, options):
+    from playwright.async_api import async_playwright
+
+    from pipeline import run_batch
+    from utils import acquire_channel_page
+
+    store = JobStore(store_path)
+    # Unfinished jobs by the sequence number `run_batch` gives them in this process
+    leased: dict[int, Job] = {}
+    sequence_number = 0
+
+    async def heartbeat():
+        while True:
+            try:
+                store.heartbeat(worker, LEASE_SECONDS, os.getpid())
+            except sqlite3.Error as e:
+                logger.warning(f"{worker} could not send a heartbeat: {e}")
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+
+    async def jobs():
+        nonlocal sequence_number
+        while True:
+            job = store.lease(batch, worker, LEASE_SECONDS)
+            if job:
+                sequence_number += 1
+                leased[sequence_number] = job
+                logger.info(
+                    f"{worker} leased prompt {job.sequence_number} (attempt {job.attempts})."
+                )
+                yield job.prompt
+            elif store.pending(batch):
+                # Jobs leased by other workers come back if those workers die
+                await asyncio.sleep(HEARTBEAT_SECONDS)
+            else:
+                return
+
+    def finish(sequence_number: int, result: str, error: str = None):
+        job = leased.pop(sequence_number)
+        if not store.finish(job.id, worker, result, error):
+            logger.warning(f"{worker} lost the lease of prompt {job.sequence_number}.")
+
+    def on_stage(event):
+        if event.stage in _FINAL_STAGES and event.sequence_number in leased:
+            finish(event.sequence_number, event.stage, _FINAL_STAGES[event.stage])
+
+    def on_progress(stats):
+        # Lines rejected before submitting have no final stage
+        for failed in stats.failed:
+            if failed in leased:
+                finish(failed, "invalid", "invalid prompt options")
+
+    beating = asyncio.create_task(heartbeat())
+    browser = None
+    try:
+        async with async_playwright() as p:
+            browser = await p.chromium.connect_over_cdp(settings.cdp_url)
+            page = await acquire_channel_page(
+                browser, settings.channel_url, settings.message_placeholder
+            )
+            stats = await run_batch(
+                page,
+                jobs(),
+                options,
+                settings,
+                on_stage=on_stage,
+                on_progress=on_progress,
+                watcher=SettingsWatcher(settings),
+            )
+            logger.info(
+                f"{worker} finished: {stats.completed} completed, {len(stats.failed)} failed."
+            )
+            await browser.close()
+    finally:
+        beating.cancel()
+        store.close()
+
+
+class Supervisor:
+    """
+    Starts one worker process per browser session and keeps them running
+    until every job of the batch is done or failed.
+    """
+
+    def __init__(
+        self,
+        sessions: list[str],
+        store_path: str,
+        batch: str,
+        options,
+        max_restarts: int = 5,
+        heartbeat_timeout: float = LEASE_SECONDS,
+    ):
+        self.sessions = {f"worker-{i + 1}": url for i, url in enumerate(sessions)}
+        self.store_path = store_path
+        self.batch = batch
+        self.options = options
+        self.max_restarts = max_restarts
+        self.heartbeat_timeout = heartbeat_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: dict[str, multiprocessing.Process] = {}
+        self._started_at: dict[str, float] = {}
+        self._restarts = {worker: 0 for worker in self.sessions}
+
+    def _spawn(self, worker: str):
+        process = self._context.Process(
+            target=run_worker,
+            args=(worker, self.sessions[worker], self.store_path, self.batch, self.options),
+            name=worker,
+        )
+        process.start()
+        self._processes[worker] = process
+        self._started_at[worker] = time.time()
+        logger.info(f"Started {worker} (pid {process.pid}) on {self.sessions[worker]}.")
+
+    def _stalled(self, store: JobStore, worker: str) -> bool:
+        # A heartbeat from an earlier process of the same worker does not count
+        last = max(store.last_heartbeat(worker) or 0, self._started_at[worker])
+        return time.time() - last > self.heartbeat_timeout
+
+    def run(self, poll_interval: float = 5.0) -> dict[str, int]:
+        """
+        Function to run the batch to the end.
+
+        Parameters:
+        - poll_interval (float): Seconds between checks of the workers.
+
+        Returns:
+        - dict[str, int]: Jobs of the batch in each status.
+        """
+        store = JobStore(self.store_path)
+        try:
+            # No worker runs yet, so any lease is left over from an earlier run
+            store.requeue()
+            for worker in self.sessions:
+                self._spawn(worker)
+
+            while self._processes:
+                time.sleep(poll_interval)
+                store.requeue(expired_only=True)
+                pending = store.pending(self.batch)
+                for worker, process in list(self._processes.items()):
+                    if process.is_alive():
+                        if not self._stalled(store, worker):
+                            continue
+                        logger.error(f"{worker} stopped sending heartbeats; killing it.")
+                        process.kill()
+                        process.join()
+                    elif process.exitcode != 0:
+                        logger.error(f"{worker} died with exit code {process.exitcode}.")
+
+                    lost = store.requeue(worker)
+                    if lost:
+                        logger.warning(f"Requeued {lost} job(s) leased by {worker}.")
+                    del self._processes[worker]
+                    # A clean exit means the queue was empty; what other
+                    # workers still hold is theirs to finish or requeue
+                    if process.exitcode == 0 and not lost:
+                        logger.info(f"{worker} finished.")
+                        continue
+                    if not pending and not lost:
+                        continue
+                    if self._restarts[worker] >= self.max_restarts:
+                        logger.error(f"{worker} restarted {self.max_restarts} times; giving up on it.")
+                        continue
+                    self._restarts[worker] += 1
+                    self._spawn(worker)
+                if not self._processes and store.pending(self.batch):
+                    # Jobs requeued after the others finished cleanly need a worker
+                    spare = [w for w in self.sessions if self._restarts[w] < self.max_restarts]
+                    if spare:
+                        self._restarts[spare[0]] += 1
+                        self._spawn(spare[0])
+            return store.counts(self.batch)
+        finally:
+            self.stop()
+            store.close()
+
+    def stop(self):
+        """Stop the workers still running. Their leased jobs are requeued on the next run."""
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self._processes.values():
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+        self._processes.clear()
+
+
+def run_supervised(sessions: list[str], prompts: list[str], options, settings) -> dict[str, int]:
+    """
+    Function to run a batch with one worker process per browser session.
+
+    The job store lives in the output directory, so running the same prompts
+    again resumes the jobs that were not finished.
+
+    Parameters:
+    - sessions (list[str]): Chrome debugging URLs, one per worker.
+    - prompts (list[str]): The prompt lines, in order.
+    - options (BatchOptions): The batch choices.
+    - settings (Settings): The validated settings.
+
+    Returns:
+    - dict[str, int]: Jobs of the batch in each status.
+    """
+    store_path = os.path.join(options.output_dir or settings.output_dir, JOBS_NAME)
+    batch = batch_id(prompts)
+    store = JobStore(store_path)
+    try:
+        added = store.enqueue(batch, prompts)
+    finally:
+        store.close()
+    logger.info(f"Batch {batch}: {added} new job(s) queued in {store_path}.")
+    counts = Supervisor(sessions, store_path, batch, options).run()
+    logger.info(f"Batch {batch} finished: {counts}")
+    return counts
@@ -1,17 +1,21 @@
+# Imported first so the startup clock starts as close to process start as possible.
+import startup
+
 import asyncio
+import multiprocessing
 import os
-import random
 import sys
-from datetime import datetime
 
 from dotenv import load_dotenv, set_key
 from loguru import logger
-from playwright.async_api import async_playwright
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt6.QtWidgets import (
     QApplication,
     QCheckBox,
+    QComboBox,
     QFileDialog,
+    QHBoxLayout,
+    QInputDialog,
     QLabel,
     QLineEdit,
     QMessageBox,
@@ -22,160 +26,128 @@ from PyQt6.QtWidgets import (
     QWidget,
 )
 
-from utils import (
-    download_upscaled_images,
-    generate_prompt_and_submit_command,
-    open_discord_channel,
-    random_sleep,
-    send_bot_command,
-    wait_and_select_upscale_options,
-    wait_and_select_super_upscale_options,
-)
-
-load_dotenv()
+from config import ENV_VARS, ConfigError, Settings, SettingsWatcher, load_settings
+from control import BatchCancelled, BatchControl
+from download_profiles import DownloadProfile
+from logging_setup import configure_logging
+from session import BrowserSession
 
+# `pipeline` pulls in Playwright, requests and OpenAI. It is imported on first
+# use (or by the background warm-up) so the window can paint first.
 
-def configure_logging():
-    """Configure logging with a unique filename for each run."""
-    # Create logs directory if it doesn't exist
-    os.makedirs("logs", exist_ok=True)
-    
-    # Generate unique filename with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = f"logs/midjourney_bot_{timestamp}.log"
-    
-    # Remove default handler and add file handler with proper formatting
-    logger.remove()
-    logger.add(
-        log_file,
-        rotation="1 day",
-        retention="7 days",
-        level="INFO",
-        format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-        backtrace=True,
-        diagnose=True
-    )
-    logger.add(
-        lambda msg: print(msg),
-        level="INFO",
-        format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-        backtrace=True,
-        diagnose=True
-    )
-    
-    logger.info(f"Logging configured. Log file: {log_file}")
+load_dotenv()
+startup.mark("imports done")
 
 
 class FileProcessor(QThread):
     progress = pyqtSignal(int)
     completed = pyqtSignal(str, str)  # Changed to include status (title, message)
+    stage = pyqtSignal(int, str, str)  # (sequence number, stage, prompt)
+    stats = pyqtSignal(int, int, float, float)  # (processed, total, jobs per hour, ETA seconds or -1)
 
-    def __init__(self, input_file, output_dir, upscale):
+    def __init__(self, input_file, output_dir, upscale, session, download_profile=None):
         super().__init__()
+        self.session = session
         self.input_file = input_file
         self.output_dir = output_dir
         self.upscale = upscale  # Upscale option
+        self.download_profile = download_profile
         self.bot_command = "/imagine"
-        self.channel_url = os.environ.get("DISCORD_CHANNEL_URL")
+        self.settings = None
         self.PROMPTS = []
+        self.control = BatchControl()
+
+    def pause(self):
+        self.control.pause()
+
+    def resume(self):
+        self.control.resume()
+
+    def skip(self):
+        self.control.skip()
+
+    def cancel(self):
+        self.control.cancel()
 
     def run(self):
         try:
+            # Reject bad settings before anything is submitted
+            self.settings = load_settings()
             with open(self.input_file, "r") as f:
                 line = f.readline()
                 while line:
                     if line.strip():
                         self.PROMPTS.append(line.strip())
                     line = f.readline()
-            logger.info(f"Channel URL: {self.channel_url}")
+            logger.info(f"Channel URL: {self.settings.channel_url}")
             if len(self.PROMPTS) != 0:
-                asyncio.run(
-                    self.process_file_async()
-                )  # Run the async function inside the thread
-                self.completed.emit("✅ Success", "All images have been processed successfully!")
+                try:
+                    # Run the batch on the shared session loop and wait for it here
+                    stats = self.session.submit(self.process_file_async()).result()
+                except BatchCancelled:
+                    self.completed.emit(
+                        "⚠️ Cancelled",
+                        "The batch was cancelled. Images already downloaded were kept.",
+                    )
+                    return
+                problems = []
+                if stats.failed:
+                    problems.append(
+                        f"{len(stats.failed)} prompt(s) produced no images: "
+                        + ", ".join(str(n) for n in stats.failed)
+                    )
+                if stats.skipped:
+                    problems.append(
+                        f"{len(stats.skipped)} prompt(s) skipped: "
+                        + ", ".join(str(n) for n in stats.skipped)
+                    )
+                if problems:
+                    self.completed.emit("⚠️ Error", "\n".join(problems))
+                else:
+                    self.completed.emit("✅ Success", "All images have been processed successfully!")
             else:
                 logger.error("No prompts found in the input file.")
                 self.completed.emit("⚠️ Error", "No prompts found in the input file.")
+        except ConfigError as e:
+            logger.error(str(e))
+            self.completed.emit("❌ Error", str(e))
         except Exception as e:
             logger.exception("Error in FileProcessor.run()")  # This will log the full traceback
             self.completed.emit("❌ Error", f"An error occurred: {str(e)}")
 
+    def _on_stage(self, event):
+        self.stage.emit(event.sequence_number, event.stage, event.prompt)
+
+    def _on_progress(self, stats):
+        self.progress.emit(stats.processed * 100 // stats.total)
+        eta = stats.eta
+        self.stats.emit(
+            stats.processed, stats.total, stats.throughput, -1.0 if eta is None else eta
+        )
+
     async def process_file_async(self):
-        try:
-            total_prompts = len(self.PROMPTS)
-            page = None
-            async with async_playwright() as p:
-                browser = await p.chromium.connect_over_cdp("http://localhost:9222")
-                try:
-                    default_context = browser.contexts[0]
-                    page = await default_context.new_page()
-
-                    await open_discord_channel(page, self.channel_url)
-
-                    for i in range(total_prompts):
-                        prompt = self.PROMPTS[i]
-                        logger.info("Entering the specified bot command.")
-                        await send_bot_command(page, self.bot_command)
-                        await asyncio.sleep(random.randint(1, 5))
-
-                        logger.info("Submit command.")
-                        await generate_prompt_and_submit_command(page, prompt)
-                        await asyncio.sleep(random.randint(1, 5))
-
-                        logger.info("Wait and select upscale options.")
-                        await wait_and_select_upscale_options(
-                            page,
-                            number_of_images=int(
-                                os.environ.get("NUMBER_OF_UPSCALED_IMAGES")
-                            ),
-                        )
-                        await asyncio.sleep(random.randint(1, 5))
-
-                        if self.upscale:
-                            await wait_and_select_super_upscale_options(
-                                page, number_of_images=1
-                            )
-
-                        logger.info("Download upscaled images.")
-                        await download_upscaled_images(
-                            page,
-                            prompt,
-                            number_of_images=int(
-                                os.environ.get("NUMBER_OF_UPSCALED_IMAGES")
-                            ),
-                            sequence_number=i + 1,
-                            output_dir=self.output_dir,
-                            timeout=int(os.environ.get("WAIT_FOR_DOWNLOAD_TIMEOUT", 600))
-                        )
-
-                        logger.info(f"Iteration {i+1} completed.")
-                        self.progress.emit((i + 1) * 100 // total_prompts)
-                        
-                        if i + 1 == total_prompts:
-                            break
-                        random_sleep()
-
-                except Exception as e:
-                    # logger.error(f"Error occurred: {e} while executing the main function.")
-                    # self.completed.emit("❌ Error", f"An error occurred while processing: {str(e)}")
-                    raise e
-                finally:
-                    if page:
-                        try:
-                            await page.close()
-                            logger.info("Page closed successfully.")
-                        except Exception as e:
-                            logger.error(f"Error closing page: {e}")
-                    try:
-                        await browser.close()
-                        logger.info("Browser closed successfully.")
-                    except Exception as e:
-                        logger.error(f"Error closing browser: {e}")
+        from pipeline import BatchOptions, run_batch
 
-        except Exception as e:
-            # logger.error(f"Error in process_file_async: {e}")
-            # self.completed.emit("❌ Error", f"An error occurred: {str(e)}")
-            raise e
+        # Shared with the other batches of the session, which run alongside
+        scheduler = await self.session.get_scheduler(self.settings)
+
+        options = BatchOptions(
+            bot_command=self.bot_command,
+            output_dir=self.output_dir,
+            upscale=self.upscale,
+            download_profile=self.download_profile,
+        )
+        return await run_batch(
+            scheduler.page,
+            self.PROMPTS,
+            options,
+            self.settings,
+            control=self.control,
+            on_stage=self._on_stage,
+            on_progress=self._on_progress,
+            watcher=SettingsWatcher(self.settings),
+            scheduler=scheduler,
+        )
 
     async def write_to_file(self, filename, content):
         """Asynchronously writes content to a file."""
@@ -188,6 +160,96 @@ class FileProcessor(QThread):
             out_file.write(content)
 
 
+class BatchRow(QWidget):
+    """One running batch: its input file, progress, stage and controls."""
+
+    finished = pyqtSignal(object)
+
+    def __init__(self, processor: FileProcessor):
+        super().__init__()
+        self.processor = processor
+
+        self.label_title = QLabel(
+            f"📄 {os.path.basename(processor.input_file)} → {processor.output_dir}"
+        )
+        self.label_title.setStyleSheet("font-weight: bold;")
+        self.progress_bar = QProgressBar()
+        self.label_stage = QLabel("")
+        self.label_stats = QLabel("")
+
+        self.btn_pause = QPushButton("⏸️ Pause")
+        self.btn_skip = QPushButton("⏭️ Skip Job")
+        self.btn_cancel = QPushButton("⏹️ Cancel")
+        self.btn_cancel.setStyleSheet("""
+            QPushButton {
+                background-color: #F44336;
+            }
+            QPushButton:hover {
+                background-color: #d32f2f;
+            }
+        """)
+        self.btn_remove = QPushButton("✖️ Remove")
+        self.btn_remove.setVisible(False)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.progress_bar, 1)
+        for button in (self.btn_pause, self.btn_skip, self.btn_cancel, self.btn_remove):
+            controls.addWidget(button)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 5, 0, 5)
+        layout.addWidget(self.label_title)
+        layout.addLayout(controls)
+        layout.addWidget(self.label_stage)
+        layout.addWidget(self.label_stats)
+        self.setLayout(layout)
+
+        self.btn_pause.clicked.connect(self.toggle_pause)
+        self.btn_skip.clicked.connect(self.processor.skip)
+        self.btn_cancel.clicked.connect(self.cancel_batch)
+        self.btn_remove.clicked.connect(self.deleteLater)
+        processor.progress.connect(self.progress_bar.setValue)
+        processor.stage.connect(self.on_stage)
+        processor.stats.connect(self.on_stats)
+        processor.completed.connect(self.on_processing_done)
+
+    def toggle_pause(self):
+        if self.processor.control.paused:
+            self.processor.resume()
+            self.btn_pause.setText("⏸️ Pause")
+        else:
+            self.processor.pause()
+            self.btn_pause.setText("▶️ Resume")
+
+    def cancel_batch(self):
+        self.processor.cancel()
+        self.btn_cancel.setEnabled(False)
+
+    def on_stage(self, sequence_number, stage, prompt):
+        """Show which stage the latest job is in."""
+        self.label_stage.setText(f"Job {sequence_number}: {stage} — {prompt[:60]}")
+
+    def on_stats(self, processed, total, throughput, eta):
+        """Show the running throughput and ETA."""
+        text = f"{processed}/{total} jobs · {throughput:.1f} jobs/h"
+        if eta >= 0:
+            hours, rest = divmod(int(eta), 3600)
+            text += f" · ETA {hours}h {rest // 60:02d}m"
+        self.label_stats.setText(text)
+
+    def on_processing_done(self, title, message):
+        """Show the final status in the row and in a message box."""
+        for button in (self.btn_pause, self.btn_skip, self.btn_cancel):
+            button.setVisible(False)
+        self.btn_remove.setVisible(True)
+        self.label_stage.setText(f"{title}: {message.splitlines()[0]}")
+        self.finished.emit(self)
+        if "Error" in title:
+            QMessageBox.critical(self, title, message)
+        else:
+            QMessageBox.information(self, title, message)
+
+
 class SettingsTab(QWidget):
     def __init__(self):
         super().__init__()
@@ -240,6 +302,35 @@ class SettingsTab(QWidget):
         placeholder_layout.addWidget(self.placeholder_input)
         placeholder_group.setLayout(placeholder_layout)
 
+        # Batch tuning. These apply to a running batch from its next job.
+        tuning_group = QWidget()
+        tuning_layout = QVBoxLayout()
+        tuning_layout.setSpacing(5)
+
+        tuning_label = QLabel("Batch Tuning (applies to running batches):")
+        tuning_label.setStyleSheet("font-size: 14px; font-weight: bold;")
+        tuning_layout.addWidget(tuning_label)
+
+        self.tuning_inputs = {}
+        for env_var, label_text in (
+            ("NUMBER_OF_UPSCALED_IMAGES", "Upscaled images per prompt (1-4)"),
+            ("JOB_PACING_MIN", "Minimum pause between prompts (s)"),
+            ("JOB_PACING_MAX", "Maximum pause between prompts (s)"),
+            ("WAIT_FOR_UPSCALE_TIMEOUT", "Upscale wait timeout (s)"),
+            ("WAIT_FOR_DOWNLOAD_TIMEOUT", "Download wait timeout (s)"),
+        ):
+            row = QWidget()
+            row_layout = QHBoxLayout()
+            row_layout.setContentsMargins(0, 0, 0, 0)
+            row_layout.addWidget(QLabel(label_text))
+            line_edit = QLineEdit()
+            row_layout.addWidget(line_edit)
+            row.setLayout(row_layout)
+            tuning_layout.addWidget(row)
+            self.tuning_inputs[env_var] = line_edit
+
+        tuning_group.setLayout(tuning_layout)
+
         # Save button
         button_group = QWidget()
         button_layout = QVBoxLayout()
@@ -265,6 +356,7 @@ class SettingsTab(QWidget):
         # Add all groups to main layout
         layout.addWidget(url_group)
         layout.addWidget(placeholder_group)
+        layout.addWidget(tuning_group)
         layout.addWidget(button_group)
         layout.addStretch()
 
@@ -277,7 +369,13 @@ class SettingsTab(QWidget):
                 load_dotenv(self.env_file)
                 self.url_input.setText(os.environ.get("DISCORD_CHANNEL_URL", ""))
                 self.placeholder_input.setText(os.environ.get("DISCORD_CHANNEL_MESSAGE_PLACEHOLDER", ""))
-                logger.info("Settings loaded successfully")
+            defaults = Settings("", "")
+            for env_var, line_edit in self.tuning_inputs.items():
+                field_name = next(k for k, v in ENV_VARS.items() if v == env_var)
+                line_edit.setText(
+                    os.environ.get(env_var, str(getattr(defaults, field_name)))
+                )
+            logger.info("Settings loaded successfully")
         except Exception as e:
             logger.error(f"Error loading settings: {e}")
             QMessageBox.critical(self, "❌ Error", f"Failed to load settings: {str(e)}")
@@ -297,14 +395,28 @@ class SettingsTab(QWidget):
                 QMessageBox.warning(self, "⚠️ Warning", "Message Placeholder cannot be empty!")
                 return
 
+            # Reject values that would break a batch before writing them
+            values = {
+                "DISCORD_CHANNEL_URL": channel_url,
+                "DISCORD_CHANNEL_MESSAGE_PLACEHOLDER": message_placeholder,
+            }
+            values.update(
+                {env_var: line_edit.text().strip() for env_var, line_edit in self.tuning_inputs.items()}
+            )
+            try:
+                load_settings(self.env_file, overrides=values)
+            except ConfigError as e:
+                QMessageBox.warning(self, "⚠️ Warning", str(e))
+                return
+
             # Create .env file if it doesn't exist
             if not os.path.exists(self.env_file):
                 with open(self.env_file, 'w') as f:
                     f.write('')
 
             # Update environment variables
-            set_key(self.env_file, 'DISCORD_CHANNEL_URL', channel_url)
-            set_key(self.env_file, 'DISCORD_CHANNEL_MESSAGE_PLACEHOLDER', message_placeholder)
+            for env_var, value in values.items():
+                set_key(self.env_file, env_var, value)
 
             # Reload environment variables
             load_dotenv(self.env_file, override=True)
@@ -317,10 +429,48 @@ class SettingsTab(QWidget):
 
 
 class TextFileProcessorApp(QWidget):
+    browser_status = pyqtSignal(str)
+
     def __init__(self):
         super().__init__()
-        configure_logging()  # Configure logging when UI starts
+        self.session = BrowserSession()
         self.init_ui()
+        self.browser_status.connect(self.label_browser.setText)
+        # Everything else runs once the window has painted
+        QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        """Deferred initialization: logging, then the background browser warm-up."""
+        startup.mark("first paint")
+        configure_logging()  # Configure logging when UI starts
+        self.session.start()
+        self.session.submit(self.warm_up())
+
+    async def warm_up(self):
+        """Load the heavy modules and connect to Chrome on the session thread."""
+        import pipeline  # noqa: F401
+
+        startup.mark("pipeline modules loaded")
+        cdp_url = os.environ.get("CDP_URL", Settings("", "").cdp_url)
+        self.browser_status.emit(f"🔌 Connecting to Chrome at {cdp_url}...")
+        try:
+            await self.session.get_browser(cdp_url)
+            self.browser_status.emit(f"✅ Connected to Chrome at {cdp_url}")
+        except Exception as e:
+            logger.warning(f"Chrome is not reachable yet: {e}")
+            self.browser_status.emit(
+                f"⚠️ Chrome not reachable at {cdp_url}; will retry when a batch starts"
+            )
+        startup.mark("browser connected")
+        startup.report()
+
+    def closeEvent(self, event):
+        for processor in self.processors:
+            processor.cancel()
+        for processor in self.processors:
+            processor.wait(10000)
+        self.session.close()
+        super().closeEvent(event)
 
     def init_ui(self):
         self.setWindowTitle("📄 Midjourney Bot")
@@ -386,7 +536,20 @@ class TextFileProcessorApp(QWidget):
         self.chk_upscale = QCheckBox("🔼 Enable Upscale Mode")
         self.chk_upscale.setStyleSheet("font-size: 14px;")
 
+        # Editable, so any <format>:<width> profile can be typed in
+        self.combo_profile = QComboBox()
+        self.combo_profile.setEditable(True)
+        self.combo_profile.addItems(["original", "webp", "webp:2048", "webp:1024", "jpeg:1024"])
+        self.combo_profile.setCurrentText(os.getenv("DOWNLOAD_PROFILE") or "original")
+        self.combo_profile.setToolTip(
+            "Rendition to download. Prompts can override it with '## profile=webp:1024'."
+        )
+        profile_row = QHBoxLayout()
+        profile_row.addWidget(QLabel("🗜️ Download profile:"))
+        profile_row.addWidget(self.combo_profile)
+
         options_layout.addWidget(self.chk_upscale)
+        options_layout.addLayout(profile_row)
         options_group.setLayout(options_layout)
 
         # Action buttons
@@ -416,25 +579,31 @@ class TextFileProcessorApp(QWidget):
             }
         """)
 
+        self.btn_estimate = QPushButton("⏱️ Estimate")
+        self.btn_estimate.setToolTip(
+            "Project duration and GPU time of the batch without touching Discord."
+        )
+
         action_layout.addWidget(self.btn_process)
+        action_layout.addWidget(self.btn_estimate)
         action_layout.addWidget(self.btn_discard)
         action_group.setLayout(action_layout)
 
-        # Progress bar
-        self.progress_bar = QProgressBar()
-        self.progress_bar.setStyleSheet("""
-            QProgressBar {
-                height: 25px;
-                font-size: 14px;
-            }
-        """)
+        # One row per batch, running or finished
+        self.label_batches = QLabel("🧵 Batches")
+        self.label_batches.setStyleSheet("font-size: 16px; font-weight: bold;")
+        self.batch_rows = QVBoxLayout()
+        self.batch_rows.setSpacing(5)
+        self.label_browser = QLabel("")
 
         # Add all sections to main layout
         main_layout.addWidget(input_group)
         main_layout.addWidget(output_group)
         main_layout.addWidget(options_group)
         main_layout.addWidget(action_group)
-        main_layout.addWidget(self.progress_bar)
+        main_layout.addWidget(self.label_batches)
+        main_layout.addLayout(self.batch_rows)
+        main_layout.addWidget(self.label_browser)
         main_layout.addStretch()
 
         main_tab.setLayout(main_layout)
@@ -457,9 +626,11 @@ class TextFileProcessorApp(QWidget):
         self.btn_select_output.clicked.connect(self.select_output_directory)
         self.btn_discard.clicked.connect(self.discard_selection)
         self.btn_process.clicked.connect(self.process_file)
+        self.btn_estimate.clicked.connect(self.estimate_batch)
 
         self.input_file = None
         self.output_dir = None
+        self.processors: set[FileProcessor] = set()
 
     def select_input_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -489,21 +660,67 @@ class TextFileProcessorApp(QWidget):
             )
             return
 
+        running = [p for p in self.processors if p.isRunning()]
+        if any(p.output_dir == self.output_dir for p in running):
+            QMessageBox.warning(
+                self, "⚠️ Warning", "A batch is already writing to this output directory."
+            )
+            return
+
         upscale_enabled = self.chk_upscale.isChecked()
-        self.progress_bar.setValue(0)
-        self.processor = FileProcessor(
-            self.input_file, self.output_dir, upscale_enabled
+        download_profile = self.combo_profile.currentText().strip()
+        try:
+            DownloadProfile.parse(download_profile)
+        except ValueError as e:
+            QMessageBox.warning(self, "⚠️ Warning", f"Invalid download profile: {e}")
+            return
+
+        # Batches run side by side on the session loop, sharing its job slots
+        processor = FileProcessor(
+            self.input_file,
+            self.output_dir,
+            upscale_enabled,
+            self.session,
+            download_profile,
         )
-        self.processor.progress.connect(self.progress_bar.setValue)
-        self.processor.completed.connect(self.on_processing_done)
-        self.processor.start()
+        row = BatchRow(processor)
+        row.finished.connect(lambda row: self.processors.discard(row.processor))
+        self.batch_rows.addWidget(row)
+        self.processors.add(processor)
+        processor.start()
+
+    def estimate_batch(self):
+        """Show a dry-run projection of the selected input file."""
+        if not self.input_file:
+            QMessageBox.warning(self, "⚠️ Warning", "Please select an input file.")
+            return
+        try:
+            settings = load_settings()
+        except ConfigError as e:
+            QMessageBox.warning(self, "⚠️ Warning", str(e))
+            return
+        concurrency, ok = QInputDialog.getInt(
+            self, "⏱️ Estimate", "Jobs in flight at once:", settings.concurrency, 1, 12
+        )
+        if not ok:
+            return
+        from planner import format_plan, plan_batch
 
-    def on_processing_done(self, title, message):
-        """Show the final status message."""
-        if "Error" in title:
-            QMessageBox.critical(self, title, message)
-        else:
-            QMessageBox.information(self, title, message)
+        try:
+            with open(self.input_file, "r", encoding="utf-8") as f:
+                prompts = f.read().splitlines()
+            plan = plan_batch(
+                prompts,
+                settings,
+                concurrency=concurrency,
+                upscale=self.chk_upscale.isChecked(),
+                download_profile=self.combo_profile.currentText().strip(),
+                output_dir=self.output_dir,
+            )
+        except (ConfigError, OSError) as e:
+            QMessageBox.warning(self, "⚠️ Warning", str(e))
+            return
+        QMessageBox.information(self, "⏱️ Estimate", format_plan(plan))
 
     def load_styles(self):
         return """
@@ -652,7 +869,10 @@ class TextFileProcessorApp(QWidget):
 
 
 if __name__ == "__main__":
+    # Worker processes (grid tiles) re-run this file in a frozen EXE
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = TextFileProcessorApp()
     window.show()
+    startup.mark("window shown")
     sys.exit(app.exec())
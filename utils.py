@@ -2,15 +2,19 @@ import asyncio
 import os
 import random
 import re
-import shutil
 import time
 import uuid
+from dataclasses import dataclass, field
+from enum import Enum
 
-import openai
 import requests
 from loguru import logger
 from playwright.async_api import Page, async_playwright
 
+from dom_selectors import registry
+from download_profiles import DownloadProfile
+from storage import ManifestEntry, ShardedStorage
+
 
 def random_sleep():
     """Sleep for a random amount of time between 1 and 5 seconds."""
@@ -69,108 +73,117 @@ async def open_isolated_browser(bot_command: str, channel_url: str, PROMPT: str)
             await browser.close()
 
 
-async def main(bot_command: str, channel_url: str, PROMPTS: list[str]):
+async def open_discord_channel(page, channel_url: str, placeholder: str = None):
     """
-    Main function that starts the bot and interacts with the page.
+    Function to open a Discord channel and send a bot command.
 
     Parameters:
-    - bot_command (str): The command for the bot to execute.
-    - channel_url (str): The URL of the channel where the bot should operate.
-    - PROMPTS (str): List of text prompt.
+    - page: The page object representing the current browser context.
+    - channel_url (str): The URL of the channel to open.
+    - placeholder (str): Accessible name of the chat box. Defaults to `DISCORD_CHANNEL_MESSAGE_PLACEHOLDER`.
 
     Returns:
     - None
     """
     try:
-        browser = None
-        async with async_playwright() as p:
-            browser = await p.chromium.connect_over_cdp("http://localhost:9222")
-            default_context = browser.contexts[0]
-            page = await default_context.new_page()
-
-            await open_discord_channel(page, channel_url)
-
-            for i in range(len(PROMPTS)):
-                prompt = PROMPTS[i]
-                logger.info("Entering the specified bot command.")
-                await send_bot_command(page, bot_command)
-                asyncio.sleep(random.randint(1, 5))
-
-                logger.info("Generating prompt using OpenAI's API.")
-                await generate_prompt_and_submit_command(page, prompt)
-                asyncio.sleep(random.randint(1, 5))
-
-                logger.info("Wait and select upscale options.")
-                await wait_and_select_upscale_options(
-                    page,
-                    number_of_images=int(os.environ.get("NUMBER_OF_UPSCALED_IMAGES")),
-                )
-                asyncio.sleep(random.randint(1, 5))
-
-                logger.info("Download upscaled images.")
-                await download_upscaled_images(
-                    page,
-                    prompt,
-                    number_of_images=int(os.environ.get("NUMBER_OF_UPSCALED_IMAGES")),
-                    sequence_number=i + 1,
-                )
+        await page.goto(f"{channel_url}", wait_until="domcontentloaded")
+        await wait_for_chat_ready(page, placeholder=placeholder)
+        logger.info("Successfully opened the appropriate channel.")
 
-                logger.info(f"Iteration {i+1} completed.")
-                random_sleep()
+        # logger.info("Entering the specified bot command.")
+        # await send_bot_command(page, bot_command, PROMPT)
 
     except Exception as e:
-        logger.error(f"Error occurred: {e} while executing the main function.")
+        logger.error(
+            f"An error occurred while opening the channel and entering the bot command: {e}"
+        )
         raise e
-    finally:
-        if browser:
-            await browser.close()
 
 
-async def open_discord_channel(page, channel_url: str):
+def chat_box(page, placeholder: str = None):
+    """Return the locator of the channel's chat box, found by its accessible name."""
+    return page.get_by_role(
+        "textbox", name=placeholder or os.environ.get("DISCORD_CHANNEL_MESSAGE_PLACEHOLDER")
+    )
+
+
+async def wait_for_chat_ready(page, timeout: int = 60000, placeholder: str = None):
     """
-    Function to open a Discord channel and send a bot command.
+    Function to wait until the channel's chat box is on screen.
+
+    Discord keeps network connections open indefinitely, so the chat box is
+    used as the readiness signal instead of network idleness.
 
     Parameters:
     - page: The page object representing the current browser context.
-    - channel_url (str): The URL of the channel to open.
-    - bot_command (str): The bot command to send.
-    - PROMPT (str): The prompt text.
+    - timeout (int): Milliseconds to wait.
+    - placeholder (str): Accessible name of the chat box. Defaults to `DISCORD_CHANNEL_MESSAGE_PLACEHOLDER`.
 
     Returns:
     - None
     """
-    try:
-        await page.goto(f"{channel_url}")
-        await asyncio.sleep(random.randint(1, 5))
-        await page.wait_for_load_state("networkidle")
-        logger.info("Successfully opened the appropriate channel.")
+    await chat_box(page, placeholder).wait_for(state="visible", timeout=timeout)
 
-        # logger.info("Entering the specified bot command.")
-        # await send_bot_command(page, bot_command, PROMPT)
 
-    except Exception as e:
-        logger.error(
-            f"An error occurred while opening the channel and entering the bot command: {e}"
-        )
-        raise e
+def _normalize_url(url: str) -> str:
+    return url.replace("://www.", "://", 1).split("?", 1)[0].split("#", 1)[0].rstrip("/")
+
+
+def is_channel_page(page, channel_url: str) -> bool:
+    """Return True if `page` shows `channel_url` (or a message link inside it)."""
+    page_url, target = _normalize_url(page.url), _normalize_url(channel_url)
+    return page_url == target or page_url.startswith(target + "/")
+
+
+async def acquire_channel_page(browser, channel_url: str, placeholder: str = None):
+    """
+    Function to get a ready page on the channel, reusing an open tab when possible.
+
+    Every tab of the CDP-connected browser is checked first; a tab already on
+    the channel is adopted as is. Otherwise a new tab is opened on the
+    channel. Either way the page is returned once the chat box is present.
+    The tab is meant to be left open after the batch so the next one can
+    adopt it.
 
+    Parameters:
+    - browser: The browser connected over CDP.
+    - channel_url (str): The URL of the channel.
+    - placeholder (str): Accessible name of the chat box. Defaults to `DISCORD_CHANNEL_MESSAGE_PLACEHOLDER`.
 
-async def send_bot_command(page, command: str):
+    Returns:
+    - Page: The channel page.
+    """
+    for context in browser.contexts:
+        for page in context.pages:
+            if not is_channel_page(page, channel_url):
+                continue
+            try:
+                await wait_for_chat_ready(page, timeout=5000, placeholder=placeholder)
+                logger.info(f"Reusing the open channel tab: {page.url}")
+                return page
+            except Exception as e:
+                logger.warning(f"Open channel tab is not usable, skipping it: {e}")
+
+    page = await browser.contexts[0].new_page()
+    await open_discord_channel(page, channel_url, placeholder)
+    return page
+
+
+async def send_bot_command(page, command: str, placeholder: str = None):
     """
     Function to send a command to the bot in the chat bar.
 
     Parameters:
     - page: The page object representing the current browser context.
     - command (str): The command to send to the bot.
+    - placeholder (str): Accessible name of the chat box. Defaults to `DISCORD_CHANNEL_MESSAGE_PLACEHOLDER`.
 
     Returns:
     - None
     """
     try:
         logger.info("Clicking on chat bar.")
-        chat_bar = page.get_by_role(
-            "textbox", name=os.environ.get("DISCORD_CHANNEL_MESSAGE_PLACEHOLDER")
-        )
+        chat_bar = chat_box(page, placeholder)
         await asyncio.sleep(random.randint(1, 3))
 
         logger.info("Typing in bot command")
@@ -178,11 +191,11 @@ async def send_bot_command(page, command: str):
         # await asyncio.sleep(random.randint(1, 3))
 
         logger.info("Selecting the prompt option in the suggestions menu")
-        prompt_option_selector = "#autocomplete-0 > .base__13533"
+        prompt_option_selector = registry().get("autocomplete_entry")
         await page.wait_for_selector(
             prompt_option_selector, state="visible", timeout=10000
         )
-        prompt_option = page.locator(prompt_option_selector)
+        prompt_option = page.locator(prompt_option_selector).first
         await asyncio.sleep(random.randint(1, 3))
         await prompt_option.click()
 
@@ -198,8 +211,9 @@ async def generate_prompt_and_submit_command(page, prompt: str):
 
         prompt_text = prompt
         # await asyncio.sleep(random.randint(1, 5))
-        pill_value_locator = "span.optionPillValue__1464f"
+        pill_value_locator = registry().get("option_pill")
         await page.fill(pill_value_locator, prompt_text)
+        await registry().resolve(page, "option_pill")
         await asyncio.sleep(random.randint(1, 3))
         await page.keyboard.press("Enter")
         logger.info(f"Successfully submitted prompt: {prompt_text}")
@@ -208,6 +222,140 @@ async def generate_prompt_and_submit_command(page, prompt: str):
         raise e
 
 
+# Runs in the page. Drives the client's own composer the way a user would
+# (insert text, pick the autocomplete entry, fill the option pill) but
+# without leaving the page between steps. Enter is pressed from Playwright
+# afterwards: the client ignores synthetic key events.
+_FAST_SUBMIT_JS = """
+async ({placeholder, command, prompt, autocompleteSelectors, pillSelectors, timeout}) => {
+    const deadline = Date.now() + timeout;
+    // Resolves to [element, selector] for the first selector in the list that matches.
+    const waitFor = async (selectors, what) => {
+        while (Date.now() < deadline) {
+            for (const selector of selectors) {
+                const element = document.querySelector(selector);
+                if (element) return [element, selector];
+            }
+            await new Promise((resolve) => setTimeout(resolve, 50));
+        }
+        throw new Error(`Timed out waiting for ${what}`);
+    };
+    const insertText = (element, text) => {
+        element.focus();
+        const selection = window.getSelection();
+        selection.selectAllChildren(element);
+        document.execCommand("insertText", false, text);
+    };
+
+    const textboxes = Array.from(document.querySelectorAll("[role=textbox]"));
+    const textbox = textboxes.find((el) => el.getAttribute("aria-label") === placeholder);
+    if (!textbox) throw new Error(`Chat box "${placeholder}" not found`);
+
+    insertText(textbox, command);
+    const [option, autocompleteSelector] = await waitFor(autocompleteSelectors, "the command suggestion");
+    option.click();
+
+    const [pill, pillSelector] = await waitFor(pillSelectors, "the prompt option");
+    insertText(pill, prompt);
+    if (!(pill.innerText || "").includes(prompt)) throw new Error("Prompt text was not accepted");
+    pill.focus();
+    return {autocompleteSelector, pillSelector};
+}
+"""
+
+
+async def fast_submit_command(
+    page, command: str, prompt: str, timeout: int = 10000, placeholder: str = None
+):
+    """
+    Function to submit a slash command and its prompt in a single in-page step.
+
+    The command and prompt are filled in by one page evaluation, then Enter
+    is pressed through the keyboard, so the client sees a trusted key press.
+
+    Parameters:
+    - page: The page object representing the current browser context.
+    - command (str): The slash command, e.g. ``/imagine``.
+    - prompt (str): The prompt text.
+    - timeout (int): Milliseconds to wait for the suggestion and option pill.
+    - placeholder (str): Accessible name of the chat box. Defaults to `DISCORD_CHANNEL_MESSAGE_PLACEHOLDER`.
+
+    Returns:
+    - None. Raises if the prompt was not sent, leaving it in the chat box.
+    """
+    selectors = registry()
+    matched = await page.evaluate(
+        _FAST_SUBMIT_JS,
+        {
+            "placeholder": placeholder or os.environ.get("DISCORD_CHANNEL_MESSAGE_PLACEHOLDER"),
+            "command": command,
+            "prompt": prompt,
+            "autocompleteSelectors": selectors.ordered("autocomplete_entry"),
+            "pillSelectors": selectors.ordered("option_pill"),
+            "timeout": timeout,
+        },
+    )
+    selectors.use("autocomplete_entry", matched["autocompleteSelector"])
+    selectors.use("option_pill", matched["pillSelector"])
+    await page.keyboard.press("Enter")
+    # The client empties the chat box once the command is sent
+    await page.wait_for_selector(matched["pillSelector"], state="detached", timeout=timeout)
+    logger.info(f"Successfully submitted prompt: {prompt}")
+
+
+async def clear_chat_box(page, placeholder: str = None):
+    """
+    Function to empty the chat box, e.g. after a failed submission.
+
+    Parameters:
+    - page: The page object representing the current browser context.
+    - placeholder (str): Accessible name of the chat box. Defaults to `DISCORD_CHANNEL_MESSAGE_PLACEHOLDER`.
+
+    Returns:
+    - None
+    """
+    await page.keyboard.press("Escape")
+    await chat_box(page, placeholder).click()
+    # A command takes two passes: its option pill, then the command itself
+    for _ in range(2):
+        await page.keyboard.press("ControlOrMeta+A")
+        await page.keyboard.press("Backspace")
+
+
+async def submit_prompt(
+    page, command: str, prompt: str, fast: bool = False, placeholder: str = None
+):
+    """
+    Function to submit a prompt, trying the in-page fast path first when enabled.
+
+    Parameters:
+    - page: The page object representing the current browser context.
+    - command (str): The slash command, e.g. ``/imagine``.
+    - prompt (str): The prompt text.
+    - fast (bool): Try `fast_submit_command` before the UI path.
+    - placeholder (str): Accessible name of the chat box. Defaults to `DISCORD_CHANNEL_MESSAGE_PLACEHOLDER`.
+
+    Returns:
+    - None
+    """
+    if fast:
+        try:
+            await fast_submit_command(page, command, prompt, placeholder=placeholder)
+            return
+        except Exception as e:
+            logger.warning(f"Fast submit failed, falling back to the UI path: {e}")
+            # Whatever the fast path typed would be sent along with the prompt
+            await clear_chat_box(page, placeholder)
+
+    logger.info("Entering the specified bot command.")
+    await send_bot_command(page, command, placeholder)
+    await asyncio.sleep(random.randint(1, 5))
+
+    logger.info("Submit command.")
+    await generate_prompt_and_submit_command(page, prompt)
+    await asyncio.sleep(random.randint(1, 5))
+
+
 def gpt3_midjourney_prompt(
     prompt: str,
     engine="text-davinci-003",
@@ -238,6 +386,9 @@ def gpt3_midjourney_prompt(
 
     prompt = prompt.encode(encoding="ASCII", errors="ignore").decode()
 
+    # Only needed here; importing it at module load slows down every start.
+    import openai
+
     try:
         response = openai.Completion.create(
             engine=engine,
@@ -266,237 +417,338 @@ def gpt3_midjourney_prompt(
         raise e
 
 
-async def wait_and_select_upscale_options(page, number_of_images: int = 1):
+@dataclass
+class ChannelMessage:
     """
-    Function to wait for and select upscale options.
+    Compact snapshot of one channel message, as returned by `read_messages`.
+
+    Attributes:
+    - id (str): DOM id of the message list item (``chat-messages-<channel>-<message>``).
+    - text (str): The rendered text of the message.
+    - buttons (list[str]): Labels of the buttons attached to the message.
+    - attachments (list[str]): Hrefs of the original image links.
+    """
+
+    id: str
+    text: str
+    buttons: list[str] = field(default_factory=list)
+    attachments: list[str] = field(default_factory=list)
+
+    @property
+    def message_id(self) -> str:
+        """The Discord snowflake of the message."""
+        return self.id.rsplit("-", 1)[-1]
+
+
+# Runs in the page. Walks forward from `afterId` through the message list
+# siblings so only new messages are touched; falls back to the trailing
+# `tail` messages when there is no cursor or the anchor is no longer rendered.
+_READ_MESSAGES_JS = """
+({messageSelector, linkSelector, afterId, tail}) => {
+    const snapshot = (node) => ({
+        id: node.id,
+        text: node.innerText || "",
+        buttons: Array.from(node.querySelectorAll("button"), (b) => (b.innerText || "").trim())
+            .filter(Boolean),
+        attachments: Array.from(node.querySelectorAll(linkSelector), (a) => a.href),
+    });
+    const anchor = afterId ? document.getElementById(afterId) : null;
+    if (anchor) {
+        const out = [];
+        for (let node = anchor.nextElementSibling; node; node = node.nextElementSibling) {
+            if (node.matches(messageSelector)) out.push(snapshot(node));
+        }
+        return out;
+    }
+    const nodes = document.querySelectorAll(messageSelector);
+    return Array.from(nodes).slice(Math.max(nodes.length - tail, 0)).map(snapshot);
+}
+"""
+
+
+async def read_messages(page, after_id: str = None, tail: int = 1) -> list[ChannelMessage]:
+    """
+    Function to read channel messages in a single in-page evaluation.
 
     Parameters:
-    - page: The page to operate on.
+    - page: The page object representing the current browser context.
+    - after_id (str): DOM id of the last message already seen. Only messages after it are returned.
+    - tail (int): Number of trailing messages to return when `after_id` is not given or not rendered.
 
     Returns:
-    - None
+    - list[ChannelMessage]: The messages, oldest first.
+    """
+    raw = await page.evaluate(
+        _READ_MESSAGES_JS,
+        {
+            "messageSelector": registry().get("message_item"),
+            "linkSelector": registry().get("image_link"),
+            "afterId": after_id,
+            "tail": tail,
+        },
+    )
+    return [ChannelMessage(**item) for item in raw]
+
+
+class MessageCursor:
+    """
+    Position in the channel history, kept on the Python side so each poll
+    only transfers messages posted since the previous one.
     """
-    try:
-        # prompt_text = prompt_text.lower()
-        # Repeat until upscale options are found
-        timeout = int(os.environ.get("WAIT_FOR_UPSCALE_TIMEOUT", 120))
-        while True:
-            last_message = await get_last_message(page)
-
-            # Check for 'U1' in the last message
-            if "U1" in last_message:
-                logger.info(
-                    "Found upscale options. Attempting to upscale all generated images."
-                )
 
-                random_selection = random.sample(
-                    ["U1", "U2", "U3", "U4"], number_of_images
-                )
+    def __init__(self, page, last_id: str = None):
+        self.page = page
+        self.last_id = last_id
 
-                try:
-                    for selection in random_selection:
-                        await select_upscale_option(page, selection)
-                        await asyncio.sleep(random.randint(5, 10))
-                        # await select_upscale_option(page, "U2")
-                        # time.sleep(random.randint(3, 5))
-                        # await select_upscale_option(page, "U3")
-                        # time.sleep(random.randint(3, 5))
-                        # await select_upscale_option(page, "U4")
-                        # time.sleep(random.randint(3, 5))
-                except Exception as e:
-                    logger.error(
-                        f"An error occurred while selecting upscale options: {e}"
-                    )
-                    raise e
+    async def peek(self, tail: int = 1) -> list[ChannelMessage]:
+        """Return the messages after the cursor without moving it."""
+        return await read_messages(self.page, self.last_id, tail)
 
-                break  # Exit the loop when upscale options have been found and selected
+    async def poll(self, tail: int = 1) -> list[ChannelMessage]:
+        """Return the messages after the cursor and move the cursor past them."""
+        messages = await self.peek(tail)
+        if messages:
+            self.last_id = messages[-1].id
+        return messages
 
-            else:
-                logger.info("Upscale options not yet available, waiting...")
-                await asyncio.sleep(10)
-                timeout -= 10
-                if timeout <= 0:
-                    raise TimeoutError("Timeout while waiting for upscale options.")
+    def advance(self, message_id: str):
+        """Move the cursor to `message_id`."""
+        self.last_id = message_id
 
-    except Exception as e:
-        logger.error(f"An error occurred while finding the last message: {e}")
-        raise e
+    async def seek_end(self):
+        """Move the cursor to the newest message in the channel."""
+        messages = await read_messages(self.page, tail=1)
+        self.last_id = messages[-1].id if messages else None
 
 
-async def wait_and_select_super_upscale_options(page, number_of_images: int = 1):
+async def select_upscale_option(page, option_text: str, message_id: str = None):
     """
-    Function to wait for and select upscale options.
+    Function to select an upscale option based on the provided text.
 
     Parameters:
-    - page: The page to operate on.
+    - page: The page object representing the current browser context.
+    - option_text (str): The text of the upscale option to select.
+    - message_id (str): DOM id of the message holding the button. Defaults to the last matching button on the page.
 
     Returns:
     - None
     """
     try:
-        # Repeat until upscale options are found
-        timeout = int(os.environ.get("WAIT_FOR_UPSCALE_TIMEOUT", 120))
-        while True:
-            last_message = await get_last_message(page)
-
-            # Check for 'Upscale' in the last message
-            if "Upscale (Subtle)" in last_message:
-                logger.info(
-                    "Found upscale options. Attempting to upscale generated images."
-                )
-
-                random_selection = random.sample(["Upscale (Subtle)"], number_of_images)
-
-                try:
-                    for selection in random_selection:
-                        await select_upscale_option(page, selection)
-                        await asyncio.sleep(random.randint(5, 10))
-                except Exception as e:
-                    logger.error(
-                        f"An error occurred while selecting upscale options: {e}"
-                    )
-                    raise e
-
-                break  # Exit the loop when upscale options have been found and selected
+        scope = f"[id='{message_id}'] " if message_id else ""
+        # Emoji-only buttons (reroll, pan) render their label as an image
+        upscale_option = page.locator(
+            f"{scope}button:has-text('{option_text}'), "
+            f"{scope}button:has(img[alt='{option_text}'])"
+        ).locator("nth=-1")
+        if not upscale_option:
+            logger.error(f"No upscale option found with text: {option_text}.")
+            raise ValueError(f"No upscale option found with text: {option_text}.")
 
-            else:
-                logger.info("Upscale options not yet available, waiting...")
-                await asyncio.sleep(10)
-                timeout -= 10
-                if timeout <= 0:
-                    raise TimeoutError("Timeout while waiting for upscale options.")
+        await upscale_option.click()
+        logger.info(f"Successfully clicked {option_text} upscale option.")
 
     except Exception as e:
-        logger.error(f"An error occurred while finding the last message: {e}")
+        logger.error(f"An error occurred while selecting the upscale option: {e}")
         raise e
 
 
-async def get_last_message(page) -> str:
+def is_confirmation(message: ChannelMessage) -> bool:
+    """Whether a message is the bot asking to confirm a permutation or ``--repeat`` submission."""
+    labels = {label.lower() for label in message.buttons}
+    return "yes" in labels and "show prompts" in labels
+
+
+async def confirm_submission(
+    page, after_id: str = None, timeout: float = 60, poll_interval: float = 1.0
+) -> ChannelMessage:
     """
-    Function to get the last message from the provided page.
+    Function to answer Yes when the bot asks to confirm a submission that creates several jobs.
 
     Parameters:
-    - page: The page from which to fetch the last message.
+    - page: The page object representing the current browser context.
+    - after_id (str): DOM id of the last message before the submission.
+    - timeout (float): Seconds to wait for the confirmation.
+    - poll_interval (float): Seconds between two reads of the channel.
 
     Returns:
-    - str: The text of the last message.
+    - ChannelMessage: The confirmation message. `TimeoutError` if it did not appear.
     """
-    try:
-        messages = await page.query_selector_all(".messageListItem__5126c")
-        if not messages:
-            logger.error("No messages found on the page.")
-            raise ValueError("No messages found on the page.")
+    deadline = time.monotonic() + timeout
+    while True:
+        for message in await read_messages(page, after_id, tail=5):
+            if is_confirmation(message):
+                await select_upscale_option(page, "Yes", message.id)
+                return message
+        if time.monotonic() >= deadline:
+            raise TimeoutError("Timeout while waiting for the bot to ask for confirmation.")
+        await asyncio.sleep(poll_interval)
 
-        last_message = messages[-1]
-        last_message_text = await last_message.evaluate("(node) => node.innerText")
 
-        if not last_message_text:
-            logger.error("Last message text cannot be empty.")
-            raise ValueError("Last message text cannot be empty.")
+class DownloadStatus(str, Enum):
+    """Final state of a download-wait stage."""
 
-        last_message_text = str(last_message_text)
-        # Commented out for now, as it's not needed.
-        # logger.info(f"Last message: {last_message_text}")
-        return last_message_text
+    DOWNLOADED = "downloaded"
+    TIMED_OUT = "timed_out"
+    ERROR = "error"
 
-    except Exception as e:
-        logger.error(f"Error occurred: {e} while getting the last message.")
-        raise e
 
+@dataclass
+class DownloadResult:
+    """
+    Outcome of waiting for a job's images and downloading them.
 
-async def select_upscale_option(page, option_text: str):
+    Attributes:
+    - status (DownloadStatus): How the stage ended.
+    - paths (list[str]): Files written to disk, in message order.
+    - error (Exception | None): The failure, when status is not DOWNLOADED.
+    - bytes_saved (int): Bytes not transferred thanks to the download profile, where the original size is known.
     """
-    Function to select an upscale option based on the provided text.
+
+    status: DownloadStatus
+    paths: list[str] = field(default_factory=list)
+    error: Exception | None = None
+    bytes_saved: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.status is DownloadStatus.DOWNLOADED
+
+
+def build_image_name(
+    prompt_text: str,
+    index: int,
+    number_of_images: int = 1,
+    sequence_number: int = None,
+) -> str:
+    """
+    Function to build the file name (without extension) of a downloaded image.
 
     Parameters:
-    - page: The page object representing the current browser context.
-    - option_text (str): The text of the upscale option to select.
+    - prompt_text (str): The prompt that produced the image.
+    - index (int): Zero-based position of the image within the job.
+    - number_of_images (int): Number of images downloaded for the job.
+    - sequence_number (int): Position of the prompt in the batch, if any.
 
     Returns:
-    - None
+    - str: The file name.
     """
+    if not sequence_number:
+        name = re.sub(r"[^a-zA-Z0-9\s]", "", prompt_text)
+        name = name.replace(" ", "_").replace(",", "_")
+        name = re.sub(r'[\<>:"/|?*]', "", name)
+        name = name.replace("\n\n", "_")
+        return name[:50].rstrip(". ") + str(uuid.uuid1())
+    if number_of_images > 1:
+        return f"pic_{sequence_number}_{index + 1}_of_{number_of_images}"
+    return f"pic_{sequence_number}"
+
+
+def _content_length(url: str) -> int:
+    """Return the size of the resource at `url` without downloading it, or None."""
     try:
-        upscale_option = page.locator(f"button:has-text('{option_text}')").locator(
-            "nth=-1"
-        )
-        if not upscale_option:
-            logger.error(f"No upscale option found with text: {option_text}.")
-            raise ValueError(f"No upscale option found with text: {option_text}.")
+        response = requests.head(url, allow_redirects=True, timeout=15)
+        return int(response.headers["Content-Length"]) if response.ok else None
+    except (requests.RequestException, KeyError, ValueError):
+        return None
 
-        await upscale_option.click()
-        logger.info(f"Successfully clicked {option_text} upscale option.")
 
-    except Exception as e:
-        logger.error(f"An error occurred while selecting the upscale option: {e}")
-        raise e
+def _save_image(
+    url: str, storage: ShardedStorage, name: str, profile: DownloadProfile = None
+) -> tuple[str, int, DownloadProfile, int]:
+    """
+    Stream an image from `url` into `storage`, as the rendition of `profile`
+    when it is available and the original otherwise. Runs in a worker thread.
 
+    Returns the key written, its size, the profile actually used and the size
+    of the original (None when it was downloaded or is unknown).
+    """
+    if profile and not profile.original:
+        variant = profile.variant_url(url)
+        try:
+            with requests.get(variant, stream=True, timeout=60) as download_response:
+                content_type = download_response.headers.get("Content-Type", "")
+                if download_response.ok and content_type.startswith("image/"):
+                    relative, size = storage.write_stream(
+                        f"{name}.{profile.extension}", download_response.raw
+                    )
+                    return relative, size, profile, _content_length(url)
+                logger.warning(
+                    f"{profile.name} rendition unavailable (HTTP {download_response.status_code}, "
+                    f"{content_type or 'no content type'}); downloading the original."
+                )
+        except requests.RequestException as e:
+            logger.warning(f"{profile.name} rendition failed ({e}); downloading the original.")
 
-async def download_upscaled_images(
-    page,
-    prompt_text: str,
-    number_of_images=1,
-    sequence_number: int = None,
-    output_dir: str = None,
-    timeout: int = 600,
-):
-    try:
-        messages = await page.query_selector_all(".messageListItem__5126c")
-        last_four_messages = messages[-number_of_images:]
+    with requests.get(url, stream=True, timeout=60) as download_response:
+        download_response.raise_for_status()
+        relative, size = storage.write_stream(f"{name}.png", download_response.raw)
+        return relative, size, DownloadProfile(), None
 
-        for message in last_four_messages:
-            message_text = await message.evaluate_handle("(node) => node.innerText")
-            message_text = str(message_text)
 
-        # Comment for cleaner logs
-        # logger.info("Message text: {}", message_text)
+def is_upscale_ready(message_text: str) -> bool:
+    """Whether a message is a finished upscale, with its follow-up buttons and Web link."""
+    return "Vary (Strong)" in message_text and "Web" in message_text
 
-        if "Vary (Strong)" in message_text and "Web" in message_text:
-            try:
-                image_elements = await page.query_selector_all(".originalLink_af017a")
-                last_four_images = image_elements[-number_of_images:]
-
-                for i, image in enumerate(last_four_images):
-                    src = await image.get_attribute("href")
-                    url = src
-                    if not sequence_number:
-                        response = re.sub(r"[^a-zA-Z0-9\s]", "", prompt_text)
-                        response = response.replace(" ", "_").replace(",", "_")
-                        response = re.sub(r'[\<>:"/|?*]', "", response)
-                        response = response.replace("\n\n", "_")
-                        response = response[:50].rstrip(". ") + str(uuid.uuid1())
-                    elif number_of_images > 1:
-                        response = (
-                            f"pic_{sequence_number}_{i + 1}_of_{number_of_images}"
-                        )
-                    else:
-                        response = f"pic_{sequence_number}"
-
-                    download_response = requests.get(url, stream=True)
-
-                    with open(
-                        f"{output_dir or "."}/{str(response)}.png", "wb"
-                    ) as out_file:
-                        shutil.copyfileobj(download_response.raw, out_file)
-                    del download_response
 
-            except Exception as e:
-                logger.info(f"An error occurred while downloading the images: {e}")
-
-        else:
-            if timeout <= 0:
-                raise TimeoutError("Timeout while waiting for images to be available.")
-            if timeout % 60 == 0:
-                logger.info(f"Images not yet available, waiting... Timeout after {timeout}")
-            
-            await asyncio.sleep(10)
-            await download_upscaled_images(
-                page,
-                prompt_text,
-                number_of_images,
-                sequence_number,
-                output_dir,
-                timeout - 10,
-            )
+async def save_message_images(
+    messages: list[ChannelMessage],
+    prompt_text: str,
+    storage: ShardedStorage,
+    paths: list[str],
+    limit: int = None,
+    sequence_number: int = None,
+    job_id: str = None,
+    parameters: dict = None,
+    profile: DownloadProfile = None,
+    name_suffix: str = "",
+) -> int:
+    """
+    Function to download the image attachments of finished messages and record them in the manifest.
 
-    except Exception as e:
-        logger.info(f"An error occurred while finding the last message: {e}")
+    Parameters:
+    - messages (list[ChannelMessage]): The messages, oldest first.
+    - prompt_text (str): The prompt that produced the images.
+    - storage (ShardedStorage): Where to write the images and record them.
+    - paths (list[str]): Receives the location of each image as soon as it is written.
+    - limit (int): Only download the last `limit` attachments.
+    - sequence_number (int): Position of the prompt in the batch, if any.
+    - job_id (str): Job identifier recorded in the manifest.
+    - parameters (dict): Job settings recorded in the manifest.
+    - profile (DownloadProfile): Rendition to download. Defaults to the original.
+    - name_suffix (str): Appended to each file name, to tell apart several downloads of one job.
+
+    Returns:
+    - int: Bytes saved by the download profile, where the original size is known.
+    """
+    sources = [
+        (message, url) for message in messages for url in message.attachments if url
+    ]
+    if limit:
+        sources = sources[-limit:]
+    bytes_saved = 0
+    for i, (message, url) in enumerate(sources):
+        name = build_image_name(prompt_text, i, len(sources), sequence_number)
+        relative, size, used, original_size = await asyncio.to_thread(
+            _save_image, url, storage, f"{name}{name_suffix}", profile
+        )
+        entry_parameters = dict(
+            parameters or {}, sequence_number=sequence_number, profile=used.name
+        )
+        if original_size is not None:
+            entry_parameters["original_bytes"] = original_size
+            bytes_saved += original_size - size
+        storage.record(
+            ManifestEntry(
+                job_id=job_id,
+                prompt=prompt_text,
+                path=relative,
+                source_url=url,
+                message_id=message.message_id,
+                parameters=entry_parameters,
+                bytes=size,
+            )
+        )
+        path = storage.location(relative)
+        paths.append(path)
+        logger.info(f"Downloaded image to {path} ({used.name}, {size} bytes)")
+    return bytes_saved
@@ -0,0 +1,202 @@
+"""
+Per-prompt workflows: small trees of bot actions run on the replies of a job.
+
+Each node acts on the replies produced by its parent (the prompt's grid for
+nodes without ``after``) and may produce replies of its own for its
+children. Workflows other than ``default`` are read from `workflows.json`:
+
+    {
+      "strong_variations": [
+        {"id": "pick", "action": "upscale", "pick": [1]},
+        {"id": "vary", "after": "pick", "action": "vary_strong"},
+        {"id": "upscale", "after": "vary", "action": "upscale", "count": 2},
+        {"id": "download", "after": "upscale", "action": "download"}
+      ]
+    }
+
+Node fields:
+- id: Name of the node, also reported as the job's stage.
+- action: One of `ACTIONS`.
+- after: The parent node. Omitted for nodes acting on the prompt's grid.
+- count / pick: For ``upscale`` and ``variations``, how many of the four
+  images to pick at random, or which ones (1-4).
+- limit: Act on at most this many of the parent's replies.
+
+Branches of one node run side by side. The bot's replies only say which
+prompt and which kind (grid or upscale) they are, not which click asked for
+them, so nodes producing the same kind must be on one line of descent;
+otherwise two branches would wait for interchangeable replies at once.
+"""
+
+import json
+import os
+from dataclasses import dataclass, field
+
+from router import GRID, UPSCALE
+
+WORKFLOWS_FILE = "workflows.json"
+DEFAULT_WORKFLOW = "default"
+
+# action: (button label, kind of reply it acts on, kind of reply it produces)
+ACTIONS = {
+    "upscale": ("U", GRID, UPSCALE),
+    "variations": ("V", GRID, GRID),
+    "reroll": ("🔄", GRID, GRID),
+    "upscale_subtle": ("Upscale (Subtle)", UPSCALE, UPSCALE),
+    "upscale_creative": ("Upscale (Creative)", UPSCALE, UPSCALE),
+    "vary_subtle": ("Vary (Subtle)", UPSCALE, GRID),
+    "vary_strong": ("Vary (Strong)", UPSCALE, GRID),
+    "zoom_out_2x": ("Zoom Out 2x", UPSCALE, GRID),
+    "zoom_out_1.5x": ("Zoom Out 1.5x", UPSCALE, GRID),
+    "pan_left": ("⬅️", UPSCALE, GRID),
+    "pan_right": ("➡️", UPSCALE, GRID),
+    "pan_up": ("⬆️", UPSCALE, GRID),
+    "pan_down": ("⬇️", UPSCALE, GRID),
+    "download": (None, None, None),
+}
+
+# Actions that click one of the four numbered buttons under a grid
+NUMBERED_ACTIONS = ("upscale", "variations")
+
+
+@dataclass
+class WorkflowNode:
+    """One action of a workflow. See the module docstring for the fields."""
+
+    id: str
+    action: str
+    after: str = None
+    count: int = 1
+    pick: list[int] = None
+    limit: int = None
+
+    @property
+    def produces(self) -> str:
+        """Kind of reply the action produces, or None for ``download``."""
+        return ACTIONS[self.action][2]
+
+    def buttons(self, choose, rejected: set[int] = frozenset()) -> list[str]:
+        """
+        Return the labels of the buttons to click on one parent reply.
+        `choose(population, k)` picks the random images (`random.sample`);
+        images in `rejected` are never picked.
+        """
+        prefix = ACTIONS[self.action][0]
+        if self.action not in NUMBERED_ACTIONS:
+            return [prefix]
+        if self.pick:
+            numbers = [n for n in self.pick if n not in rejected]
+        else:
+            population = [n for n in (1, 2, 3, 4) if n not in rejected]
+            numbers = choose(population, min(self.count, len(population)))
+        return [f"{prefix}{n}" for n in numbers]
+
+
+@dataclass
+class Workflow:
+    """A named tree of `WorkflowNode`, parents listed before their children."""
+
+    name: str
+    nodes: list[WorkflowNode] = field(default_factory=list)
+
+    @property
+    def downloads(self) -> list[WorkflowNode]:
+        return [node for node in self.nodes if node.action == "download"]
+
+
+def parse_workflow(name: str, raw: list[dict]) -> Workflow:
+    """
+    Function to build and check a workflow from its JSON form.
+
+    Parameters:
+    - name (str): Name of the workflow.
+    - raw (list[dict]): The nodes, parents first.
+
+    Returns:
+    - Workflow: The workflow. `ValueError` describes the first problem found.
+    """
+    nodes: dict[str, WorkflowNode] = {}
+    # Ids of each node and its ancestors
+    lineage: dict[str, set[str]] = {}
+    for item in raw:
+        try:
+            node = WorkflowNode(**item)
+        except TypeError as e:
+            raise ValueError(f"workflow {name}: {e}") from None
+        where = f"workflow {name}, node {node.id!r}"
+        if not node.id or node.id in nodes:
+            raise ValueError(f"{where}: ids must be unique and not empty")
+        if node.action not in ACTIONS:
+            raise ValueError(f"{where}: unknown action {node.action!r}")
+        if node.after is not None and node.after not in nodes:
+            raise ValueError(f"{where}: parent {node.after!r} must be declared before it")
+
+        parent_output = nodes[node.after].produces if node.after else GRID
+        if parent_output is None:
+            raise ValueError(f"{where}: a download has no replies to act on")
+        needs = ACTIONS[node.action][1]
+        if needs is not None and needs != parent_output:
+            raise ValueError(
+                f"{where}: {node.action} acts on {needs} replies but its parent produces {parent_output}"
+            )
+        if node.pick is not None and (
+            not node.pick or any(n not in (1, 2, 3, 4) for n in node.pick)
+        ):
+            raise ValueError(f"{where}: pick must list images 1 to 4")
+        if not 1 <= node.count <= 4:
+            raise ValueError(f"{where}: count must be between 1 and 4")
+        lineage[node.id] = {node.id} | (lineage[node.after] if node.after else set())
+        for other in nodes.values():
+            if (
+                node.produces is not None
+                and other.produces == node.produces
+                and other.id not in lineage[node.id]
+            ):
+                raise ValueError(
+                    f"{where}: {other.id!r} on another branch also produces {node.produces} "
+                    "replies, which could not be told apart"
+                )
+        nodes[node.id] = node
+    if not nodes:
+        raise ValueError(f"workflow {name} has no nodes")
+    return Workflow(name, list(nodes.values()))
+
+
+def default_workflow(number_of_images: int = 1, upscale: bool = False) -> Workflow:
+    """
+    Function to build the workflow of a plain batch: upscale `number_of_images`
+    random images of the grid, optionally run ``Upscale (Subtle)`` on each,
+    and download the results.
+
+    Parameters:
+    - number_of_images (int): Images of the grid to upscale.
+    - upscale (bool): Run ``Upscale (Subtle)`` and download its results instead.
+
+    Returns:
+    - Workflow: The workflow.
+    """
+    nodes = [WorkflowNode("upscale", "upscale", count=number_of_images)]
+    if upscale:
+        nodes.append(WorkflowNode("super_upscale", "upscale_subtle", after="upscale"))
+    nodes.append(WorkflowNode("download", "download", after=nodes[-1].id))
+    return Workflow(DEFAULT_WORKFLOW, nodes)
+
+
+def load_workflows(path: str = None) -> dict[str, Workflow]:
+    """
+    Function to read the named workflows.
+
+    Parameters:
+    - path (str): The file to read. Defaults to `WORKFLOWS_FILE` env var, then `workflows.json`.
+
+    Returns:
+    - dict[str, Workflow]: The workflows by name; empty when there is no file.
+    """
+    path = path or os.environ.get("WORKFLOWS_FILE") or WORKFLOWS_FILE
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if DEFAULT_WORKFLOW in data:
+        raise ValueError(f"{path}: the name {DEFAULT_WORKFLOW!r} is reserved")
+    return {name: parse_workflow(name, raw) for name, raw in data.items()}